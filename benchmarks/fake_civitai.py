@@ -0,0 +1,127 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# fake_civitai.py — FocusCatalog benchmarks
+# Server HTTP locale che imita le API Civitai usate da FocusCatalog
+# (/models/{id}, /model-versions/{id}, /model-versions/by-hash/{sha}) e serve
+# immagini JPEG, con latenza configurabile. Si usa con CIVITAI_API_BASE.
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+
+class FakeCivitai:
+    """Avvia il server su 127.0.0.1 (porta libera) in un thread. `hits` conta le richieste per rotta."""
+
+    def __init__(self, latency: float = 0.02, image_size=(832, 1216)):
+        self.latency = latency
+        buf = io.BytesIO()
+        Image.new("RGB", image_size, (90, 120, 160)).save(buf, "JPEG", quality=90)
+        self.image = buf.getvalue()
+        self.hits = {"model": 0, "version": 0, "by_hash": 0, "image": 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.base = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        self.api_base = self.base + "/api/v1"
+        self._thread = None
+
+    def start(self) -> "FakeCivitai":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-civitai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _hit(self, kind: str):
+        with self._lock:
+            self.hits[kind] += 1
+
+    # ------------------------ dati ------------------------
+    def version(self, vid: int, mid: int) -> dict:
+        return {"id": vid, "modelId": mid, "name": f"v{vid % 7 + 1}.0", "model": {"name": f"Synthetic Model {mid}"},
+                "trainedWords": [f"trigger{mid}", f"style{vid % 13}"],
+                "images": [{"url": f"{self.base}/images/{vid}_{k}.jpeg"} for k in range(4)]}
+
+    def model(self, mid: int) -> dict:
+        return {"id": mid, "name": f"Synthetic Model {mid}",
+                "modelVersions": [self.version(mid * 10 + k, mid) for k in range(2)]}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, ctype: str):
+                etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    status, body = 304, b""
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                path = self.path.split("?", 1)[0]
+                m = re.fullmatch(r"/api/v1/models/(\d+)", path)
+                if m:
+                    fake._hit("model")
+                    return self._send(200, json.dumps(fake.model(int(m.group(1)))).encode(), "application/json")
+                m = re.fullmatch(r"/api/v1/model-versions/by-hash/([0-9A-Fa-f]+)", path)
+                if m:
+                    fake._hit("by_hash")
+                    sha = m.group(1).upper()
+                    if int(sha[:2], 16) % 2:  # metà degli hash è "sconosciuta"
+                        return self._send(404, b'{"error":"not found"}', "application/json")
+                    mid = int(sha[2:8], 16)
+                    return self._send(200, json.dumps(fake.version(mid * 10, mid)).encode(), "application/json")
+                m = re.fullmatch(r"/api/v1/model-versions/(\d+)", path)
+                if m:
+                    fake._hit("version")
+                    vid = int(m.group(1))
+                    return self._send(200, json.dumps(fake.version(vid, vid // 10)).encode(), "application/json")
+                if path.startswith("/images/"):
+                    fake._hit("image")
+                    return self._send(200, fake.image, "image/jpeg")
+                self._send(404, b"{}", "application/json")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    srv = FakeCivitai().start()
+    print(f"CIVITAI_API_BASE={srv.api_base}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.stop()
@@ -0,0 +1,351 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# run.py — FocusCatalog benchmarks
+# Misure end-to-end su librerie sintetiche (synthlib.py) e Civitai finto
+# (fake_civitai.py): avvio a freddo (python -X importtime), scansione a freddo e
+# a caldo, miniature, load_existing_index, latenze di /api/index,
+# /api/set_link_and_fetch e /api/refresh con client concorrenti. Il risultato è
+# un JSON da confrontare tra versioni.
+#
+#   python benchmarks/run.py --models 1000 10000 --output bench.json
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+HERE = Path(__file__).resolve().parent
+REPO = HERE.parent
+sys.path[:0] = [str(REPO), str(HERE)]
+
+from fake_civitai import FakeCivitai  # noqa: E402
+import synthlib  # noqa: E402
+
+SCHEMA = 1
+
+
+# ------------------------ misure ------------------------
+def latency_stats(samples: List[float]) -> Dict[str, Any]:
+    """Statistiche in millisecondi di una lista di durate in secondi."""
+    if not samples:
+        return {"count": 0}
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))] * 1000
+    return {"count": len(s), "mean_ms": round(sum(s) / len(s) * 1000, 2), "p50_ms": round(pick(0.5), 2),
+            "p90_ms": round(pick(0.9), 2), "p99_ms": round(pick(0.99), 2), "max_ms": round(s[-1] * 1000, 2)}
+
+
+def timed(fn: Callable, *args, **kw) -> float:
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn(*args, **kw)
+    return time.perf_counter() - t0
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_info() -> Dict[str, Optional[str]]:
+    def run(*cmd):
+        try:
+            return subprocess.run(["git", *cmd], cwd=REPO, capture_output=True, text=True, timeout=10).stdout.strip() or None
+        except Exception:
+            return None
+    return {"commit": run("rev-parse", "HEAD"), "describe": run("describe", "--always", "--dirty")}
+
+
+# ------------------------ avvio ------------------------
+def _children(rows: List[tuple]) -> List[tuple]:
+    """Import diretti dell'ultimo modulo di -X importtime (righe in post-ordine:
+    i figli precedono il padre e seguono l'import di primo livello precedente)."""
+    start = max((i for i, r in enumerate(rows[:-1]) if r[1] == 0), default=-1) + 1
+    return [r for r in rows[start:-1] if r[1] == 1]
+
+
+def bench_startup(modules=("server", "scan_models"), repeat: int = 3) -> Dict[str, Any]:
+    """Import a freddo di ogni modulo in un interprete nuovo (python -X importtime):
+    mediana in ms del tempo cumulativo e i cinque import diretti più costosi dell'ultima prova."""
+    res: Dict[str, Any] = {}
+    for mod in modules:
+        totals, rows = [], []
+        for _ in range(repeat):
+            err = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {mod}"], cwd=str(REPO),
+                                 capture_output=True, text=True).stderr
+            rows = []
+            for line in err.splitlines():
+                parts = line.split("|")
+                if line.startswith("import time:") and len(parts) == 3 and parts[1].strip().isdigit():
+                    depth = (len(parts[2]) - len(parts[2].lstrip()) - 1) // 2
+                    rows.append((int(parts[1]), depth, parts[2].strip()))
+            if rows:
+                totals.append(rows[-1][0] / 1000)
+        res[mod] = {"import_ms": round(sorted(totals)[len(totals) // 2], 1) if totals else None,
+                    "top": [{"module": name, "ms": round(us / 1000, 1)}
+                            for us, depth, name in sorted(_children(rows), reverse=True)][:5]}
+    return res
+
+
+# ------------------------ scanner ------------------------
+def bench_scan(roots: List[str], out: Path, jobs: int) -> Dict[str, Any]:
+    import scan_models
+    argv = ["--roots", *roots, "--out", str(out), "--jobs", str(jobs)]
+    res: Dict[str, Any] = {}
+    for run in ("cold", "warm"):
+        secs = timed(scan_models.main, argv)
+        # tempi per fase e contatori scritti dallo scanner stesso
+        summary = json.loads((out / scan_models.METRICS_NAME).read_text(encoding="utf-8"))
+        res[run] = {"seconds": round(secs, 3), "phases_s": summary.get("phases_s"), "counters": summary.get("counters")}
+    n = len(json.loads((out / "index.json").read_text(encoding="utf-8")).get("items", []))
+    for run in ("cold", "warm"):
+        res[run]["models_per_s"] = round(n / res[run]["seconds"], 1) if res[run]["seconds"] else None
+    return {"models": n, **res}
+
+
+def bench_thumbs(lib: Path, work: Path, jobs: int) -> Dict[str, Any]:
+    """Solo generazione miniature (+ varianti) di tutte le preview, in una cartella vuota."""
+    import image_variants
+    import scan_models
+    dest = work / "thumbs"
+    shutil.rmtree(dest, ignore_errors=True)
+    formats = image_variants.variant_formats()
+    srcs = [p for p in lib.rglob("*") if p.suffix.lower() in scan_models.IMG_EXT]
+    thumb_jobs = [(p, dest / str(i) / p.name, (640, 640), formats) for i, p in enumerate(srcs)]
+    t0 = time.perf_counter()
+    built = scan_models.run_thumb_jobs(thumb_jobs, jobs)
+    secs = time.perf_counter() - t0
+    return {"images": len(srcs), "built": sum(1 for ok in built.values() if ok), "formats": list(formats),
+            "seconds": round(secs, 3), "images_per_s": round(len(srcs) / secs, 1) if secs else None}
+
+
+def bench_load_index(out: Path, repeat: int = 3) -> Dict[str, Any]:
+    import scan_models
+    index_path = out / "index.json"
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        scan_models.load_existing_index(index_path)
+        samples.append(time.perf_counter() - t0)
+    return {"index_bytes": index_path.stat().st_size, **latency_stats(samples)}
+
+
+# ------------------------ server ------------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServerProc:
+    """server.py in un sottoprocesso (come in produzione), con Civitai finto."""
+
+    def __init__(self, out: Path, roots: List[str], api_base: str, log_path: Path, extra: List[str] = ()):
+        self.port = free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        env = dict(os.environ, CIVITAI_API_BASE=api_base, PYTHONIOENCODING="utf-8")
+        self._log = open(log_path, "wb")
+        self.proc = subprocess.Popen([sys.executable, str(REPO / "server.py"), "--out", str(out),
+                                      "--port", str(self.port), "--roots", *roots, *extra],
+                                     cwd=str(REPO), env=env, stdout=self._log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, session, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError("server.py terminato all'avvio (vedi server.log)")
+            try:
+                if session.get(self.base + "/api/ping", timeout=1).ok:
+                    return
+            except Exception:
+                time.sleep(0.2)
+        raise RuntimeError("server.py non risponde")
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self._log.close()
+
+
+def hammer(call: Callable[[int], int], total: int, clients: int) -> Dict[str, Any]:
+    """Esegue call(i) per i in range(total) con `clients` thread; latenze e status."""
+    statuses: Dict[str, int] = {}
+
+    def one(i):
+        t0 = time.perf_counter()
+        status = call(i)
+        return time.perf_counter() - t0, status
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(one, range(total)))
+    wall = time.perf_counter() - t0
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {"clients": clients, "wall_s": round(wall, 3), "rps": round(total / wall, 1) if wall else None,
+            "status": statuses, **latency_stats([d for d, _ in results])}
+
+
+def bench_server(out: Path, roots: List[str], fake: FakeCivitai, work: Path,
+                 clients: int, requests_n: int, links: int, server_args: List[str] = ()) -> Dict[str, Any]:
+    import requests
+    srv = ServerProc(out, roots, fake.api_base, work / "server.log", extra=server_args)
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=clients * 2))
+    try:
+        srv.wait_ready(session)
+        res: Dict[str, Any] = {}
+        res["index"] = hammer(lambda i: session.get(srv.base + "/api/index").status_code, requests_n, clients)
+        etag = session.get(srv.base + "/api/index").headers.get("ETag", "")
+        res["index_304"] = hammer(lambda i: session.get(srv.base + "/api/index",
+                                                        headers={"If-None-Match": etag}).status_code,
+                                  requests_n, clients)
+
+        slugs = [it["slug"] for it in session.get(srv.base + "/api/index").json().get("items", [])][:links]
+
+        def link(i):
+            mid = 1000 + i
+            return session.post(srv.base + "/api/set_link_and_fetch", json={
+                "slug": slugs[i], "civitai_url": f"https://civitai.com/models/{mid}?modelVersionId={mid * 10}"},
+                timeout=120).status_code
+        res["set_link_and_fetch"] = hammer(link, len(slugs), min(clients, max(1, len(slugs))))
+
+        # Più client chiedono il refresh insieme: uno avvia il job, gli altri lo riusano
+        job_urls: List[str] = []
+
+        def refresh(i):
+            r = session.post(srv.base + "/api/refresh", timeout=60)
+            if r.status_code == 202:
+                job_urls.append(r.json().get("status") or "")
+            return r.status_code
+        t0 = time.perf_counter()
+        res["refresh"] = hammer(refresh, clients, clients)
+        status_url = next((u for u in job_urls if u), None)
+        state = None
+        while status_url:
+            state = session.get(srv.base + status_url).json().get("state")
+            if state != "running":
+                break
+            time.sleep(0.2)
+        res["refresh"]["scan_seconds"] = round(time.perf_counter() - t0, 3)
+        res["refresh"]["scan_state"] = state
+        # refresh consecutivi senza modifiche: il costo fisso di ogni scansione
+        res["refresh_warm"] = hammer(lambda i: session.post(srv.base + "/api/refresh?wait=1", timeout=600).status_code,
+                                     5, 1)
+        return res
+    finally:
+        srv.stop()
+        session.close()
+
+
+# ------------------------ entry ------------------------
+def bench_library(n: int, args, work: Path, fake: FakeCivitai) -> Dict[str, Any]:
+    lib, out = work / f"lib_{n}", work / f"out_{n}"
+    shutil.rmtree(out, ignore_errors=True)
+    t0 = time.perf_counter()
+    if not lib.exists():
+        stats = synthlib.generate(lib, n, seed=args.seed, preview_ratio=args.preview_ratio)
+    else:
+        stats = {"roots": [str(p) for p in sorted(lib.iterdir()) if p.is_dir()], "reused": True}
+    stats["generate_s"] = round(time.perf_counter() - t0, 3)
+    roots = stats["roots"]
+    run: Dict[str, Any] = {"models": n, "library": stats}
+    print(f"[bench] {n} modelli: scansione...", file=sys.stderr, flush=True)
+    run["scan"] = bench_scan(roots, out, args.jobs)
+    print(f"[bench] {n} modelli: miniature...", file=sys.stderr, flush=True)
+    run["thumbs"] = bench_thumbs(lib, work / f"tmp_{n}", args.jobs)
+    run["load_existing_index"] = bench_load_index(out)
+    if not args.skip_server:
+        print(f"[bench] {n} modelli: server...", file=sys.stderr, flush=True)
+        run["server"] = bench_server(out, roots, fake, work / f"tmp_{n}", args.clients, args.requests, args.links,
+                                     ["--server", args.server, "--workers", str(args.workers),
+                                      "--scan-mode", args.scan_mode])
+    return run
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark FocusCatalog su librerie sintetiche")
+    ap.add_argument("--models", type=int, nargs="+", default=[1000], help="Dimensioni della libreria (es. 1000 10000 100000)")
+    ap.add_argument("--preview-ratio", type=float, default=0.7, help="Frazione di modelli con preview locale")
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--jobs", type=int, default=0, help="Processi per le miniature (come scan_models.py)")
+    ap.add_argument("--clients", type=int, default=8, help="Client HTTP concorrenti")
+    ap.add_argument("--requests", type=int, default=200, help="Richieste /api/index per misura")
+    ap.add_argument("--links", type=int, default=16, help="Chiamate /api/set_link_and_fetch")
+    ap.add_argument("--latency-ms", type=float, default=20, help="Latenza del Civitai finto")
+    ap.add_argument("--server", choices=("dev", "waitress", "gunicorn"), default="dev", help="Modalità di server.py da misurare")
+    ap.add_argument("--workers", type=int, default=2, help="Processi worker con --server gunicorn")
+    ap.add_argument("--scan-mode", choices=("inprocess", "subprocess"), default="inprocess",
+                    help="Come server.py esegue le scansioni di /api/refresh")
+    ap.add_argument("--skip-server", action="store_true", help="Solo scanner (senza server.py)")
+    ap.add_argument("--work", help="Cartella di lavoro (le librerie già generate vengono riusate)")
+    ap.add_argument("--keep", action="store_true", help="Non cancella la cartella di lavoro temporanea")
+    ap.add_argument("--output", help="File JSON dei risultati (default: stdout)")
+    args = ap.parse_args(argv)
+
+    fake = FakeCivitai(latency=args.latency_ms / 1000).start()
+    os.environ["CIVITAI_API_BASE"] = fake.api_base  # prima di importare civitai_client
+    work = Path(args.work) if args.work else Path(tempfile.mkdtemp(prefix="focuscatalog-bench-"))
+    work.mkdir(parents=True, exist_ok=True)
+    startup = bench_startup()
+    try:
+        runs = [bench_library(n, args, work, fake) for n in args.models]
+    finally:
+        fake.stop()
+        if not args.work and not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    result = {
+        "schema": SCHEMA,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "git": git_info(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "work", "keep")},
+        "startup": startup,
+        "runs": runs,
+        "civitai_hits": fake.hits,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# synthlib.py — FocusCatalog benchmarks
+# Genera una libreria di modelli sintetica: file .safetensors sparsi (header
+# reale + buco fino alla dimensione voluta), nomi realistici con i suffissi hash
+# gestiti da nice_name, cartelle annidate e preview locali di dimensioni diverse.
+# Deterministica a parità di seed.
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import random
+import struct
+from pathlib import Path
+from typing import Any, Dict, List
+
+from PIL import Image
+
+WORDS = ("dream", "shaper", "juggernaut", "realistic", "vision", "epic", "photon", "cyber", "realism",
+         "anime", "pastel", "mix", "pony", "diffusion", "detail", "tweaker", "film", "grain", "neon",
+         "noir", "ghibli", "style", "portrait", "landscape", "fantasy", "ink", "sketch", "clay", "retro")
+VERSIONS = ("v1", "v2", "v3.5", "V6", "XL", "xl_v2", "Turbo", "Lightning", "final", "fp16", "pruned")
+CATEGORIES = {"checkpoints": ("sd15", "sdxl", "pony", "flux"),
+              "loras": ("style", "character", "concept", "clothing", "pose")}
+PREVIEW_SIZES = ((512, 768), (768, 512), (832, 1216), (1024, 1024), (1536, 2048))
+
+# Header safetensors minimi: bastano a model_header per riconoscere tipo e architettura
+LORA_TENSORS = ["lora_unet_down_blocks_0_attentions_0_proj_in.lora_up.weight",
+                "lora_te1_text_model_encoder_layers_0_mlp_fc1.lora_down.weight"]
+CKPT_TENSORS = ["model.diffusion_model.input_blocks.0.0.weight", "conditioner.embedders.1.model.ln_final.weight"]
+
+
+def model_name(rng: random.Random) -> str:
+    words = rng.sample(WORDS, rng.randint(1, 3))
+    name = "".join(w.capitalize() for w in words) if rng.random() < 0.5 else "_".join(words)
+    name += "_" + rng.choice(VERSIONS)
+    suffix = "{:08x}".format(rng.getrandbits(32))
+    # Suffissi hash nelle tre forme riconosciute da nice_name (o nessuno)
+    return rng.choice((name, f"{name} ({suffix})", f"{name} [{suffix}]", f"{name}.{suffix}"))
+
+
+def safetensors_header(tensors: List[str], meta: Dict[str, str]) -> bytes:
+    header = {t: {"dtype": "F16", "shape": [4, 4], "data_offsets": [i * 32, (i + 1) * 32]}
+              for i, t in enumerate(tensors)}
+    header["__metadata__"] = meta
+    raw = json.dumps(header).encode("utf-8")
+    return struct.pack("<Q", len(raw)) + raw
+
+
+def write_sparse(path: Path, head: bytes, size: int):
+    """Scrive l'header e porta il file a `size` byte senza allocarli (file sparso)."""
+    with open(path, "wb") as fh:
+        fh.write(head)
+        fh.truncate(max(size, len(head)))
+
+
+def preview_pool(rng: random.Random, count: int = 8) -> List[tuple]:
+    """Poche immagini già codificate (JPEG/PNG, dimensioni diverse) riusate per tutte le preview."""
+    pool = []
+    for i in range(count):
+        w, h = PREVIEW_SIZES[i % len(PREVIEW_SIZES)]
+        im = Image.new("RGB", (w, h), tuple(rng.randrange(256) for _ in range(3)))
+        for y in range(0, h, 64):  # un po' di struttura, altrimenti JPEG/PNG sono irrealisticamente piccoli
+            im.paste(tuple(rng.randrange(256) for _ in range(3)), (0, y, w, min(h, y + 32)))
+        buf = io.BytesIO()
+        ext = ".png" if i % 3 == 0 else ".jpg"
+        im.save(buf, "PNG" if ext == ".png" else "JPEG", quality=90)
+        pool.append((ext, buf.getvalue()))
+    return pool
+
+
+def generate(root: Path, n: int, seed: int = 1234, preview_ratio: float = 0.7, depth: int = 3,
+             min_mb: int = 20, max_mb: int = 7000) -> Dict[str, Any]:
+    """Crea n modelli sotto root/checkpoints e root/loras (30% / 70%).
+    Restituisce un riepilogo con radici, conteggi e byte logici/reali."""
+    rng = random.Random(seed)
+    root = Path(root)
+    pool = preview_pool(rng)
+    roots = {cat: root / cat for cat in CATEGORIES}
+    stats = {"models": 0, "previews": 0, "logical_bytes": 0, "preview_bytes": 0, "dirs": set()}
+    used = set()
+    for i in range(n):
+        cat = "checkpoints" if rng.random() < 0.3 else "loras"
+        folder = roots[cat].joinpath(*[rng.choice(CATEGORIES[cat]) + (str(d) if d else "")
+                                       for d in range(rng.randint(1, depth))])
+        folder.mkdir(parents=True, exist_ok=True)
+        name = model_name(rng)
+        while (folder, name) in used:
+            name = model_name(rng)
+        used.add((folder, name))
+        if cat == "loras":
+            head = safetensors_header(LORA_TENSORS, {"ss_network_module": "networks.lora",
+                                                     "ss_base_model_version": "sdxl_base_v1-0"})
+            size = rng.randint(min_mb, max(min_mb, min(max_mb, 900))) * 1024 * 1024
+        else:
+            head = safetensors_header(CKPT_TENSORS, {})
+            size = rng.randint(min(max_mb, 2000), max_mb) * 1024 * 1024
+        write_sparse(folder / (name + ".safetensors"), head, size)
+        stats["models"] += 1
+        stats["logical_bytes"] += size
+        stats["dirs"].add(folder)
+        if rng.random() < preview_ratio:
+            ext, data = pool[rng.randrange(len(pool))]
+            (folder / (name + ext)).write_bytes(data)
+            stats["previews"] += 1
+            stats["preview_bytes"] += len(data)
+    stats["dirs"] = len(stats["dirs"])
+    stats["roots"] = [str(p) for p in roots.values() if p.exists()]
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Genera una libreria di modelli sintetica")
+    ap.add_argument("dest")
+    ap.add_argument("--models", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--preview-ratio", type=float, default=0.7)
+    a = ap.parse_args()
+    print(json.dumps(generate(Path(a.dest), a.models, a.seed, a.preview_ratio), indent=2))
@@ -0,0 +1,225 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# catalog_db.py — FocusCatalog
+# Catalogo opzionale in SQLite (public/catalog.db, modalità WAL): item, preview e
+# trigger words in tabelle con indici su tipo/data/dimensione e una tabella FTS5
+# per la ricerca. Quando il file esiste è la fonte dei dati per index_store:
+# index.json (o gli shard) diventa un'esportazione scritta subito dopo.
+# -*- coding: utf-8 -*-
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import index_store
+
+DB_NAME = "catalog.db"
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS items (
+    slug TEXT PRIMARY KEY,
+    pos INTEGER NOT NULL DEFAULT 0,
+    name TEXT, display_name TEXT, sort_name TEXT,
+    type TEXT, filename TEXT, folder TEXT,
+    size_mb REAL, modified TEXT, civitai_url TEXT,
+    search TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_type ON items(type);
+CREATE INDEX IF NOT EXISTS items_modified ON items(modified);
+CREATE INDEX IF NOT EXISTS items_size ON items(size_mb);
+CREATE INDEX IF NOT EXISTS items_sort_name ON items(sort_name);
+CREATE TABLE IF NOT EXISTS previews (
+    slug TEXT NOT NULL, pos INTEGER NOT NULL, path TEXT NOT NULL,
+    PRIMARY KEY (slug, pos)
+);
+CREATE TABLE IF NOT EXISTS trigger_words (
+    slug TEXT NOT NULL, word TEXT NOT NULL,
+    PRIMARY KEY (slug, word)
+);
+CREATE INDEX IF NOT EXISTS trigger_words_word ON trigger_words(word COLLATE NOCASE);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    name, display_name, filename, trigger_words, extra,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+SORT_COLUMNS = {"name": "sort_name", "date": "modified", "size": "size_mb"}
+
+
+def db_path(index_path: Path) -> Path:
+    return index_path.with_name(DB_NAME)
+
+
+class CatalogDB:
+    """Connessione per thread a catalog.db. Le scritture usano BEGIN IMMEDIATE,
+    quindi sono serializzate anche tra processi; i lettori non vengono bloccati (WAL).
+    Senza FTS5 nella build di SQLite la ricerca ripiega su LIKE."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+        con = self._con()
+        con.executescript(SCHEMA)
+        try:
+            con.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        con.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+        con.commit()
+
+    def _con(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(str(self.path), timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    @contextmanager
+    def transaction(self):
+        con = self._con()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+        except BaseException:
+            con.rollback()
+            raise
+        con.commit()
+
+    # ------------------------ scrittura ------------------------
+    def _put(self, con: sqlite3.Connection, pos: int, item: Dict[str, Any], raw: str):
+        slug = item["slug"]
+        sort_name = (item.get("display_name") or item.get("name") or "").casefold()
+        con.execute(
+            "INSERT INTO items(slug, pos, name, display_name, sort_name, type, filename, folder, size_mb,"
+            " modified, civitai_url, search, data) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)"
+            " ON CONFLICT(slug) DO UPDATE SET pos=excluded.pos, name=excluded.name,"
+            " display_name=excluded.display_name, sort_name=excluded.sort_name, type=excluded.type,"
+            " filename=excluded.filename, folder=excluded.folder, size_mb=excluded.size_mb,"
+            " modified=excluded.modified, civitai_url=excluded.civitai_url, search=excluded.search,"
+            " data=excluded.data",
+            (slug, pos, item.get("name"), item.get("display_name"), sort_name, item.get("type"),
+             item.get("filename"), item.get("folder"), item.get("size_mb"), item.get("modified"),
+             item.get("civitai_url"), index_store.search_text(item), raw))
+        rowid = con.execute("SELECT rowid FROM items WHERE slug=?", (slug,)).fetchone()[0]
+        con.execute("DELETE FROM previews WHERE slug=?", (slug,))
+        con.executemany("INSERT INTO previews(slug, pos, path) VALUES (?,?,?)",
+                        [(slug, i, p) for i, p in enumerate(item.get("previews") or [])])
+        words = sorted({w.strip() for w in (item.get("triggerWords") or []) if w and w.strip()})
+        con.execute("DELETE FROM trigger_words WHERE slug=?", (slug,))
+        con.executemany("INSERT INTO trigger_words(slug, word) VALUES (?,?)", [(slug, w) for w in words])
+        if self.fts:
+            extra = " ".join([str(item.get("folder") or ""), str(item.get("architecture") or ""),
+                              str(item.get("base_model") or "")] + list(item.get("triggerCandidates") or []))
+            con.execute("DELETE FROM items_fts WHERE rowid=?", (rowid,))
+            con.execute("INSERT INTO items_fts(rowid, name, display_name, filename, trigger_words, extra)"
+                        " VALUES (?,?,?,?,?,?)",
+                        (rowid, item.get("name") or "", item.get("display_name") or "",
+                         item.get("filename") or "", " ".join(words), extra))
+
+    def _delete(self, con: sqlite3.Connection, slug: str):
+        row = con.execute("SELECT rowid FROM items WHERE slug=?", (slug,)).fetchone()
+        if row is None:
+            return
+        if self.fts:
+            con.execute("DELETE FROM items_fts WHERE rowid=?", (row[0],))
+        for table in ("items", "previews", "trigger_words"):
+            con.execute(f"DELETE FROM {table} WHERE slug=?", (slug,))
+
+    def sync(self, payload: Dict[str, Any]) -> int:
+        """Allinea il catalogo al payload completo: riscrive solo gli item il cui JSON
+        è cambiato ed elimina quelli spariti. Restituisce il numero di righe toccate."""
+        touched = 0
+        with self.transaction() as con:
+            old = {slug: (pos, data) for slug, pos, data in con.execute("SELECT slug, pos, data FROM items")}
+            seen = set()
+            for pos, item in enumerate(payload.get("items", [])):
+                slug = item.get("slug")
+                if not slug or slug in seen:
+                    continue
+                seen.add(slug)
+                raw = index_store.dump_item(item)
+                prev = old.get(slug)
+                if prev is None or prev[1] != raw:
+                    self._put(con, pos, item, raw)
+                    touched += 1
+                elif prev[0] != pos:
+                    con.execute("UPDATE items SET pos=? WHERE slug=?", (pos, slug))
+            for slug in set(old) - seen:
+                self._delete(con, slug)
+                touched += 1
+            con.executemany("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)",
+                            [("generated_at", payload.get("generated_at", "")),
+                             ("counts", json.dumps(payload.get("counts", {})))])
+        return touched
+
+    # ------------------------ lettura ------------------------
+    def meta(self) -> Dict[str, Any]:
+        rows = dict(self._con().execute("SELECT key, value FROM meta"))
+        try:
+            counts = json.loads(rows.get("counts") or "{}")
+        except ValueError:
+            counts = {}
+        return {"generated_at": rows.get("generated_at", ""), "counts": counts}
+
+    def iter_items(self) -> Iterator[Dict[str, Any]]:
+        for (raw,) in self._con().execute("SELECT data FROM items ORDER BY pos, slug"):
+            yield json.loads(raw)
+
+    def item(self, slug: str) -> Optional[Dict[str, Any]]:
+        row = self._con().execute("SELECT data FROM items WHERE slug=?", (slug,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def query(self, q: str = "", mtype: str = "", sort: str = "date-desc", offset: int = 0, limit: int = 96,
+              slugs: Optional[set] = None, exclude: Optional[set] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """Stessa semantica di IndexCache.query in server.py; i termini di ricerca
+        sono prefissi di parola (FTS5) invece di sottostringhe."""
+        where, params = [], []
+        if mtype:
+            where.append("type = ?"); params.append(mtype)
+        if slugs is not None:
+            where.append("slug IN (SELECT value FROM json_each(?))"); params.append(json.dumps(sorted(slugs)))
+        if exclude:
+            where.append("slug NOT IN (SELECT value FROM json_each(?))"); params.append(json.dumps(sorted(exclude)))
+        terms = q.casefold().split()
+        if terms and self.fts:
+            where.append("rowid IN (SELECT rowid FROM items_fts WHERE items_fts MATCH ?)")
+            params.append(" ".join('"{}"*'.format(t.replace('"', '""')) for t in terms))
+        else:
+            for t in terms:
+                where.append("search LIKE ? ESCAPE '\\'")
+                params.append("%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        clause = (" WHERE " + " AND ".join(where)) if where else ""
+        field, _, direction = (sort or "").partition("-")
+        if field not in SORT_COLUMNS:
+            field, direction = "date", "desc"
+        order = "{} {}".format(SORT_COLUMNS[field], "ASC" if direction == "asc" else "DESC")
+        con = self._con()
+        total = con.execute("SELECT COUNT(*) FROM items" + clause, params).fetchone()[0]
+        rows = con.execute(f"SELECT data FROM items{clause} ORDER BY {order}, slug LIMIT ? OFFSET ?",
+                           params + [limit, offset])
+        return total, [json.loads(raw) for (raw,) in rows]
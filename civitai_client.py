@@ -0,0 +1,247 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# civitai_client.py — FocusCatalog
+# Client Civitai condiviso da scan_models.py e server.py:
+# Session con pool di connessioni, coda concorrente limitata, rate limit globale,
+# backoff su 429/5xx e cache su disco (ETag + TTL) per modelli e versioni.
+# L'endpoint è configurabile (CIVITAI_API_BASE) per i test con un server stub locale.
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import metrics
+
+API_BASE = os.environ.get("CIVITAI_API_BASE", "https://civitai.com/api/v1").rstrip("/")
+USER_AGENT = "FocusCatalog/1.0 (+local)"
+
+DEFAULT_TTL = 24 * 3600     # secondi prima di rivalidare una risposta in cache
+DEFAULT_RATE = 4.0          # richieste/secondo (globali, tutti i thread)
+DEFAULT_WORKERS = 4         # richieste concorrenti massime
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Rate limit globale: distanzia le richieste di almeno 1/rate secondi.
+    penalize() sposta in avanti la prossima partenza per tutti (es. dopo un 429)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def penalize(self, delay: float):
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + delay)
+
+
+class CivitaiClient:
+    def __init__(self, cache_dir: Optional[Path] = None, api_base: str = API_BASE,
+                 ttl: float = DEFAULT_TTL, rate: float = DEFAULT_RATE,
+                 workers: int = DEFAULT_WORKERS, timeout: float = 25, retries: int = 4,
+                 user_agent: str = USER_AGENT):
+        self.api_base = api_base.rstrip("/")
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.ttl = ttl
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.retries = retries
+        self.limiter = RateLimiter(rate)
+        self.user_agent = user_agent
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Session creata alla prima richiesta: requests (~40 ms di import) si carica
+        solo se Civitai serve davvero (scansioni e avvio del server non lo pagano)."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers * 2)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers["User-Agent"] = self.user_agent
+                    self._session = session
+        return self._session
+
+    # ------------------------ HTTP ------------------------
+    def request(self, url: str, **kw) -> "requests.Response":
+        """GET con rate limit globale e backoff su 429/5xx/errori di rete.
+        Rispetta Retry-After; a tentativi esauriti restituisce l'ultima risposta."""
+        import requests
+        session = self.session
+        kw.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            m, t0 = metrics.current(), time.perf_counter()
+            try:
+                r = session.get(url, **kw)
+            except (requests.ConnectionError, requests.Timeout):
+                m.observe("http.civitai", time.perf_counter() - t0)
+                m.count("http.civitai.errors")
+                if attempt >= self.retries:
+                    raise
+                self.limiter.penalize(min(2 ** attempt, 30))
+                continue
+            # Latenza fino agli header (con stream=True il corpo non è incluso)
+            m.observe("http.civitai", time.perf_counter() - t0)
+            m.count(f"http.civitai.{r.status_code}")
+            if r.status_code not in RETRY_STATUS or attempt >= self.retries:
+                return r
+            delay = _retry_after(r.headers.get("Retry-After"))
+            if delay is None:
+                delay = min(2 ** attempt, 30)
+            r.close()
+            self.limiter.penalize(delay)
+        return r
+
+    # ------------------------ cache ------------------------
+    def _cache_path(self, key: str) -> Optional[Path]:
+        return self.cache_dir / f"{key}.json" if self.cache_dir else None
+
+    def _cache_read(self, key: str) -> Optional[Dict[str, Any]]:
+        p = self._cache_path(key)
+        if p and p.exists():
+            try:
+                return json.loads(p.read_text(encoding="utf-8"))
+            except Exception:
+                pass
+        return None
+
+    def _cache_write(self, key: str, entry: Dict[str, Any]):
+        p = self._cache_path(key)
+        if not p:
+            return
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.with_name(f"{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, p)
+        except Exception:
+            pass
+
+    def get_json(self, path: str, cache_key: Optional[str] = None, ttl: Optional[float] = None,
+                 missing_ok: bool = False) -> Any:
+        """GET JSON su api_base+path. Con cache_key la risposta è salvata su disco:
+        entro il TTL viene servita dalla cache, poi rivalidata con If-None-Match.
+        Con missing_ok un 404 restituisce None (messo in cache come le altre risposte)."""
+        ttl = self.ttl if ttl is None else ttl
+        cached = self._cache_read(cache_key) if cache_key else None
+        if cached and time.time() - cached.get("fetched_at", 0) < ttl:
+            metrics.current().count("http.civitai.cache_hits")
+            return cached.get("data")
+
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        r = self.request(self.api_base + path, headers=headers)
+        if r.status_code == 304 and cached:
+            cached["fetched_at"] = time.time()
+            self._cache_write(cache_key, cached)
+            return cached.get("data")
+        if r.status_code == 404 and missing_ok:
+            r.close()
+            data = None
+        else:
+            r.raise_for_status()
+            data = r.json()
+        if cache_key:
+            self._cache_write(cache_key, {"etag": r.headers.get("ETag"), "fetched_at": time.time(), "data": data})
+        return data
+
+    def model(self, model_id: str, ttl: Optional[float] = None) -> Dict[str, Any]:
+        return self.get_json(f"/models/{model_id}", f"model_{model_id}", ttl)
+
+    def model_version(self, version_id: str, ttl: Optional[float] = None) -> Dict[str, Any]:
+        return self.get_json(f"/model-versions/{version_id}", f"version_{version_id}", ttl)
+
+    def version_by_hash(self, sha256: str, ttl: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Versione di modello per hash del file (SHA-256 o AutoV2); None se Civitai non la conosce."""
+        key = sha256.upper()
+        return self.get_json(f"/model-versions/by-hash/{key}", f"hash_{key}", ttl, missing_ok=True)
+
+    def download(self, url: str, dest: Path, headers: Optional[Dict[str, str]] = None,
+                 chunk_size: int = 1 << 16) -> Path:
+        """Scarica url su dest a blocchi, senza tenere l'intero corpo in memoria."""
+        r = self.request(url, headers=headers or {}, stream=True)
+        with r:
+            r.raise_for_status()
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            with open(dest, "wb") as fh:
+                for chunk in r.iter_content(chunk_size):
+                    fh.write(chunk)
+        return dest
+
+    # ------------------------ coda concorrente ------------------------
+    def fetch_many(self, fn: Callable[[Any], Any], keys: Iterable[Any],
+                   on_done: Optional[Callable[[int], Any]] = None,
+                   on_result: Optional[Callable[[Any, Any], Any]] = None) -> Dict[Any, Any]:
+        """Esegue fn(key) su al massimo `workers` thread. Il risultato per chiave è
+        il valore restituito oppure l'eccezione sollevata; man mano che le chiavi
+        terminano (in qualsiasi ordine) chiama on_result(key, risultato) e on_done(n)."""
+        keys = list(dict.fromkeys(keys))
+        out: Dict[Any, Any] = {}
+        if not keys:
+            return out
+
+        mt = metrics.current()  # i thread del pool contano nel registro del chiamante
+
+        def _one(k):
+            try:
+                with metrics.use(mt):
+                    return fn(k)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(keys))) as pool:
+            futures = {pool.submit(_one, k): k for k in keys}
+            for fut in as_completed(futures):
+                k = futures[fut]
+                out[k] = fut.result()
+                if on_result:
+                    on_result(k, out[k])
+                if on_done:
+                    on_done(len(out))
+        return {k: out[k] for k in keys}
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
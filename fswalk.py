@@ -0,0 +1,141 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# fswalk.py — FocusCatalog
+# Walker delle cartelle modelli basato su os.scandir: una sola lettura per
+# cartella, stat dai DirEntry (gratis su Windows, una chiamata su POSIX) e
+# preview abbinate ai modelli con l'insieme dei nomi della cartella, senza
+# exists() aggiuntive. Le cartelle vengono lette in parallelo su più thread
+# (utile soprattutto su SMB/NFS, dove ogni chiamata è un round trip).
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_WORKERS = 8
+
+
+@dataclass
+class ModelFile:
+    path: Path
+    stat: os.stat_result
+    inode: int
+    previews: List[Tuple[Path, os.stat_result]] = field(default_factory=list)
+
+
+class WalkStats:
+    """Contatori delle chiamate al filesystem fatte dal walker (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.dirs = 0        # os.scandir
+        self.entries = 0     # voci lette dai listing
+        self.stats = 0       # DirEntry.stat() / inode() che richiedono una chiamata
+
+    def add(self, dirs: int = 0, entries: int = 0, stats: int = 0):
+        with self._lock:
+            self.dirs += dirs
+            self.entries += entries
+            self.stats += stats
+
+    @property
+    def syscalls(self) -> int:
+        return self.dirs + self.stats
+
+    def as_dict(self) -> Dict[str, int]:
+        return {"dirs": self.dirs, "entries": self.entries, "stats": self.stats, "syscalls": self.syscalls}
+
+
+# Su Windows stat() dei DirEntry arriva dal listing, ma inode() richiede una chiamata;
+# su POSIX è il contrario (d_ino è nel listing, stat() è una chiamata).
+_STAT_COST, _INODE_COST = (0, 1) if os.name == "nt" else (1, 0)
+
+
+def _scan_dir(path: str, model_exts: frozenset, image_exts: Tuple[str, ...],
+              stats: WalkStats) -> Tuple[List[str], List[ModelFile]]:
+    """Legge una cartella: sottocartelle da visitare e modelli con le preview accanto."""
+    subdirs: List[str] = []
+    files: Dict[str, os.DirEntry] = {}
+    n = 0
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                n += 1
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        subdirs.append(e.path)
+                    elif e.is_file():
+                        files[e.name.casefold() if os.name == "nt" else e.name] = e
+                except OSError:
+                    continue
+    except OSError:
+        stats.add(dirs=1)
+        return [], []
+
+    models: List[ModelFile] = []
+    cost = 0
+    for e in files.values():
+        stem, ext = os.path.splitext(e.name)
+        if ext.lower() not in model_exts:
+            continue
+        try:
+            st = e.stat()
+            ino = e.inode()
+        except OSError:
+            continue
+        cost += _STAT_COST + _INODE_COST
+        previews = []
+        for iext in image_exts:
+            key = stem + iext
+            pe = files.get(key.casefold() if os.name == "nt" else key)
+            if pe is None:
+                continue
+            try:
+                previews.append((Path(pe.path), pe.stat()))
+                cost += _STAT_COST
+            except OSError:
+                continue
+        models.append(ModelFile(Path(e.path), st, ino, previews))
+    stats.add(dirs=1, entries=n, stats=cost)
+    return subdirs, models
+
+
+def walk_models(roots: Iterable[str], model_exts: Iterable[str], image_exts: Iterable[str],
+                workers: int = DEFAULT_WORKERS, stats: Optional[WalkStats] = None,
+                on_dir: Optional[Callable[[int, int], object]] = None) -> List[ModelFile]:
+    """Tutti i file modello sotto `roots`, ordinati per percorso. Le cartelle sono
+    lette da un pool di `workers` thread man mano che vengono scoperte;
+    on_dir(voci_lette, modelli_trovati) viene chiamata dopo ogni cartella."""
+    stats = stats or WalkStats()
+    model_exts = frozenset(x.lower() for x in model_exts)
+    # Ordine fisso delle estensioni immagine (prima le minuscole, come find_local_previews)
+    image_exts = tuple(sorted({x.lower() for x in image_exts}))
+    found: List[ModelFile] = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = {pool.submit(_scan_dir, str(r), model_exts, image_exts, stats) for r in roots}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                subdirs, models = fut.result()
+                found.extend(models)
+                for d in subdirs:
+                    pending.add(pool.submit(_scan_dir, d, model_exts, image_exts, stats))
+                if on_dir:
+                    on_dir(stats.entries, len(found))
+    found.sort(key=lambda m: str(m.path))
+    return found
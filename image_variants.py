@@ -0,0 +1,150 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# image_variants.py — FocusCatalog
+# Varianti ridotte delle preview (160/320/640 px) in WebP e, se Pillow lo
+# supporta, AVIF, salvate accanto all'immagine base (foo.jpg → foo.320.webp).
+# L'immagine base (.jpg, .png se trasparente) resta il fallback; l'index registra
+# dimensioni e hash di ogni file e il server sceglie la variante con ?w=.
+# -*- coding: utf-8 -*-
+
+import hashlib
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+THUMB_SIZES = (160, 320, 640)
+DEFAULT_FORMATS = ("webp",)
+FORMAT_PREFERENCE = ("avif", "webp")   # ordine di scelta lato server
+QUALITY = {"webp": 80, "avif": 60}
+MIME = {"webp": "image/webp", "avif": "image/avif"}
+
+_VARIANT_RE = re.compile(r"\.\d+\.(?:webp|avif)$", re.IGNORECASE)
+
+
+@lru_cache(maxsize=None)
+def available(fmt: str) -> bool:
+    try:
+        from PIL import features  # Pillow solo quando serve (import ~20 ms)
+        return bool(features.check(fmt))
+    except Exception:
+        return False
+
+
+def variant_formats(avif: bool = False) -> Tuple[str, ...]:
+    """Formati delle varianti supportati dalla build di Pillow corrente."""
+    wanted = ("webp", "avif") if avif else DEFAULT_FORMATS
+    return tuple(f for f in wanted if available(f))
+
+
+def variant_path(base: Path, w: int, fmt: str) -> Path:
+    return base.with_name(f"{base.stem}.{w}.{fmt}")
+
+
+def is_variant(path: Path) -> bool:
+    return bool(_VARIANT_RE.search(path.name))
+
+
+def content_hash(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()[:12]
+
+
+def write_variants(im: "Image.Image", base: Path, formats: Iterable[str],
+                   sizes: Iterable[int] = THUMB_SIZES) -> List[Path]:
+    """Salva le varianti di `im` (già decodificata) accanto a `base`. Le misure
+    oltre il lato lungo dell'immagine non vengono create (niente copie identiche)."""
+    formats = tuple(formats)
+    if not formats:
+        return []
+    if im.mode not in ("RGB", "RGBA"):
+        im = im.convert("RGBA" if im.mode in ("LA", "PA") or "transparency" in im.info else "RGB")
+    longest = max(im.size)
+    out: List[Path] = []
+    for w in sorted(sizes):
+        v = im.copy()
+        v.thumbnail((w, w))
+        for fmt in formats:
+            dest = variant_path(base, w, fmt)
+            v.save(dest, fmt.upper(), quality=QUALITY.get(fmt, 80))
+            out.append(dest)
+        if longest <= w:
+            break
+    return out
+
+
+def variants_fresh(base: Path, src_mtime_ns: int, formats: Iterable[str]) -> bool:
+    """True se la variante più piccola di ogni formato esiste ed è più recente della sorgente."""
+    for fmt in formats:
+        try:
+            if variant_path(base, min(THUMB_SIZES), fmt).stat().st_mtime_ns < src_mtime_ns:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _file_info(path: Path, out_dir: Path) -> Optional[Dict[str, Any]]:
+    from PIL import Image
+    try:
+        with Image.open(path) as im:
+            w, h = im.size
+        return {"path": str(path.relative_to(out_dir)).replace("\\", "/"), "w": w, "h": h,
+                "hash": content_hash(path)}
+    except Exception:
+        return None
+
+
+def describe(base: Path, out_dir: Path) -> Optional[Dict[str, Any]]:
+    """Dimensioni e hash dell'immagine base e delle varianti presenti su disco:
+    {"w", "h", "hash", "variants": [{"path", "w", "h", "hash", "format", "size"}]}."""
+    info = _file_info(base, out_dir)
+    if info is None:
+        return None
+    variants = []
+    for w in THUMB_SIZES:
+        for fmt in FORMAT_PREFERENCE:
+            p = variant_path(base, w, fmt)
+            if p.exists():
+                v = _file_info(p, out_dir)
+                if v:
+                    variants.append(dict(v, format=fmt, size=w))
+    del info["path"]
+    info["variants"] = variants
+    return info
+
+
+def pick_variant(base: Path, w: int, accepts: Callable[[str], bool]) -> Tuple[Path, Optional[str]]:
+    """Variante più piccola con lato >= w in un formato accettato dal client e non
+    più vecchia della base (per immagini piccole la maggiore disponibile); oltre
+    l'ultima misura, o senza varianti adatte, la base stessa.
+    Restituisce (percorso, mimetype o None per la base)."""
+    try:
+        base_mtime = base.stat().st_mtime_ns
+    except OSError:
+        return base, None
+    fmts = [f for f in FORMAT_PREFERENCE if accepts(MIME[f])]
+    if not fmts or w > max(THUMB_SIZES):
+        return base, None
+    wanted = [s for s in THUMB_SIZES if s >= w]
+    # Se la misura richiesta non esiste (immagine piccola) si ripiega sulle minori
+    for size in wanted + sorted((s for s in THUMB_SIZES if s < wanted[0]), reverse=True):
+        for fmt in fmts:
+            p = variant_path(base, size, fmt)
+            try:
+                if p.stat().st_mtime_ns >= base_mtime:
+                    return p, MIME[fmt]
+            except OSError:
+                continue
+    return base, None
@@ -0,0 +1,465 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# index_store.py — FocusCatalog
+# Percorso di scrittura di index.json condiviso da scan_models.py e server.py:
+# file temporaneo + fsync + os.replace (mai un index troncato), lock inter-processo
+# su index.json.lock e aggiornamenti read-modify-write per slug.
+# Formati: "json" (index.json unico, quello letto dal frontend) e/o "shards"
+# (index.d/: shard NDJSON per hash dello slug + manifest.json con conteggi,
+# generated_at e digest: si riscrivono solo gli shard cambiati).
+# Se accanto all'index c'è catalog.db (catalog_db.py) è quello la fonte dei dati:
+# le letture passano dal database e ogni scrittura lo aggiorna prima dei file.
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import brotli  # opzionale: abilita index.json.br
+except ImportError:
+    brotli = None
+
+# Campi modificabili dall'utente/server (link Civitai): in caso di scritture
+# concorrenti vince la versione su disco se è cambiata rispetto alla base.
+META_FIELDS = ("display_name", "civitai_url", "previews", "preview_variants",
+               "triggerWords", "triggerWordsChecked", "triggerWordsNotFound", "civitaiLookupHash")
+
+INDEX_FORMATS = ("json", "shards")
+SHARD_DIR = "index.d"
+SHARD_COUNT = 16
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Campi su cui si cerca con ?q= (/api/items, sia in memoria sia in SQLite)
+SEARCH_FIELDS = ("name", "display_name", "filename", "folder", "architecture", "base_model")
+SEARCH_LIST_FIELDS = ("triggerWords", "triggerCandidates")
+
+_thread_locks: Dict[str, threading.RLock] = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(path: Path) -> threading.RLock:
+    key = str(path.resolve())
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(key, threading.RLock())
+
+
+def _lock_nb(fh) -> bool:
+    """Lock esclusivo non bloccante su un file aperto; False se è già tenuto altrove."""
+    try:
+        if fcntl:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fh):
+    if fcntl:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    else:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def index_lock(index_path: Path, timeout: float = 60.0):
+    """Lock esclusivo tra thread e processi su <index>.lock."""
+    lock_path = index_path.with_name(index_path.name + ".lock")
+    with _thread_lock(index_path):
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        fh = open(lock_path, "a+b")
+        try:
+            deadline = time.monotonic() + timeout
+            while not _lock_nb(fh):
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Lock non ottenuto su {lock_path}")
+                time.sleep(0.05)
+            try:
+                yield
+            finally:
+                _unlock(fh)
+        finally:
+            fh.close()
+
+
+def try_lock(lock_path: Path):
+    """Lock inter-processo di lunga durata (es. scansione o watcher del server):
+    il file aperto e bloccato, oppure None se un altro processo lo tiene già.
+    Si rilascia con release_lock() o terminando il processo."""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    fh = open(lock_path, "a+b")
+    if _lock_nb(fh):
+        return fh
+    fh.close()
+    return None
+
+
+def release_lock(fh):
+    try:
+        _unlock(fh)
+    finally:
+        fh.close()
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """Scrive su file temporaneo nella stessa cartella, fsync, poi os.replace."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+        metrics.current().count("bytes_written", len(data))
+        metrics.current().count("files_written")
+    finally:
+        if tmp.exists():
+            try: tmp.unlink()
+            except OSError: pass
+
+
+def atomic_write_text(path: Path, text: str):
+    atomic_write_bytes(path, text.encode("utf-8"))
+
+
+def dump_index(payload: Dict[str, Any]) -> str:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def dump_item(item: Dict[str, Any]) -> str:
+    return json.dumps(item, ensure_ascii=False, separators=(",", ":"))
+
+
+def search_text(item: Dict[str, Any]) -> str:
+    """Testo case-folded su cui si cercano i termini di ?q=."""
+    parts = [str(item.get(k) or "") for k in SEARCH_FIELDS]
+    parts += [str(w) for k in SEARCH_LIST_FIELDS for w in (item.get(k) or [])]
+    return " ".join(parts).casefold()
+
+
+# ------------------------ formato a shard ------------------------
+def shard_dir(index_path: Path) -> Path:
+    return index_path.with_name(SHARD_DIR)
+
+
+def manifest_path(index_path: Path) -> Path:
+    return shard_dir(index_path) / MANIFEST_NAME
+
+
+def shard_name(slug: str) -> str:
+    return "items-{:02x}.ndjson".format(zlib.crc32((slug or "").encode("utf-8")) % SHARD_COUNT)
+
+
+def read_manifest(index_path: Path) -> Optional[Dict[str, Any]]:
+    p = manifest_path(index_path)
+    if p.exists():
+        try:
+            data = json.loads(p.read_text(encoding="utf-8"))
+            if data.get("version") == MANIFEST_VERSION:
+                return data
+        except Exception:
+            pass
+    return None
+
+
+def iter_shard_lines(index_path: Path, manifest: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """Righe JSON (un item per riga) degli shard elencati nel manifest, senza parsarle."""
+    manifest = manifest or read_manifest(index_path) or {}
+    d = shard_dir(index_path)
+    for name in sorted(manifest.get("shards", {})):
+        try:
+            with open(d / name, "r", encoding="utf-8") as fh:
+                for line in fh:
+                    line = line.strip()
+                    if line:
+                        yield line
+        except OSError:
+            continue
+
+
+def _write_shard(path: Path, lines: Iterable[str], old_digest: Optional[str]) -> str:
+    """Scrive le righe in streaming su un file temporaneo calcolandone il digest;
+    se coincide con quello precedente lo scarta, altrimenti fsync + os.replace."""
+    h = hashlib.sha1()
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as fh:
+            for line in lines:
+                raw = (line + "\n").encode("utf-8")
+                h.update(raw)
+                fh.write(raw)
+            digest = h.hexdigest()[:20]
+            if digest == old_digest and path.exists():
+                return digest
+            fh.flush()
+            os.fsync(fh.fileno())
+            size = fh.tell()
+        os.replace(tmp, path)
+        metrics.current().count("bytes_written", size)
+        metrics.current().count("files_written")
+        return digest
+    finally:
+        if tmp.exists():
+            try: tmp.unlink()
+            except OSError: pass
+
+
+def write_shards(index_path: Path, payload: Dict[str, Any]):
+    """Item raggruppati per shard (hash dello slug) e scritti riga per riga; solo gli
+    shard con contenuto cambiato vengono sostituiti, il manifest per ultimo."""
+    d = shard_dir(index_path)
+    d.mkdir(parents=True, exist_ok=True)
+    buckets: Dict[str, List[Dict[str, Any]]] = {}
+    for it in payload.get("items", []):
+        buckets.setdefault(shard_name(it.get("slug")), []).append(it)
+    old = (read_manifest(index_path) or {}).get("shards", {})
+    shards: Dict[str, Dict[str, Any]] = {}
+    for name in sorted(buckets):
+        digest = _write_shard(d / name, map(dump_item, buckets[name]), (old.get(name) or {}).get("sha1"))
+        shards[name] = {"count": len(buckets[name]), "sha1": digest}
+    manifest = {"version": MANIFEST_VERSION, "generated_at": payload.get("generated_at", ""),
+                "counts": payload.get("counts", {}), "shards": shards}
+    atomic_write_text(manifest_path(index_path), json.dumps(manifest, ensure_ascii=False, separators=(",", ":")))
+    for name in set(old) - set(shards):
+        try: (d / name).unlink()
+        except OSError: pass
+
+
+# ------------------------ catalogo SQLite ------------------------
+_dbs: Dict[str, Any] = {}
+
+
+def open_db(index_path: Path, create: bool = False):
+    """CatalogDB per questo index se catalog.db esiste (o create=True), altrimenti None."""
+    import catalog_db  # import locale: catalog_db importa a sua volta index_store
+    path = catalog_db.db_path(index_path)
+    if not create and not path.exists():
+        return None
+    key = str(path.resolve())
+    with _thread_locks_guard:
+        db = _dbs.get(key)
+        if db is None:
+            db = _dbs[key] = catalog_db.CatalogDB(path)
+    return db
+
+
+def enable_db(index_path: Path):
+    """Crea catalog.db importando l'index attuale (se non esiste già) e lo restituisce."""
+    with index_lock(index_path):
+        db = open_db(index_path)
+        if db is None:
+            data = read_index(index_path)
+            db = open_db(index_path, create=True)
+            db.sync(data)
+        return db
+
+
+# ------------------------ lettura ------------------------
+def index_formats(index_path: Path) -> tuple:
+    """Formati presenti su disco (in loro assenza "json", il formato storico)."""
+    found = tuple(f for f, p in (("json", index_path), ("shards", manifest_path(index_path))) if p.exists())
+    return found or ("json",)
+
+
+def primary_path(index_path: Path) -> Path:
+    """File la cui firma/contenuto identifica la versione corrente dell'index:
+    il manifest se ci sono gli shard (scritto per ultimo), altrimenti index.json."""
+    m = manifest_path(index_path)
+    return m if m.exists() else index_path
+
+
+def iter_items(index_path: Path) -> Iterator[Dict[str, Any]]:
+    """Item dell'index uno alla volta: dal catalogo SQLite se presente, poi dagli
+    shard riga per riga, altrimenti da index.json."""
+    db = open_db(index_path)
+    if db is not None:
+        yield from db.iter_items()
+        return
+    manifest = read_manifest(index_path)
+    if manifest is not None:
+        for line in iter_shard_lines(index_path, manifest):
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+        return
+    if index_path.exists():
+        try:
+            yield from json.loads(index_path.read_text(encoding="utf-8")).get("items", [])
+        except Exception:
+            pass
+
+
+def read_index(index_path: Path) -> Dict[str, Any]:
+    db = open_db(index_path)
+    if db is not None:
+        return dict(db.meta(), items=list(db.iter_items()))
+    manifest = read_manifest(index_path)
+    if manifest is not None:
+        return {"generated_at": manifest.get("generated_at", ""), "counts": manifest.get("counts", {}),
+                "items": list(iter_items(index_path))}
+    if index_path.exists():
+        try:
+            return json.loads(index_path.read_text(encoding="utf-8"))
+        except Exception:
+            pass
+    return {"generated_at": "", "items": []}
+
+
+def write_compressed(path: Path, raw: bytes):
+    """Varianti precompresse accanto al file (<nome>.gz e, se c'è brotli, <nome>.br).
+    Scritte dopo l'originale: il server le usa solo se non sono più vecchie di esso."""
+    atomic_write_bytes(path.with_name(path.name + ".gz"), gzip.compress(raw, compresslevel=6, mtime=0))
+    if brotli is not None:
+        atomic_write_bytes(path.with_name(path.name + ".br"), brotli.compress(raw, quality=5))
+
+
+def write_index(index_path: Path, payload: Dict[str, Any], formats: Optional[Iterable[str]] = None):
+    """Scrittura atomica dell'index nei formati richiesti (default: quelli già su
+    disco) e rimozione degli altri; il chiamante tiene index_lock se serve.
+    Con catalog.db presente il database viene aggiornato per primo; alla fine
+    si aggiornano il manifest delle preview referenziate (preview_refs) e
+    l'indice trigger word/tag (term_index)."""
+    m = metrics.current()
+    db = open_db(index_path)
+    if db is not None:
+        with m.phase("write_db"):
+            db.sync(payload)
+    formats = tuple(formats) if formats else index_formats(index_path)
+    if "json" in formats:
+        with m.phase("serialize"):
+            raw = dump_index(payload).encode("utf-8")
+        atomic_write_bytes(index_path, raw)
+        write_compressed(index_path, raw)
+    if "shards" in formats:
+        write_shards(index_path, payload)
+    drop_formats(index_path, formats)
+    import preview_refs, term_index  # importano index_store: qui evita l'import circolare
+    with m.phase("preview_refs"):
+        preview_refs.sync(index_path.parent, payload.get("items", []))
+    with m.phase("term_index"):
+        term_index.sync(index_path.parent, payload.get("items", []))
+
+
+def drop_formats(index_path: Path, keep: Iterable[str]):
+    keep = set(keep)
+    if "shards" not in keep and shard_dir(index_path).exists():
+        # prima il manifest: senza di esso gli shard rimasti non vengono più letti
+        for p in [manifest_path(index_path)] + sorted(shard_dir(index_path).glob("*.ndjson")):
+            try: p.unlink()
+            except OSError: pass
+        try: shard_dir(index_path).rmdir()
+        except OSError: pass
+    if "json" not in keep:
+        for p in (index_path, index_path.with_name(index_path.name + ".gz"),
+                  index_path.with_name(index_path.name + ".br")):
+            try: p.unlink()
+            except OSError: pass
+
+
+def update_items(index_path: Path, updates: Dict[str, Callable[[Dict[str, Any]], Any]],
+                 after_write: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Dict[str, Any]:
+    """Read-modify-write sotto lock: per ogni slug applica updates[slug](item)
+    all'item corrente su disco, così modifiche concorrenti su slug diversi
+    (o su campi diversi) si sommano invece di sovrascriversi.
+    after_write(payload) viene chiamata ancora sotto lock (es. per aggiornare una cache).
+    Restituisce il payload scritto; gli slug mancanti vengono ignorati."""
+    with index_lock(index_path):
+        data = read_index(index_path)
+        by_slug = {it.get("slug"): it for it in data.get("items", [])}
+        for slug, fn in updates.items():
+            item = by_slug.get(slug)
+            if item is not None:
+                fn(item)
+        data["generated_at"] = datetime.now().isoformat(timespec="seconds")
+        write_index(index_path, data)
+        if after_write:
+            after_write(data)
+        return data
+
+
+def count_items(items: List[Dict[str, Any]]) -> Dict[str, int]:
+    return {"total": len(items),
+            "checkpoints": sum(1 for x in items if x.get("type") == "Checkpoint"),
+            "loras": sum(1 for x in items if x.get("type") == "LoRA")}
+
+
+def upsert_items(index_path: Path, items: List[Dict[str, Any]], removed: Iterable[str] = (),
+                 after_write: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Dict[str, Any]:
+    """Unisce all'index su disco, sotto lock, item completi identificati per filename
+    (aggiunti o sostituiti) e rimuove quelli dei filename in `removed`: è così che
+    server.py applica gli item di scan_models.py --stream prima della scrittura finale.
+    Un item esistente con lo stesso slug ma un altro file lascia il posto al nuovo."""
+    incoming = {it.get("filename"): it for it in items if it.get("filename")}
+    slugs = {it.get("slug") for it in incoming.values()}
+    drop = set(removed) | set(incoming)
+    with index_lock(index_path):
+        data = read_index(index_path)
+        kept = [it for it in data.get("items", []) if it.get("filename") not in drop and it.get("slug") not in slugs]
+        data["items"] = kept + list(incoming.values())
+        data["counts"] = count_items(data["items"])
+        write_index(index_path, data)
+        if after_write:
+            after_write(data)
+        return data
+
+
+def merge_meta(items, base: Dict[str, Dict[str, Any]], current: Dict[str, Dict[str, Any]],
+               streamed: Optional[Dict[str, Dict[str, Any]]] = None):
+    """Merge a tre vie dei META_FIELDS per una scansione che riscrive tutto l'index.
+    base = metadati letti a inizio scansione, current = quelli su disco al momento
+    della scrittura: se un campo è cambiato nel frattempo (es. link Civitai salvato
+    dal server), la versione su disco prevale su quella calcolata dalla scansione.
+    streamed = item emessi dalla stessa scansione (--stream) che il server può aver
+    già scritto: trovarli su disco non conta come modifica."""
+    for it in items:
+        slug = it.get("slug")
+        cur = current.get(slug)
+        if cur is None:
+            continue
+        old: Dict[str, Any] = base.get(slug) or {}
+        own: Dict[str, Any] = (streamed or {}).get(slug) or {}
+        for k in META_FIELDS:
+            if cur.get(k) == old.get(k) or (k in own and cur.get(k) == own[k]):
+                continue
+            if k == "previews":
+                # preview aggiunte dal server + miniature locali trovate dalla scansione
+                it[k] = list(cur.get(k) or []) + [p for p in (it.get(k) or []) if p not in (cur.get(k) or [])]
+            elif k == "preview_variants":
+                it[k] = dict(it.get(k) or {}, **(cur.get(k) or {})) or None
+            else:
+                it[k] = cur.get(k)
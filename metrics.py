@@ -0,0 +1,129 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# metrics.py — FocusCatalog
+# Metriche leggere e thread-safe: tempi per fase, contatori e istogrammi di
+# latenza a bucket fissi. Un registro "corrente" per processo permette a
+# civitai_client e index_store di registrare chiamate HTTP e byte scritti senza
+# passarsi l'oggetto (scan_models ne crea uno per scansione, server.py uno globale;
+# una scansione in-process usa il suo solo nel proprio thread, con use()).
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# Limiti superiori dei bucket in secondi (l'ultimo raccoglie tutto il resto)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Stima per bucket: limite superiore del bucket che contiene il quantile
+        (mai oltre il massimo osservato)."""
+        if not self.count:
+            return None
+        target, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def as_dict(self) -> Dict[str, Any]:
+        ms = lambda s: None if s is None else round(s * 1000, 2)
+        return {"count": self.count, "sum_ms": ms(self.sum), "max_ms": ms(self.max),
+                "p50_ms": ms(self.quantile(0.5)), "p90_ms": ms(self.quantile(0.9)), "p99_ms": ms(self.quantile(0.99)),
+                # [limite superiore in ms (None = oltre l'ultimo), conteggio]
+                "buckets": [[None if b is None else b * 1000, n] for b, n in zip(BUCKETS + (None,), self.counts)]}
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + dt
+
+    def count(self, name: str, n: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = Histogram()
+            h.observe(seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                    "elapsed_s": round(time.time() - self.started, 3),
+                    "phases_s": {k: round(v, 4) for k, v in self.phases.items()},
+                    "counters": dict(sorted(self.counters.items())),
+                    "histograms": {k: h.as_dict() for k, h in sorted(self.histograms.items())}}
+
+
+_current = Metrics()
+_local = threading.local()
+
+
+def current() -> Metrics:
+    return getattr(_local, "metrics", None) or _current
+
+
+def set_current(m: Metrics) -> Metrics:
+    global _current
+    _current = m
+    return m
+
+
+@contextmanager
+def use(m: Metrics):
+    """Registro corrente solo per il thread chiamante (scansione in-process nel
+    server, che tiene il proprio registro globale); gli altri thread non lo vedono."""
+    prev = getattr(_local, "metrics", None)
+    _local.metrics = m
+    try:
+        yield m
+    finally:
+        _local.metrics = prev
@@ -0,0 +1,108 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# model_hash.py — FocusCatalog
+# Impronte dei file modello: hash rapido (size + primi/ultimi 64 KiB) per
+# riconoscere rinomine e duplicati, e SHA-256 completo (AutoV2 di Civitai = primi
+# 10 caratteri) letto a blocchi via mmap. I calcoli girano in un pool di processi.
+# -*- coding: utf-8 -*-
+
+import hashlib
+import mmap
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+QUICK_BLOCK = 64 * 1024
+FULL_CHUNK = 16 * 1024 * 1024
+HASH_MODES = ("none", "quick", "full")
+MP_CONTEXT: Optional[str] = None  # metodo di avvio dei pool di processi (None = default di piattaforma)
+
+
+def quick_hash(path: Path) -> str:
+    """Impronta veloce: size + testa + coda del file (2 letture, indipendente dalla dimensione)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        h.update(str(size).encode("ascii"))
+        h.update(fh.read(QUICK_BLOCK))
+        if size > QUICK_BLOCK:
+            fh.seek(max(QUICK_BLOCK, size - QUICK_BLOCK))
+            h.update(fh.read(QUICK_BLOCK))
+    return h.hexdigest()[:20]
+
+
+def full_sha256(path: Path, chunk: int = FULL_CHUNK) -> str:
+    """SHA-256 dell'intero file (maiuscolo, come lo mostra Civitai), a blocchi via mmap."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for off in range(0, size, chunk):
+                        h.update(view[off:off + chunk])
+                finally:
+                    view.release()
+    return h.hexdigest().upper()
+
+
+def autov2(sha256: Optional[str]) -> Optional[str]:
+    return sha256[:10] if sha256 else None
+
+
+def file_hashes(path: Path, full: bool = False) -> Dict[str, str]:
+    out = {"quick": quick_hash(path)}
+    if full:
+        out["sha256"] = full_sha256(path)
+    return out
+
+
+def _hash_job(job) -> Optional[Dict[str, str]]:
+    path, full = job
+    try:
+        return file_hashes(Path(path), full)
+    except OSError:
+        return None
+
+
+def process_pool(workers: int):
+    """ProcessPoolExecutor (import differito) con il metodo di avvio MP_CONTEXT,
+    usato anche per le miniature di scan_models. Il server con le scansioni
+    in-process imposta "forkserver": il fork di un processo con più thread non è sicuro."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context(MP_CONTEXT) if MP_CONTEXT else None)
+
+
+def hash_many(paths: List[Path], full: bool, workers: int,
+              on_done: Optional[Callable[[int], object]] = None) -> Dict[Path, Optional[Dict[str, str]]]:
+    """Hash di più file con un pool di processi (seriale con workers<=1 o un solo file).
+    Per i file illeggibili il risultato è None; on_done(n) dopo ogni file."""
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    jobs = [(p, full) for p in paths]
+    results: List[Optional[Dict[str, str]]] = []
+    if workers <= 1 or len(jobs) < 2:
+        for j in jobs:
+            results.append(_hash_job(j))
+            if on_done: on_done(len(results))
+    else:
+        with process_pool(min(workers, len(jobs))) as pool:
+            for res in pool.map(_hash_job, jobs):
+                results.append(res)
+                if on_done: on_done(len(results))
+    return dict(zip(paths, results))
@@ -0,0 +1,221 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# model_header.py — FocusCatalog
+# Legge solo l'header dei file .safetensors (JSON preceduto dalla lunghezza) e
+# .gguf (sezione chiave/valore) senza toccare i pesi: architettura di base,
+# metadati di training (ss_*), tipo (LoRA/Checkpoint) dai nomi dei tensori e
+# tag candidati come trigger words. Letture limitate: una (al massimo due) read.
+# -*- coding: utf-8 -*-
+
+import json
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+PROBE_BYTES = 64 * 1024                 # prima lettura, basta per quasi tutti gli header
+SAFETENSORS_MAX_HEADER = 32 * 1024 * 1024
+GGUF_MAX_BYTES = PROBE_BYTES
+MAX_TRIGGER_CANDIDATES = 20
+
+# Metadati di training kohya-ss conservati nell'index
+TRAINING_KEYS = ("ss_base_model_version", "ss_network_module", "ss_network_dim", "ss_network_alpha",
+                 "ss_resolution", "ss_num_epochs", "ss_output_name", "ss_sd_model_name")
+
+# Prefissi dei tensori → architettura (primo che corrisponde)
+ARCH_PATTERNS = (
+    ("double_blocks.", "flux"),
+    ("model.diffusion_model.double_blocks.", "flux"),
+    ("model.diffusion_model.joint_blocks.", "sd3"),
+    ("conditioner.embedders.1.", "sdxl"),
+    ("lora_te2_", "sdxl"),
+    ("cond_stage_model.model.", "sd2"),
+    ("cond_stage_model.transformer.", "sd1"),
+)
+LORA_MARKERS = ("lora_up", "lora_down", "lora_A", "lora_B", "lora_unet_", "lora_te", ".hada_w", ".lokr_w")
+
+
+def read_header(path: Path) -> Optional[Dict[str, Any]]:
+    """Info dall'header del file, None se il formato non è supportato o illeggibile."""
+    ext = path.suffix.lower()
+    try:
+        if ext == ".safetensors":
+            return safetensors_info(path)
+        if ext == ".gguf":
+            return gguf_info(path)
+    except (OSError, ValueError, EOFError, struct.error):  # EOFError: file più corto dell'header
+        pass
+    return None
+
+
+# ------------------------ safetensors ------------------------
+def read_safetensors_header(path: Path) -> Dict[str, Any]:
+    """Header JSON: 8 byte little-endian con la lunghezza, poi il JSON."""
+    with open(path, "rb") as fh:
+        head = fh.read(PROBE_BYTES)
+        if len(head) < 8:
+            raise ValueError("file troppo corto")
+        (n,) = struct.unpack("<Q", head[:8])
+        if n > SAFETENSORS_MAX_HEADER:
+            raise ValueError("header safetensors troppo grande")
+        raw = head[8:8 + n]
+        if len(raw) < n:
+            raw += fh.read(n - len(raw))
+    return json.loads(raw.decode("utf-8"))
+
+
+def safetensors_info(path: Path) -> Dict[str, Any]:
+    header = read_safetensors_header(path)
+    if not isinstance(header, dict):
+        raise ValueError("header safetensors non è un oggetto JSON")
+    meta = header.pop("__metadata__", None) or {}
+    if not isinstance(meta, dict):
+        raise ValueError("__metadata__ non è un oggetto JSON")
+    names = list(header.keys())
+    info = _info("safetensors", names, meta)
+    arch = meta.get("modelspec.architecture") or ""
+    if isinstance(arch, str) and arch:
+        info["architecture"] = arch.split("/")[0]
+        if arch.endswith("/lora"):
+            info["kind"] = "LoRA"
+    module = meta.get("ss_network_module")
+    if isinstance(module, str) and "lora" in module.lower():
+        info["kind"] = "LoRA"
+    return info
+
+
+# ------------------------ gguf ------------------------
+_GGUF_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?",
+                 10: "<Q", 11: "<q", 12: "<d"}
+_GGUF_STRING, _GGUF_ARRAY = 8, 9
+
+
+class _Buf:
+    """Lettore su un buffer limitato: oltre la fine solleva EOFError."""
+
+    def __init__(self, data: bytes):
+        self.data, self.pos = data, 0
+
+    def take(self, n: int) -> bytes:
+        if self.pos + n > len(self.data):
+            raise EOFError
+        out = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return out
+
+    def unpack(self, fmt: str):
+        return struct.unpack(fmt, self.take(struct.calcsize(fmt)))[0]
+
+    def string(self, len_fmt: str) -> str:
+        return self.take(self.unpack(len_fmt)).decode("utf-8", "replace")
+
+
+def _gguf_value(buf: _Buf, vtype: int, len_fmt: str):
+    if vtype in _GGUF_SCALARS:
+        return buf.unpack(_GGUF_SCALARS[vtype])
+    if vtype == _GGUF_STRING:
+        return buf.string(len_fmt)
+    if vtype == _GGUF_ARRAY:
+        etype, count = buf.unpack("<I"), buf.unpack(len_fmt)
+        return [_gguf_value(buf, etype, len_fmt) for _ in range(count)]
+    raise ValueError(f"tipo GGUF sconosciuto: {vtype}")
+
+
+def read_gguf_kv(path: Path, max_bytes: int = GGUF_MAX_BYTES) -> Dict[str, Any]:
+    """Coppie chiave/valore dell'header GGUF contenute nei primi max_bytes.
+    Le chiavi general.* vengono prima dei vocabolari del tokenizer: ci si ferma
+    al primo valore che non sta nel buffer invece di leggere oltre."""
+    with open(path, "rb") as fh:
+        buf = _Buf(fh.read(max_bytes))
+    if buf.take(4) != b"GGUF":
+        raise ValueError("magic GGUF mancante")
+    version = buf.unpack("<I")
+    len_fmt = "<I" if version == 1 else "<Q"
+    buf.unpack(len_fmt)  # numero di tensori
+    kv_count = buf.unpack(len_fmt)
+    out: Dict[str, Any] = {}
+    try:
+        for _ in range(kv_count):
+            key = buf.string(len_fmt)
+            out[key] = _gguf_value(buf, buf.unpack("<I"), len_fmt)
+    except EOFError:
+        pass
+    return out
+
+
+def gguf_info(path: Path) -> Dict[str, Any]:
+    kv = read_gguf_kv(path)
+    info = _info("gguf", [], {})
+    arch = kv.get("general.architecture")
+    if isinstance(arch, str) and arch:
+        info["architecture"] = arch
+    if kv.get("general.type") == "adapter" or kv.get("adapter.type") == "lora":
+        info["kind"] = "LoRA"
+    elif kv.get("general.type") == "model":
+        info["kind"] = "Checkpoint"
+    return info
+
+
+# ------------------------ interpretazione ------------------------
+def _info(fmt: str, names: List[str], meta: Dict[str, Any]) -> Dict[str, Any]:
+    info: Dict[str, Any] = {"format": fmt, "kind": None, "architecture": None}
+    if names:
+        info["tensors"] = len(names)
+        info["architecture"] = _arch_from_names(names)
+        if any(m in n for n in names for m in LORA_MARKERS):
+            info["kind"] = "LoRA"
+        elif any(n.startswith("model.diffusion_model.") for n in names):
+            info["kind"] = "Checkpoint"
+    # __metadata__ arriva dal file: si tengono solo valori scalari
+    training = {k: v for k in TRAINING_KEYS for v in [meta.get(k)]
+                if isinstance(v, (str, int, float)) and v not in ("", "None")}
+    if training:
+        info["training"] = training
+        base = training.get("ss_base_model_version")
+        info["base_model"] = base if isinstance(base, str) else None
+    candidates = trigger_candidates(meta.get("ss_tag_frequency"))
+    if candidates:
+        info["trigger_candidates"] = candidates
+    return info
+
+
+def _arch_from_names(names: List[str]) -> Optional[str]:
+    for prefix, arch in ARCH_PATTERNS:
+        if any(n.startswith(prefix) for n in names):
+            return arch
+    return None
+
+
+def trigger_candidates(tag_frequency, limit: int = MAX_TRIGGER_CANDIDATES) -> List[str]:
+    """Tag più frequenti del dataset di training (ss_tag_frequency, JSON
+    {dataset: {tag: conteggio}}), sommati su tutti i dataset."""
+    if isinstance(tag_frequency, str):
+        try:
+            tag_frequency = json.loads(tag_frequency)
+        except ValueError:
+            return []
+    if not isinstance(tag_frequency, dict):
+        return []
+    totals: Dict[str, int] = {}
+    for tags in tag_frequency.values():
+        if not isinstance(tags, dict):
+            continue
+        for tag, count in tags.items():
+            tag = (tag or "").strip()
+            if tag:
+                try:
+                    totals[tag] = totals.get(tag, 0) + int(count)
+                except (TypeError, ValueError):
+                    continue
+    return [t for t, _ in sorted(totals.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]]
@@ -0,0 +1,169 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# preview_refs.py — FocusCatalog
+# Manifest delle preview referenziate da ogni item (out/.preview_refs.json),
+# aggiornato a ogni scrittura dell'index: le immagini che nessun item usa più
+# diventano "orfane" e il garbage collector elimina solo quelle, invece di
+# percorrere tutto assets/previews. Le varianti (foo.320.webp) seguono la base.
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+import image_variants
+import index_store
+
+REFS_NAME = ".preview_refs.json"
+REFS_VERSION = 1
+PREFIX = "assets/previews/"
+GRACE_S = 600  # file più recenti di così non vengono mai cancellati
+
+
+def refs_path(out_dir: Path) -> Path:
+    return Path(out_dir) / REFS_NAME
+
+
+def item_refs(item: Dict[str, Any]) -> List[str]:
+    """Preview (immagini base) sotto assets/previews usate da un item."""
+    return sorted({rel for rel in item.get("previews") or [] if rel.startswith(PREFIX)})
+
+
+def load(out_dir: Path) -> Dict[str, Any]:
+    try:
+        data = json.loads(refs_path(out_dir).read_text(encoding="utf-8"))
+        if data.get("version") == REFS_VERSION:
+            return data
+    except (OSError, ValueError):
+        pass
+    # swept=False: i file precedenti al manifest non sono mai stati registrati,
+    # il primo GC percorre tutto l'albero
+    return {"version": REFS_VERSION, "swept": False, "refs": {}, "orphans": []}
+
+
+def save(out_dir: Path, data: Dict[str, Any]):
+    index_store.atomic_write_text(refs_path(out_dir), json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+
+
+def _all_refs(refs: Dict[str, List[str]]) -> Set[str]:
+    out: Set[str] = set()
+    for rels in refs.values():
+        out.update(rels)
+    return out
+
+
+def sync(out_dir: Path, items: Iterable[Dict[str, Any]]) -> int:
+    """Sostituisce i riferimenti con quelli degli item appena scritti; le preview
+    non più referenziate da nessun item si aggiungono agli orfani. Chiamata da
+    index_store.write_index sotto index_lock. Restituisce i nuovi orfani."""
+    data = load(out_dir)
+    refs = {}
+    for it in items:
+        rels = item_refs(it)
+        if rels and it.get("slug"):
+            refs[it["slug"]] = rels
+    if refs == data["refs"]:
+        return 0
+    live = _all_refs(refs)
+    dropped = _all_refs(data["refs"]) - live
+    orphans = (set(data["orphans"]) | dropped) - live
+    data.update(refs=refs, orphans=sorted(orphans))
+    save(out_dir, data)
+    return len(dropped)
+
+
+def _variant_key(rel: str) -> Tuple[str, str]:
+    """(cartella, stem della base) di una variante foo.320.webp → foo."""
+    d, _, name = rel.rpartition("/")
+    return d, name.rsplit(".", 2)[0]
+
+
+def _candidates(out_dir: Path, orphans: List[str]) -> List[str]:
+    """Orfani registrati più le loro varianti (esistenti o meno: il costo è una stat)."""
+    out: List[str] = []
+    for rel in orphans:
+        out.append(rel)
+        base = Path(rel)
+        out.extend(image_variants.variant_path(base, w, fmt).as_posix()
+                   for w in image_variants.THUMB_SIZES for fmt in image_variants.FORMAT_PREFERENCE)
+    return out
+
+
+def _walk(out_dir: Path) -> List[str]:
+    root = Path(out_dir) / PREFIX
+    out: List[str] = []
+    for dirpath, _, files in os.walk(root):
+        rel_dir = Path(dirpath).relative_to(out_dir).as_posix()
+        out.extend(f"{rel_dir}/{name}" for name in files)
+    return out
+
+
+def collect(out_dir: Path, dry_run: bool = False, full: bool = False, grace: float = GRACE_S) -> Dict[str, Any]:
+    """Rimuove le preview non referenziate. Di norma esamina solo gli orfani
+    registrati (costo proporzionale a quanto è cambiato); con full=True, o se
+    l'albero non è mai stato percorso, tutto assets/previews. I file modificati da
+    meno di `grace` secondi restano (es. download del server non ancora nell'index)
+    e gli orfani tra questi vengono riesaminati al prossimo giro. Le cartelle rimaste
+    vuote vengono eliminate. Con dry_run non cancella nulla e riporta solo quanto
+    si recupererebbe. Va chiamata sotto index_lock."""
+    out_dir = Path(out_dir)
+    data = load(out_dir)
+    full = full or not data.get("swept")
+    live = _all_refs(data["refs"])
+    live_bases = {(rel.rpartition("/")[0], Path(rel).stem) for rel in live}
+    candidates = _walk(out_dir) if full else _candidates(out_dir, data["orphans"])
+    report = {"full": full, "dry_run": dry_run, "checked": len(candidates), "files": 0, "bytes": 0, "dirs": 0}
+    cutoff = time.time() - grace
+    kept: List[str] = []
+    dirs: Set[Path] = set()
+    for rel in candidates:
+        if rel in live or (image_variants.is_variant(Path(rel)) and _variant_key(rel) in live_bases):
+            continue
+        p = out_dir / rel
+        try:
+            st = p.stat()
+            if st.st_mtime > cutoff:
+                kept.append(rel)
+                continue
+            if not dry_run:
+                p.unlink()
+        except OSError:
+            continue
+        report["files"] += 1
+        report["bytes"] += st.st_size
+        dirs.add(p.parent)
+    if dry_run:
+        return report
+    root = out_dir / PREFIX.rstrip("/")
+    for d in sorted(dirs, key=lambda x: len(x.parts), reverse=True):
+        if d != root:
+            try:
+                d.rmdir()
+                report["dirs"] += 1
+            except OSError:
+                pass  # non vuota
+    data.update(orphans=sorted(set(kept) & set(data["orphans"]) if not full else set(kept) - live), swept=True)
+    save(out_dir, data)
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    return "{} file, {:.1f} MB{} ({} esaminati{}){}".format(
+        report["files"], report["bytes"] / (1024 * 1024),
+        "" if report["dry_run"] else ", {} cartelle".format(report["dirs"]),
+        report["checked"], ", albero completo" if report["full"] else "",
+        " — simulazione, nulla è stato cancellato" if report["dry_run"] else "")
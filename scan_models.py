@@ -18,17 +18,37 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import glob
+import hashlib
 import json
+import os
 import re
-import requests
+import time
+from contextlib import nullcontext
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
-from PIL import Image
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+import fswalk
+import image_variants
+import index_store
+import metrics
+import model_hash
+import model_header
+import preview_refs
+from civitai_client import CivitaiClient
 
 MODEL_EXT = {".safetensors", ".ckpt", ".pt", ".bin", ".gguf"}
 IMG_EXT = {".png", ".jpg", ".jpeg", ".webp"}
 
+# Cache di stato della scansione (accanto a index.json): per ogni file modello
+# conserva firma (size, mtime_ns, inode), sorgenti preview e item calcolato.
+STATE_NAME = ".scan_state.json"
+METRICS_NAME = ".scan_metrics.json"
+STATE_VERSION = 1
+STREAM_CHUNK = 256  # modelli per blocco (impronte + miniature) con --stream o checkpoint attivi
+
 # ========== Utility di base ==========
 def slugify(name: str) -> str:
     s = re.sub(r"[^a-zA-Z0-9._-]+", "-", name.strip())
@@ -42,7 +62,11 @@ def nice_name(file: Path) -> str:
     base = re.sub(r"\.[0-9a-f]{5,}$", "", base, flags=re.I)
     return base.strip() or file.stem
 
-def detect_type(file: Path) -> str:
+def detect_type(file: Path, header: Optional[Dict[str, Any]] = None) -> str:
+    """Tipo dal contenuto dell'header (nomi dei tensori/metadati) se disponibile,
+    altrimenti dal percorso."""
+    if header and header.get("kind"):
+        return header["kind"]
     p = file.as_posix().lower()
     if "lora" in p or "loras" in p or "lora" in file.parent.name.lower():
         return "LoRA"
@@ -50,55 +74,202 @@ def detect_type(file: Path) -> str:
         return "Checkpoint"
     return "Model"
 
+# Campi dell'item ricavati dall'header del file (model_header.py)
+HEADER_FIELDS = ("format", "architecture", "base_model", "triggerCandidates", "training")
+
+def header_fields(file: Path, header: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    h = header or {}
+    out = {
+        "format": h.get("format") or file.suffix.lower().lstrip("."),
+        "architecture": h.get("architecture"),
+        "base_model": h.get("base_model"),
+        "triggerCandidates": h.get("trigger_candidates"),
+        "training": h.get("training"),
+    }
+    return {k: v for k, v in out.items() if v}
+
 def find_local_previews(file: Path) -> List[Path]:
-    out: List[Path] = []
-    for ext in IMG_EXT:
-        direct = file.with_suffix(ext)
-        if direct.exists():
-            out.append(direct)
-    if not out:
-        for ext in IMG_EXT:
-            cand = file.parent / (file.stem + ext)
-            if cand.exists():
-                out.append(cand)
-    return out
+    """Preview accanto a un singolo file (percorso del watcher); la scansione
+    completa le ricava dai listing di fswalk senza exists() per file."""
+    return [p for p in (file.with_suffix(ext) for ext in sorted(IMG_EXT)) if p.exists()]
 
-def ensure_thumb(infile: Path, outfile: Path, size=(640, 640)) -> bool:
+def thumb_is_fresh(infile: Path, outfile: Path, formats=()) -> bool:
+    """True se esiste già una miniatura (.jpg/.png) più recente della sorgente,
+    insieme alle sue varianti nei formati richiesti."""
+    try:
+        src_mtime = infile.stat().st_mtime_ns
+    except OSError:
+        return False
+    for ext in (".jpg", ".png"):
+        try:
+            if outfile.with_suffix(ext).stat().st_mtime_ns >= src_mtime:
+                return image_variants.variants_fresh(outfile.with_suffix(ext), src_mtime, formats)
+        except OSError:
+            pass
+    return False
+
+def write_thumb(infile: Path, outfile: Path, size=(640, 640), formats=()) -> Optional[Path]:
+    """Ridimensiona infile entro size e lo salva come outfile .png (se trasparente)
+    o .jpg, più le varianti 160/320/640 nei formati indicati (image_variants);
+    restituisce il percorso scritto, None se l'immagine non è leggibile."""
+    from PIL import Image  # import differito: le scansioni senza miniature nuove non lo pagano
     try:
         outfile.parent.mkdir(parents=True, exist_ok=True)
         with Image.open(infile) as im:
+            # Per i JPEG decodifica direttamente a scala ridotta (DCT scaling)
+            if im.format == "JPEG":
+                im.draft(im.mode, size)
             im.thumbnail(size)
             if im.mode in ("RGBA", "LA") or getattr(im, "info", {}).get("transparency"):
-                im.save(outfile.with_suffix(".png"))
+                dest = outfile.with_suffix(".png")
+                im.save(dest)
             else:
                 im = im.convert("RGB")
-                im.save(outfile.with_suffix(".jpg"), quality=90, optimize=True)
-        return True
+                dest = outfile.with_suffix(".jpg")
+                im.save(dest, quality=90, optimize=True)
+            image_variants.write_variants(im, dest, formats)
+        return dest
     except Exception:
-        return False
+        return None
+
+def _thumb_status(infile: Path, outfile: Path, size=(640, 640), formats=()) -> str:
+    if thumb_is_fresh(infile, outfile, formats):
+        return "skipped"
+    return "built" if write_thumb(infile, outfile, size, formats) is not None else "failed"
+
+def ensure_thumb(infile: Path, outfile: Path, size=(640, 640), formats=()) -> bool:
+    return _thumb_status(infile, outfile, size, formats) != "failed"
+
+def _thumb_job(job) -> str:
+    return _thumb_status(*job)
+
+def run_thumb_jobs(jobs: List[tuple], workers: int, on_done=None) -> Dict[Path, bool]:
+    """Genera le miniature (sorgente, destinazione[, size, formati]) con un pool di processi.
+    Con workers<=1 o pochi job resta seriale; il risultato è identico.
+    on_done(n) viene chiamata dopo ogni miniatura completata."""
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    results: List[str] = []
+    if workers <= 1 or len(jobs) < 2:
+        for j in jobs:
+            results.append(_thumb_job(j))
+            if on_done: on_done(len(results))
+    else:
+        with model_hash.process_pool(min(workers, len(jobs))) as pool:
+            for status in pool.map(_thumb_job, jobs, chunksize=4):
+                results.append(status)
+                if on_done: on_done(len(results))
+    mt = metrics.current()
+    for status in results:
+        mt.count("thumbs_" + status)
+    return {job[0]: status != "failed" for job, status in zip(jobs, results)}
+
+class Progress:
+    """Eventi di avanzamento NDJSON su stdout (--progress), letti da server.py.
+    tick() è limitato a un evento ogni `interval` secondi; emit() scrive sempre.
+    Anche i messaggi per l'utente passano da qui (log): con `sink` ogni riga va
+    a quella funzione invece che su stdout (scansione in-process del server)."""
+
+    def __init__(self, enabled: bool, interval: float = 0.5, sink: Optional[Callable[[str], Any]] = None):
+        self.enabled = enabled
+        self.interval = interval
+        self.sink = sink or (lambda line: print(line, flush=True))
+        self.counters: Dict[str, Any] = {"phase": "walk", "files_scanned": 0, "models_found": 0,
+                                         "hashes_total": 0, "hashes_done": 0,
+                                         "thumbs_total": 0, "thumbs_built": 0,
+                                         "civitai_pending": 0, "civitai_done": 0,
+                                         "lookup_total": 0, "lookup_done": 0, "lookup_found": 0,
+                                         "walk_syscalls": 0}
+        self._last = 0.0
+
+    def emit(self, event: str = "progress", **fields):
+        self.counters.update(fields)
+        if self.enabled:
+            self.sink(json.dumps({"event": event, **self.counters}, ensure_ascii=False))
+            self._last = time.monotonic()
+
+    def tick(self, **fields):
+        self.counters.update(fields)
+        if self.enabled and time.monotonic() - self._last >= self.interval:
+            self.emit()
+
+    def record(self, event: str, **fields):
+        """Record NDJSON senza contatori (item e rimozioni di --stream)."""
+        if self.enabled:
+            self.sink(json.dumps({"event": event, **fields}, ensure_ascii=False))
+
+    def log(self, msg: str):
+        self.sink(msg)
+
+def file_sig(st, ino: Optional[int] = None) -> List[int]:
+    return [st.st_size, st.st_mtime_ns, st.st_ino if ino is None else ino]
+
+def preview_sources_sig(previews: List[Path]) -> Dict[str, List[int]]:
+    out: Dict[str, List[int]] = {}
+    for p in previews:
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        out[str(p)] = [st.st_size, st.st_mtime_ns]
+    return out
+
+def load_scan_state(state_path: Path) -> Dict[str, Dict[str, Any]]:
+    if state_path.exists():
+        try:
+            data = json.loads(state_path.read_text(encoding="utf-8"))
+            if data.get("version") == STATE_VERSION:
+                return data.get("files") or {}
+        except Exception:
+            pass
+    return {}
+
+def save_scan_state(state_path: Path, files: Dict[str, Dict[str, Any]]):
+    payload = {"version": STATE_VERSION, "files": files}
+    index_store.atomic_write_text(state_path, json.dumps(payload, ensure_ascii=False, separators=(",", ":")))
+
+def collect_thumbs(sources: List[Path], slug: str, previews_root: Path, out_dir: Path) -> List[str]:
+    thumbs: List[str] = []
+    saved_dir = (previews_root / slug)
+    for p in sources:
+        for cand in saved_dir.glob(glob.escape(p.stem) + ".*"):  # nomi con [..] non sono pattern
+            if image_variants.is_variant(cand):
+                continue
+            rel = str(cand.relative_to(out_dir)).replace("\\", "/")
+            if rel not in thumbs:
+                thumbs.append(rel)
+    return thumbs
 
 def load_existing_index(index_path: Path) -> Dict[str, Dict[str, Any]]:
+    """Metadati da preservare per slug; gli item sono letti uno alla volta
+    (riga per riga con il formato a shard)."""
     m: Dict[str, Dict[str, Any]] = {}
-    if index_path.exists():
+    if index_store.open_db(index_path) is not None or index_store.primary_path(index_path).exists():
         try:
-            data = json.loads(index_path.read_text(encoding="utf-8"))
-            for it in data.get("items", []):
+            for it in index_store.iter_items(index_path):
                 slug = it.get("slug")
                 if not slug:
                     continue
-                m[slug] = {
-                    "display_name": it.get("display_name"),
-                    "civitai_url": it.get("civitai_url"),
-                    "previews": it.get("previews", []),
-                    # NEW: manteniamo eventuali triggerWords già presenti
-                    "triggerWords": it.get("triggerWords"),
-                    "triggerWordsChecked": it.get("triggerWordsChecked"),
-                    "triggerWordsNotFound": it.get("triggerWordsNotFound"),
-                }
+                m[slug] = item_meta(it)
         except Exception:
             pass
     return m
 
+def item_meta(it: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "filename": it.get("filename"),
+        "fingerprint": it.get("fingerprint"),
+        "display_name": it.get("display_name"),
+        "civitai_url": it.get("civitai_url"),
+        "previews": it.get("previews", []),
+        "preview_variants": it.get("preview_variants"),
+        # NEW: manteniamo eventuali triggerWords già presenti
+        "triggerWords": it.get("triggerWords"),
+        "triggerWordsChecked": it.get("triggerWordsChecked"),
+        "triggerWordsNotFound": it.get("triggerWordsNotFound"),
+        "civitaiLookupHash": it.get("civitaiLookupHash"),
+    }
+
 # ========== Funzioni Trigger Words Civitai ==========
 def _civitai_model_id(url: str):
     if not url:
@@ -106,13 +277,8 @@ def _civitai_model_id(url: str):
     m = re.search(r"/models/(\d+)", url)
     return m.group(1) if m else None
 
-def _fetch_civitai_trigger_words(model_id: str, timeout=12) -> List[str]:
-    api = f"https://civitai.com/api/v1/models/{model_id}"
-    r = requests.get(api, timeout=timeout, headers={
-        "User-Agent": "FocusCatalog/1.0 (+local)"
-    })
-    r.raise_for_status()
-    data = r.json()
+def _fetch_civitai_trigger_words(client: CivitaiClient, model_id: str) -> List[str]:
+    data = client.model(model_id)
     words = set()
     for v in (data.get("modelVersions") or []):
         for w in (v.get("trainedWords") or []):
@@ -121,133 +287,897 @@ def _fetch_civitai_trigger_words(model_id: str, timeout=12) -> List[str]:
                 words.add(w)
     return sorted(words)
 
+# ========== Fasi della scansione ==========
+def state_by_sig(scan_state: Dict[str, Dict[str, Any]]) -> Dict[tuple, Dict[str, Any]]:
+    """Record di stato indicizzati per firma (size, mtime_ns, inode): una rinomina
+    mantiene la firma, quindi il file ritrova hash e slug precedenti."""
+    return {tuple(rec.get("sig") or ()): rec for rec in scan_state.values()}
+
+def scan_entry(f: Path, st, scan_state: Dict[str, Dict[str, Any]], out_dir: Path,
+               by_sig: Optional[Dict[tuple, Dict[str, Any]]] = None,
+               previews: Optional[List[tuple]] = None, ino: Optional[int] = None) -> Dict[str, Any]:
+    """Entry di stato di un file modello: riusa item e miniature dalla cache se
+    firma e sorgenti preview sono invariate, altrimenti ricalcola i campi base.
+    Un file rinominato (stessa firma, vecchio percorso sparito) riusa gli hash e
+    ricorda lo slug precedente in prev_slug, per non perdere i metadati; le
+    miniature della vecchia cache (anche quella del vecchio percorso) finiscono in
+    stale_thumbs: make_item scarta quelle la cui immagine sorgente non c'è più.
+    previews = [(path, stat)] già raccolte dal walker (altrimenti si cercano su disco)."""
+    sig = file_sig(st, ino)
+    if previews is None:
+        sources = find_local_previews(f)
+        sources_sig = preview_sources_sig(sources)
+    else:
+        sources = [p for p, _ in previews]
+        sources_sig = {str(p): [pst.st_size, pst.st_mtime_ns] for p, pst in previews}
+
+    cached = scan_state.get(str(f))
+    if cached and cached.get("sig") == sig:
+        # sorgenti senza miniature in cache (es. nomi con [..] prima del glob.escape): si rifanno
+        if (cached.get("sources") == sources_sig and "variants" in cached
+                and (cached.get("thumbs") or not sources_sig)
+                and all((out_dir / rel).exists() for rel in cached.get("thumbs", []))):
+            item = cached["item"]
+            if "format" not in item:  # stato scritto prima della lettura degli header
+                header = model_header.read_header(f)
+                item = dict(item, type=detect_type(f, header), **header_fields(f, header))
+            return {"sig": sig, "sources": sources_sig, "thumbs": cached.get("thumbs", []),
+                    "variants": cached["variants"], "item": item, "hash": cached.get("hash"), "paths": sources,
+                    "prev_slug": cached.get("prev_slug"), "reused": True}
+        hashes, prev_slug, stale = cached.get("hash"), None, cached.get("thumbs") or []
+    else:
+        stale = []
+        prev = (by_sig or {}).get(tuple(sig))
+        prev_file = (prev or {}).get("item", {}).get("filename")
+        if prev and prev_file != str(f) and not Path(prev_file).exists():
+            hashes, prev_slug, stale = prev.get("hash"), prev["item"].get("slug"), prev.get("thumbs") or []
+        else:
+            hashes, prev_slug = None, None
+
+    name = nice_name(f)
+    header = model_header.read_header(f)
+    base = {
+        "name": name,
+        "slug": slugify(name),
+        "type": detect_type(f, header),
+        "filename": str(f),
+        "folder": str(f.parent),
+        "size_mb": round(st.st_size / (1024 * 1024), 2),
+        "modified": datetime.fromtimestamp(st.st_mtime).isoformat(timespec="seconds"),
+        **header_fields(f, header),
+    }
+    return {"sig": sig, "sources": sources_sig, "thumbs": None, "item": base, "paths": sources,
+            "hash": hashes, "prev_slug": prev_slug, "stale_thumbs": stale}
+
+def needs_hash(e: Dict[str, Any], mode: str) -> bool:
+    if mode not in ("quick", "full"):
+        return False
+    return not (e.get("hash") and (mode != "full" or e["hash"].get("sha256")))
+
+def compute_hashes(entries: List[Dict[str, Any]], mode: str, jobs: int, progress: "Progress",
+                   done: int = 0, total: Optional[int] = None) -> int:
+    """Impronte (--hash quick|full) solo per i file senza hash in cache.
+    done/total: avanzamento complessivo quando si procede a blocchi. Restituisce i file hashati."""
+    if mode not in ("quick", "full"):
+        return 0
+    todo = [e for e in entries if needs_hash(e, mode)]
+    progress.emit(phase="hash", hashes_total=len(todo) if total is None else total)
+    if not todo:
+        return 0
+    paths = [Path(e["item"]["filename"]) for e in todo]
+    hashed = model_hash.hash_many(paths, mode == "full", jobs, on_done=lambda n: progress.tick(hashes_done=done + n))
+    metrics.current().count("hashes_computed", len(paths))
+    for e, p in zip(todo, paths):
+        if hashed.get(p):
+            e["hash"] = hashed[p]
+    return len(todo)
+
+def _slug_suffix(filename: str) -> str:
+    return hashlib.sha1(filename.encode("utf-8")).hexdigest()[:8]
+
+def _renamed_from(e: Dict[str, Any], existing_meta: Dict[str, Dict[str, Any]],
+                  slug_by_fp: Dict[str, str]) -> Optional[str]:
+    """Slug del file di cui e è la rinomina (stessa firma o stessa impronta, vecchio
+    percorso sparito), None se è un file nuovo o una copia."""
+    if e.get("prev_slug"):
+        return e["prev_slug"]
+    slug = slug_by_fp.get((e.get("hash") or {}).get("quick") or "")
+    old = existing_meta[slug].get("filename") if slug else None
+    if old and old != e["item"]["filename"] and not Path(old).exists():
+        return slug
+    return None
+
+def resolve_slugs(entries: List[Dict[str, Any]], existing_meta: Dict[str, Dict[str, Any]], taken=frozenset()):
+    """Slug univoci e deterministici. Un file già nell'index mantiene il suo slug;
+    uno rinominato può riprendere il proprio slug precedente se coincide con quello
+    base o, come un file nuovo, lo slug base se nessuno lo usa. Gli slug dell'index
+    rimasti senza file non vanno a file nuovi (ne erediterebbero link e preview):
+    questi ricevono un suffisso dall'hash del percorso. Gli slug in `taken`
+    appartengono a file fuori da `entries` e non vengono riassegnati."""
+    current = {m.get("filename"): slug for slug, m in existing_meta.items()}
+    slug_by_fp = {m["fingerprint"]: slug for slug, m in existing_meta.items() if m.get("fingerprint")}
+    used = set(taken)
+    fresh: List[Dict[str, Any]] = []
+    for e in sorted(entries, key=lambda e: e["item"]["filename"]):
+        slug = current.get(e["item"]["filename"])
+        if slug and slug not in used:
+            used.add(slug)
+            _set_slug(e, slug)
+        else:
+            fresh.append(e)
+    for e in fresh:
+        base = slugify(e["item"]["name"])
+        prev = _renamed_from(e, existing_meta, slug_by_fp)
+        free = base not in used and (base not in existing_meta or base == prev)
+        slug = base if free else "{}-{}".format(base, _slug_suffix(e["item"]["filename"]))
+        used.add(slug)
+        _set_slug(e, slug)
+
+def _set_slug(e: Dict[str, Any], slug: str):
+    if e["item"]["slug"] != slug:
+        e["item"] = dict(e["item"], slug=slug)
+        e["thumbs"] = None  # miniature da rigenerare nella cartella del nuovo slug
+
+def mark_duplicates(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Marca i file con lo stesso sha256 con la lista degli altri percorsi in
+    `duplicates`. Con la sola impronta rapida (--hash quick: dimensione e primi/ultimi
+    64 KiB) il contenuto non è confermato: quei file finiscono in `possible_duplicates`
+    e non contano come spazio sprecato."""
+    by_sha: Dict[str, List[Dict[str, Any]]] = {}
+    by_fp: Dict[str, List[Dict[str, Any]]] = {}
+    for it in items:
+        it.pop("duplicates", None)
+        it.pop("possible_duplicates", None)
+        if it.get("sha256"):
+            by_sha.setdefault(it["sha256"], []).append(it)
+        if it.get("fingerprint"):
+            by_fp.setdefault(it["fingerprint"], []).append(it)
+    dup_groups, possible_groups, wasted = 0, 0, 0.0
+    for group in by_sha.values():
+        if len(group) < 2:
+            continue
+        dup_groups += 1
+        wasted += sum(it.get("size_mb") or 0 for it in group[1:])
+        for it in group:
+            it["duplicates"] = [o["filename"] for o in group if o is not it]
+    for group in by_fp.values():
+        if len(group) < 2 or all(it.get("sha256") for it in group):
+            continue  # con tutti gli sha256 decide il raggruppamento sopra
+        possible_groups += 1
+        for it in group:
+            others = [o["filename"] for o in group if o is not it and not (it.get("sha256") and o.get("sha256"))]
+            if others:
+                it["possible_duplicates"] = others
+    return {"groups": dup_groups, "wasted_mb": round(wasted, 2), "possible_groups": possible_groups}
+
+def thumb_jobs_for(entries: List[Dict[str, Any]], out_dir: Path, formats) -> List[tuple]:
+    previews_root = out_dir / "assets" / "previews"
+    return list(dict.fromkeys((p, previews_root / e["item"]["slug"] / p.name, (640, 640), tuple(formats))
+                              for e in entries if e["thumbs"] is None for p in e.get("paths", [])))
+
+def build_thumbs(entries: List[Dict[str, Any]], out_dir: Path, jobs: int, progress: "Progress",
+                 formats=image_variants.DEFAULT_FORMATS, done: int = 0, total: Optional[int] = None) -> int:
+    """Miniature e varianti (in parallelo) solo per le entry nuove/modificate;
+    dimensioni e hash dei file finiscono in e["variants"] (rel → descrizione).
+    done/total come in compute_hashes; restituisce le miniature elaborate."""
+    previews_root = out_dir / "assets" / "previews"
+    thumb_jobs = thumb_jobs_for(entries, out_dir, formats)
+    progress.emit(phase="thumbs", thumbs_total=len(thumb_jobs) if total is None else total)
+    built = run_thumb_jobs(thumb_jobs, jobs, on_done=lambda n: progress.tick(thumbs_built=done + n))
+    for e in entries:
+        if e["thumbs"] is None:
+            e["thumbs"] = collect_thumbs([p for p in e.get("paths", []) if built.get(p)],
+                                         e["item"]["slug"], previews_root, out_dir)
+            e["variants"] = {rel: info for rel in e["thumbs"]
+                             for info in [image_variants.describe(out_dir / rel, out_dir)] if info}
+    return len(thumb_jobs)
+
+def state_record(e: Dict[str, Any], checkpoint: bool = False) -> Dict[str, Any]:
+    rec = {"sig": e["sig"], "sources": e["sources"], "thumbs": e["thumbs"], "variants": e.get("variants") or {},
+           "item": e["item"], "hash": e.get("hash")}
+    if checkpoint and e.get("prev_slug"):
+        # solo nei checkpoint: una scansione ripresa ritrova i metadati del file rinominato
+        rec["prev_slug"] = e["prev_slug"]
+    return rec
+
+def find_meta(e: Dict[str, Any], existing_meta: Dict[str, Dict[str, Any]],
+              by_fp: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Metadati da preservare: per slug, poi per slug prima della rinomina,
+    poi per impronta del contenuto (file rinominato o spostato)."""
+    fp = (e.get("hash") or {}).get("quick")
+    return (existing_meta.get(e["item"]["slug"]) or existing_meta.get(e.get("prev_slug"))
+            or (by_fp.get(fp) if fp else None) or {})
+
+def meta_by_fingerprint(existing_meta: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    return {m["fingerprint"]: m for m in existing_meta.values() if m.get("fingerprint")}
+
+def make_item(e: Dict[str, Any], existing_meta: Dict[str, Dict[str, Any]], out_dir: Path,
+              cutoff: datetime, pending_triggers: List[tuple],
+              by_fp: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Item finale dell'index: campi base + metadati preservati da index.json."""
+    base, thumbs = e["item"], e["thumbs"]
+    name = base["name"]
+    slug = base["slug"]
+    mtype = base["type"]
+    mtime = datetime.fromisoformat(base["modified"])
+
+    ex = find_meta(e, existing_meta, by_fp or {})
+    stale = set(e.get("stale_thumbs") or ()) - set(thumbs)
+    previews_rel: List[str] = []
+    for rel in ex.get("previews", []):
+        p = out_dir / rel
+        if rel not in stale and p.exists():
+            previews_rel.append(str(p.relative_to(out_dir)).replace("\\", "/"))
+    for rel in thumbs:
+        if rel not in previews_rel:
+            previews_rel.append(rel)
+    known = dict(ex.get("preview_variants") or {}, **(e.get("variants") or {}))
+    variants = {rel: known[rel] for rel in previews_rel if rel in known}
+
+    item: Dict[str, Any] = {
+        "name": name,
+        "display_name": ex.get("display_name"),
+        "slug": slug,
+        "type": mtype,
+        "filename": base["filename"],
+        "folder": base["folder"],
+        "size_mb": base["size_mb"],
+        "modified": base["modified"],
+        "previews": previews_rel,
+        "preview_variants": variants or None,
+        "civitai_url": ex.get("civitai_url"),
+        "is_new": mtime >= cutoff,
+        # Manteniamo eventuali dati trigger words
+        "triggerWords": ex.get("triggerWords"),
+        "triggerWordsChecked": ex.get("triggerWordsChecked"),
+        "triggerWordsNotFound": ex.get("triggerWordsNotFound"),
+        "civitaiLookupHash": ex.get("civitaiLookupHash"),
+    }
+    for k in HEADER_FIELDS:
+        if base.get(k):
+            item[k] = base[k]
+    hashes = e.get("hash") or {}
+    if hashes.get("quick"):
+        item["fingerprint"] = hashes["quick"]
+    if hashes.get("sha256"):
+        item["sha256"] = hashes["sha256"]
+        item["autov2"] = model_hash.autov2(hashes["sha256"])
+
+    # --- NEW: Trigger Words solo per LoRA con link Civitai (raccolte e scaricate dopo) ---
+    is_lora = (mtype.lower() == "lora")
+    civitai_url = (item.get("civitai_url") or "").strip()
+    already_has_triggers = bool(item.get("triggerWords"))
+    already_checked = bool(item.get("triggerWordsChecked"))
+
+    if is_lora and civitai_url and (not already_has_triggers) and (not already_checked):
+        mid = _civitai_model_id(civitai_url)
+        if mid:
+            pending_triggers.append((item, mid))
+        else:
+            item["triggerWordsChecked"] = True
+    return item
+
+def fetch_trigger_words(pending_triggers: List[tuple], out_dir: Path, progress: "Progress"):
+    """Trigger Words da Civitai, in parallelo con rate limit e cache."""
+    if not pending_triggers:
+        return
+    client = CivitaiClient(cache_dir=out_dir / ".cache" / "civitai")
+    mids = list(dict.fromkeys(mid for _, mid in pending_triggers))
+    progress.emit(phase="civitai", civitai_pending=len(mids))
+    try:
+        fetched = client.fetch_many(lambda mid: _fetch_civitai_trigger_words(client, mid), mids,
+                                    on_done=lambda n: progress.tick(civitai_done=n, civitai_pending=len(mids) - n))
+    finally:
+        client.close()
+    for item, mid in pending_triggers:
+        tw = fetched.get(mid)
+        if isinstance(tw, Exception):
+            item["triggerWordsError"] = str(tw)[:200]
+        elif tw:
+            item["triggerWords"] = tw
+            item["triggerWordsChecked"] = True
+            item["triggerWordsNotFound"] = False
+        else:
+            item["triggerWords"] = []
+            item["triggerWordsChecked"] = True
+            item["triggerWordsNotFound"] = True
+
+def make_payload(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "counts": index_store.count_items(items),
+        "items": items,
+    }
+
+# ========== Ricerca Civitai per hash (bulk) ==========
+LOOKUP_BATCH = 50          # item applicati all'index per ogni scrittura atomica
+LOOKUP_PREVIEWS = 3        # preview scaricate per modello trovato
+LOOKUP_PREVIEW_MAX = 1280  # lato massimo delle preview salvate
+
+def _download_preview(client: CivitaiClient, url: str, dest: Path, formats=()) -> Optional[Path]:
+    tmp = dest.with_name(dest.name + ".part")
+    try:
+        client.download(url, tmp, headers={"Referer": "https://civitai.com/"})
+        return write_thumb(tmp, dest, (LOOKUP_PREVIEW_MAX, LOOKUP_PREVIEW_MAX), formats)
+    finally:
+        try: tmp.unlink()
+        except OSError: pass
+
+def _lookup_one(client: CivitaiClient, sha256: str, slug: str, out_dir: Path, formats=()):
+    """Versione Civitai per hash + preview scaricate (con le loro varianti);
+    None se l'hash è sconosciuto."""
+    vdata = client.version_by_hash(sha256)
+    if not vdata:
+        return None
+    urls = [im.get("url") for im in (vdata.get("images") or []) if im.get("url")]
+    previews: List[str] = []
+    variants: Dict[str, Any] = {}
+    for i, u in enumerate(urls[:LOOKUP_PREVIEWS]):
+        try:
+            saved = _download_preview(client, u, out_dir / "assets" / "previews" / slug / f"civitai_{i+1}", formats)
+        except Exception:
+            saved = None
+        if saved:
+            rel = str(saved.relative_to(out_dir)).replace("\\", "/")
+            previews.append(rel)
+            info = image_variants.describe(saved, out_dir)
+            if info:
+                variants[rel] = info
+    return vdata, previews, variants
+
+def _lookup_update(sha256: str, result):
+    """Funzione di aggiornamento dell'item per index_store.update_items."""
+    def apply(item):
+        item["civitaiLookupHash"] = sha256
+        if not result:
+            return
+        vdata, previews, variants = result
+        mname = (vdata.get("model") or {}).get("name") or item.get("display_name") or item.get("name")
+        vname = vdata.get("name") or ""
+        item["civitai_url"] = "https://civitai.com/models/{}?modelVersionId={}".format(vdata.get("modelId"), vdata.get("id"))
+        item["display_name"] = f"{mname} [{vname}]" if vname else mname
+        item["previews"] = list(item.get("previews") or []) + [p for p in previews if p not in (item.get("previews") or [])]
+        if variants:
+            item["preview_variants"] = dict(item.get("preview_variants") or {}, **variants)
+        if (item.get("type") or "").lower() == "lora":
+            words = sorted({(w or "").strip() for w in (vdata.get("trainedWords") or []) if (w or "").strip()})
+            item["triggerWords"] = words
+            item["triggerWordsChecked"] = True
+            item["triggerWordsNotFound"] = not words
+    return apply
+
+def civitai_lookup(out_dir: Path, jobs: int, progress: "Progress", retry: bool = False,
+                   batch: int = LOOKUP_BATCH, formats=image_variants.DEFAULT_FORMATS) -> Dict[str, int]:
+    """Collega in blocco i modelli senza civitai_url cercandone lo SHA-256 su Civitai.
+    Ogni lotto viene scritto subito (una scrittura atomica per lotto) e gli hash già
+    cercati restano in civitaiLookupHash: una ricerca interrotta riparte da dove era
+    arrivata, e i modelli sconosciuti non vengono richiesti di nuovo (salvo retry)."""
+    out_dir = Path(out_dir)
+    index_path = out_dir / "index.json"
+    state_path = out_dir / STATE_NAME
+    scan_state = load_scan_state(state_path)
+    unlinked = [it for it in index_store.read_index(index_path).get("items", [])
+                if it.get("slug") and not (it.get("civitai_url") or "").strip()]
+
+    # SHA-256 dalla cache di stato se la firma del file è invariata, altrimenti calcolato
+    shas: Dict[str, str] = {}
+    computed: Dict[str, Dict[str, Any]] = {}
+    need: List[Path] = []
+    for it in unlinked:
+        f = Path(it["filename"])
+        try:
+            sig = file_sig(f.stat())
+        except OSError:
+            continue
+        rec = scan_state.get(str(f)) or {}
+        cached = rec.get("hash") or {}
+        if rec.get("sig") == sig and cached.get("sha256"):
+            shas[str(f)] = cached["sha256"]
+        else:
+            need.append(f)
+    progress.emit(phase="hash", hashes_total=len(need), hashes_done=0)
+    for p, h in model_hash.hash_many(need, True, jobs, on_done=lambda n: progress.tick(hashes_done=n)).items():
+        if h:
+            shas[str(p)] = h["sha256"]
+            computed[str(p)] = h
+    if computed:
+        with index_store.index_lock(index_path):
+            state = load_scan_state(state_path)
+            for fname, h in computed.items():
+                if fname in state:
+                    state[fname]["hash"] = h
+            save_scan_state(state_path, state)
+
+    todo = [it for it in unlinked if shas.get(it["filename"])
+            and (retry or it.get("civitaiLookupHash") != shas[it["filename"]])]
+    progress.emit(phase="lookup", lookup_total=len(todo), lookup_done=0, lookup_found=0)
+    found = errors = 0
+    client = CivitaiClient(cache_dir=out_dir / ".cache" / "civitai")
+    try:
+        for start in range(0, len(todo), batch):
+            chunk = {it["slug"]: shas[it["filename"]] for it in todo[start:start + batch]}
+            results = client.fetch_many(lambda slug: _lookup_one(client, chunk[slug], slug, out_dir, formats), chunk)
+            updates = {}
+            for slug, res in results.items():
+                if isinstance(res, Exception):
+                    errors += 1  # non marcato: verrà ritentato alla prossima esecuzione
+                    continue
+                found += bool(res)
+                updates[slug] = _lookup_update(chunk[slug], res)
+            if updates:
+                index_store.update_items(index_path, updates)
+            progress.emit(lookup_done=min(start + batch, len(todo)), lookup_found=found)
+    finally:
+        client.close()
+    return {"checked": len(todo), "found": found, "errors": errors}
+
+# ========== Collegamento Civitai da link noti (bulk) ==========
+def parse_civitai_url(url: str):
+    """(model_id, version_id) da un link civitai.com/models/<id>[?modelVersionId=<id>]."""
+    try:
+        u = urlparse(url)
+        parts = u.path.strip("/").split("/")
+        model_id = parts[1] if len(parts) >= 2 and parts[0].lower() == "models" else None
+        return model_id, parse_qs(u.query).get("modelVersionId", [None])[0]
+    except Exception:
+        return None, None
+
+def _trained_words(versions) -> List[str]:
+    return sorted({(w or "").strip() for v in versions for w in (v.get("trainedWords") or []) if (w or "").strip()})
+
+def civitai_link(client: CivitaiClient, slug: str, url: str, out_dir: Path, download,
+                 ttl: Optional[float] = None, parallel: bool = False) -> Dict[str, Any]:
+    """Metadati e preview di un link Civitai scelto dall'utente: la versione indicata
+    o, senza modelVersionId, la prima versione con immagini. download(url, dest)
+    salva una preview (con le varianti) e ne restituisce il percorso; con parallel
+    le preview si scaricano insieme sui worker del client (singolo link)."""
+    model_id, version_id = parse_civitai_url(url)
+    if not model_id:
+        raise ValueError("Link Civitai non valido")
+    if version_id:
+        vdata = client.model_version(version_id, ttl=ttl)
+        model_name, version_name = (vdata.get("model") or {}).get("name"), vdata.get("name")
+        urls = [im.get("url") for im in vdata.get("images", []) if im.get("url")]
+        words = _trained_words([vdata])
+    else:
+        mdata = client.model(model_id, ttl=ttl)
+        model_name, version_name, urls = mdata.get("name"), None, []
+        for ver in mdata.get("modelVersions", []):
+            version_name = ver.get("name") or version_name
+            urls = [im.get("url") for im in ver.get("images", []) if im.get("url")]
+            if urls:
+                break
+        words = _trained_words(mdata.get("modelVersions") or [])
+
+    jobs = [(u, out_dir / "assets" / "previews" / slug / f"civitai_{i+1}") for i, u in enumerate(urls[:LOOKUP_PREVIEWS])]
+    if parallel:
+        saved_by_job = client.fetch_many(lambda job: download(*job), jobs)
+    else:
+        saved_by_job = {}
+        for job in jobs:
+            try:
+                saved_by_job[job] = download(*job)
+            except Exception as e:
+                saved_by_job[job] = e
+    previews: List[str] = []
+    variants: Dict[str, Any] = {}
+    errors: List[str] = []
+    for job in jobs:
+        saved = saved_by_job.get(job)
+        if isinstance(saved, Exception):
+            errors.append("download preview fallito ({}): {}".format(job[0], saved))
+        elif saved:
+            rel = str(saved.relative_to(out_dir)).replace("\\", "/")
+            if rel not in previews:
+                previews.append(rel)
+            info = image_variants.describe(saved, out_dir)
+            if info:
+                variants[rel] = info
+    return {"url": url, "model_name": model_name, "version_name": version_name,
+            "previews": previews, "variants": variants, "triggerWords": words, "errors": errors}
+
+def link_update(slug: str, res: Dict[str, Any]):
+    """Funzione di aggiornamento dell'item (index_store.update_items) per il
+    risultato di civitai_link: le immagini di un link precedente (civitai_N)
+    escono dall'item e restano al GC delle preview."""
+    def apply(item):
+        item["civitai_url"] = res["url"]
+        name = res["model_name"] or item.get("display_name") or item.get("name")
+        if name:
+            item["display_name"] = "{} [{}]".format(name, res["version_name"]) if res["version_name"] else name
+        previews = list(item.get("previews") or [])
+        if res["previews"]:
+            old = "assets/previews/{}/civitai_".format(slug)
+            previews = [r for r in previews if not r.startswith(old) or r in res["previews"]]
+        item["previews"] = previews + [r for r in res["previews"] if r not in previews]
+        known = dict(item.get("preview_variants") or {}, **res["variants"])
+        item["preview_variants"] = {r: known[r] for r in item["previews"] if r in known} or None
+        if (item.get("type") or "").lower() == "lora":
+            item["triggerWords"] = res["triggerWords"]
+            item["triggerWordsChecked"] = True
+            item["triggerWordsNotFound"] = not res["triggerWords"]
+    return apply
+
+def link_many(client: CivitaiClient, links: Dict[str, str], out_dir: Path, download,
+              on_result=None, ttl: Optional[float] = None) -> Dict[str, Any]:
+    """civitai_link per ogni {slug: url} in parallelo sui worker del client (rate
+    limit condiviso); on_result(slug, risultato o eccezione) appena ciascuno termina.
+    Non scrive l'index: il chiamante applica tutti i link_update in una sola scrittura."""
+    return client.fetch_many(lambda slug: civitai_link(client, slug, links[slug], out_dir, download, ttl),
+                             links, on_result=on_result)
+
+def read_link_file(path: Path) -> Dict[str, str]:
+    """{slug: url} da un file JSON ([{"slug", "civitai_url"}] o {slug: url}) oppure
+    di testo con una coppia "slug url" (o "slug,url") per riga; # per i commenti."""
+    text = Path(path).read_text(encoding="utf-8")
+    if text.lstrip()[:1] in ("[", "{"):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return {str(k).strip(): str(v).strip() for k, v in data.items()}
+        return {str(d.get("slug") or "").strip(): str(d.get("civitai_url") or "").strip() for d in data}
+    out: Dict[str, str] = {}
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            slug, _, url = line.replace(",", " ", 1).partition(" ")
+            out[slug.strip()] = url.strip()
+    return out
+
+def link_file(out_dir: Path, path: Path, progress: "Progress", formats=image_variants.DEFAULT_FORMATS) -> Dict[str, int]:
+    """--link-file: collega tutti i modelli elencati e applica i risultati
+    all'index con una sola scrittura atomica."""
+    out_dir = Path(out_dir)
+    index_path = out_dir / "index.json"
+    links = read_link_file(path)
+    known = {it.get("slug") for it in index_store.iter_items(index_path)}
+    bad = {slug: ("slug non trovato" if slug not in known else "link non valido")
+           for slug, url in links.items() if slug not in known or not parse_civitai_url(url)[0]}
+    links = {slug: url for slug, url in links.items() if slug not in bad}
+    for slug, err in bad.items():
+        progress.record("link", slug=slug, ok=False, error=err)
+        progress.log("[!] {}: {}".format(slug, err))
+    progress.emit(phase="link", link_total=len(links), link_done=0)
+    client = CivitaiClient(cache_dir=out_dir / ".cache" / "civitai")
+    download = lambda u, dest: _download_preview(client, u, dest, formats)
+    updates = {}
+    done = [0]
+
+    def on_result(slug, res):
+        done[0] += 1
+        if isinstance(res, Exception):
+            progress.record("link", slug=slug, ok=False, error=str(res)[:200])
+            progress.log("[!] {}: {}".format(slug, res))
+        else:
+            updates[slug] = link_update(slug, res)
+            progress.record("link", slug=slug, ok=True, previews=len(res["previews"]))
+            progress.log("[OK] {} → {} ({} preview)".format(slug, res["url"], len(res["previews"])))
+        progress.tick(link_done=done[0])
+
+    try:
+        results = link_many(client, links, out_dir, download, on_result)
+    finally:
+        client.close()
+    if updates:
+        index_store.update_items(index_path, updates)
+    failed = len(bad) + sum(1 for r in results.values() if isinstance(r, Exception))
+    return {"linked": len(updates), "failed": failed}
+
+# ========== Aggiornamento incrementale (watcher) ==========
+def affected_models(paths, scan_state: Dict[str, Dict[str, Any]]) -> set:
+    """File modello toccati da un insieme di percorsi cambiati: il modello stesso,
+    i modelli con lo stesso nome di un'immagine, o tutto ciò che sta sotto una cartella."""
+    out: set = set()
+    for p in map(Path, paths):
+        ext = p.suffix.lower()
+        if ext in MODEL_EXT:
+            out.add(p)
+        elif ext in IMG_EXT:
+            for mext in MODEL_EXT:
+                cand = p.with_suffix(mext)
+                if str(cand) in scan_state or cand.exists():
+                    out.add(cand)
+        else:
+            if p.is_dir():
+                out.update(f for f in p.rglob("*") if f.suffix.lower() in MODEL_EXT)
+            prefix = str(p).rstrip("/\\") + os.sep
+            out.update(Path(k) for k in scan_state if k.startswith(prefix))
+    return out
+
+def apply_changes(out_dir: Path, paths, new_days: int = 30, jobs: int = 1,
+                  gc_previews: bool = False, hash_mode: str = "none",
+                  thumb_formats=image_variants.DEFAULT_FORMATS) -> Dict[str, int]:
+    """Applica all'index solo le aggiunte/rimozioni/rinomine dei percorsi indicati,
+    senza riscansionare le radici. Usato dal watcher (server.py --watch / --watch qui).
+    Con gc_previews elimina le preview rimaste orfane (GC incrementale)."""
+    out_dir = Path(out_dir)
+    index_path = out_dir / "index.json"
+    state_path = out_dir / STATE_NAME
+    progress = Progress(False)
+
+    scan_state = load_scan_state(state_path)
+    existing_meta = load_existing_index(index_path)
+    cutoff = datetime.now() - timedelta(days=new_days)
+
+    by_sig = state_by_sig(scan_state)
+    entries: List[Dict[str, Any]] = []
+    removed: set = set()
+    for f in affected_models(paths, scan_state):
+        try:
+            st = f.stat() if f.is_file() else None
+        except OSError:
+            st = None
+        if st is None:
+            if str(f) in scan_state:
+                removed.add(str(f))
+            continue
+        entries.append(scan_entry(f, st, scan_state, out_dir, by_sig))
+    if not entries and not removed:
+        return {"updated": 0, "removed": 0}
+
+    touched = removed | {e["item"]["filename"] for e in entries}
+    taken = {m.get("slug") for m in index_store.read_index(index_path).get("items", [])
+             if m.get("filename") not in touched}
+    compute_hashes(entries, hash_mode, jobs, progress)
+    resolve_slugs(entries, existing_meta, taken)
+    build_thumbs(entries, out_dir, jobs, progress, thumb_formats)
+    pending_triggers: List[tuple] = []
+    by_fp = meta_by_fingerprint(existing_meta)
+    new_items = [make_item(e, existing_meta, out_dir, cutoff, pending_triggers, by_fp) for e in entries]
+    fetch_trigger_words(pending_triggers, out_dir, progress)
+
+    with index_store.index_lock(index_path):
+        current = index_store.read_index(index_path)
+        index_store.merge_meta(new_items, existing_meta, load_existing_index(index_path))
+        kept = [it for it in current.get("items", []) if it.get("filename") not in touched]
+        items = kept + new_items
+        mark_duplicates(items)
+        index_store.write_index(index_path, make_payload(items))
+        state = load_scan_state(state_path)
+        for k in removed:
+            state.pop(k, None)
+        for e in entries:
+            state[e["item"]["filename"]] = state_record(e)
+        save_scan_state(state_path, state)
+        if gc_previews:
+            preview_refs.collect(out_dir)
+    return {"updated": len(new_items), "removed": len(removed)}
+
+def watch(args):
+    """Modalità --watch: dopo la scansione completa resta in ascolto sulle radici
+    e applica solo le modifiche (eventi del filesystem via watchdog: inotify,
+    FSEvents, ReadDirectoryChangesW; altrimenti polling)."""
+    from watcher import Watcher
+
+    def on_changes(paths):
+        res = apply_changes(Path(args.out), paths, args.new_days, args.jobs, args.gc_previews, args.hash,
+                            image_variants.variant_formats(args.thumb_avif))
+        print("[watch] {} aggiornati, {} rimossi".format(res["updated"], res["removed"]), flush=True)
+
+    w = Watcher(args.roots, on_changes, exts=MODEL_EXT | IMG_EXT, debounce=args.watch_debounce,
+                poll_interval=args.watch_interval, force_poll=args.watch_poll)
+    w.start()
+    print("[watch] In ascolto su {} ({}). Ctrl+C per uscire.".format(", ".join(args.roots), w.backend), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        w.stop()
+
 # ========== MAIN ==========
-def main():
+def main(argv=None, sink: Optional[Callable[[str], Any]] = None,
+         existing_items: Optional[List[Dict[str, Any]]] = None):
+    """Punto d'ingresso da riga di comando e per server.py in-process: con sink
+    ogni riga di output (eventi NDJSON e messaggi) va a sink invece che su stdout,
+    existing_items evita di rileggere l'index che il chiamante ha già in memoria."""
     ap = argparse.ArgumentParser(description="Scansiona modelli (Checkpoint/LoRA) e genera public/index.json")
-    ap.add_argument("--roots", nargs="+", required=True, help="Percorsi da scansionare (es. checkpoints, loras)")
+    ap.add_argument("--roots", nargs="+", help="Percorsi da scansionare (es. checkpoints, loras)")
     ap.add_argument("--out", default="public", help="Cartella output (conterrà index.json e assets/previews)")
     ap.add_argument("--new-days", type=int, default=30, help="Giorni per marcare come NUOVO")
-    ap.add_argument("--gc-previews", action="store_true", help="Rimuove cartelle previews di modelli non più presenti")
-    args = ap.parse_args()
+    ap.add_argument("--gc-previews", action="store_true",
+                    help="Elimina le anteprime che nessun modello usa più (solo quelle cambiate dall'ultimo GC)")
+    ap.add_argument("--gc-full", action="store_true",
+                    help="Con --gc-previews percorre tutto assets/previews (file non registrati nel manifest)")
+    ap.add_argument("--gc-dry-run", action="store_true",
+                    help="Riporta cosa eliminerebbe il GC e quanto spazio si recupererebbe, senza cancellare")
+    ap.add_argument("--jobs", type=int, default=0, help="Processi per le miniature (0 = numero di CPU, 1 = seriale)")
+    ap.add_argument("--walk-threads", type=int, default=fswalk.DEFAULT_WORKERS,
+                    help="Thread che leggono le cartelle in parallelo (utile su SMB/NFS)")
+    ap.add_argument("--thumb-avif", action="store_true",
+                    help="Oltre alle varianti WebP 160/320/640 crea anche quelle AVIF (se Pillow lo supporta)")
+    ap.add_argument("--hash", choices=model_hash.HASH_MODES, default="none",
+                    help="Impronta dei file: quick = size+testa+coda (rinomine/duplicati), full = anche SHA-256/AutoV2")
+    ap.add_argument("--civitai-lookup", action="store_true",
+                    help="Dopo la scansione cerca su Civitai (per SHA-256) i modelli senza link e ne completa i dati")
+    ap.add_argument("--lookup-retry", action="store_true", help="Con --civitai-lookup ritenta anche gli hash già non trovati")
+    ap.add_argument("--link-file", metavar="FILE",
+                    help="Collega in blocco i modelli elencati (JSON [{slug, civitai_url}] o righe \"slug url\"); "
+                         "senza --roots non esegue la scansione")
+    ap.add_argument("--index-format", choices=("json", "shards", "both"),
+                    help="Formato dell'index: json = index.json unico (frontend), shards = index.d/ NDJSON + manifest, "
+                         "both = entrambi (default: quello già presente, altrimenti json)")
+    ap.add_argument("--db", action="store_true",
+                    help="Aggiorna public/catalog.db (SQLite, WAL) come catalogo principale; index.json resta come esportazione")
+    ap.add_argument("--progress", action="store_true", help="Emette eventi di avanzamento JSON (uno per riga) su stdout")
+    ap.add_argument("--stream", action="store_true",
+                    help="Come --progress, più un record JSON per ogni modello nuovo/modificato appena pronto e per i file rimossi")
+    ap.add_argument("--checkpoint-interval", type=float, default=30.0,
+                    help="Secondi tra due salvataggi dello stato parziale (una scansione interrotta riparte da lì; 0 = mai)")
+    ap.add_argument("--watch", action="store_true", help="Dopo la scansione resta in ascolto e applica solo le modifiche")
+    ap.add_argument("--watch-poll", action="store_true", help="Forza il polling (per mount di rete senza inotify)")
+    ap.add_argument("--watch-interval", type=float, default=30.0, help="Secondi tra due polling")
+    ap.add_argument("--watch-debounce", type=float, default=2.0, help="Secondi di quiete prima di applicare le modifiche")
+    ap.add_argument("--profile", metavar="FILE", help="Salva il profilo cProfile della scansione (leggibile con pstats)")
+    args = ap.parse_args(argv)
+    if not args.roots and not args.link_file:
+        ap.error("--roots è obbligatorio (salvo con --link-file)")
+    progress = Progress(args.progress or args.stream, sink=sink)
+    mt = metrics.Metrics()
+    # da riga di comando il registro è quello del processo; in-process solo del thread chiamante
+    with (metrics.use(mt) if sink else nullcontext(metrics.set_current(mt))):
+        profiler = None
+        if args.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            if args.roots:
+                scan(args, progress, existing_items)
+            if args.link_file:
+                with mt.phase("link"):
+                    res = link_file(Path(args.out), Path(args.link_file), progress,
+                                    image_variants.variant_formats(args.thumb_avif))
+                progress.emit("done", phase="done")
+                progress.log("[OK] Link Civitai: {} modelli collegati, {} errori.".format(res["linked"], res["failed"]))
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+                progress.log("[i] Profilo salvato in {} (python -m pstats {}).".format(args.profile, args.profile))
+
+        summary = write_metrics(Path(args.out), mt)
+        progress.record("metrics", **summary)
+        progress.log("[i] Tempi: " + ", ".join("{} {:.2f}s".format(k, v) for k, v in summary["phases_s"].items()))
+
+    if args.watch and args.roots:
+        watch(args)
+
+def write_metrics(out_dir: Path, mt: "metrics.Metrics") -> Dict[str, Any]:
+    """Riepilogo della scansione (fasi, contatori, latenze HTTP) in out/.scan_metrics.json,
+    letto da /api/metrics del server."""
+    summary = mt.as_dict()
+    index_store.atomic_write_text(out_dir / METRICS_NAME, json.dumps(summary, ensure_ascii=False, indent=1))
+    return summary
+
+def scan(args, progress: Progress, existing_items: Optional[List[Dict[str, Any]]] = None):
+    """Scansione completa delle radici (corpo di main), fase per fase nel registro metrics.
+    existing_items: item dell'index già in memoria (server in-process), al posto della rilettura."""
+    mt = metrics.current()
+    thumb_formats = image_variants.variant_formats(args.thumb_avif)
 
     out_dir = Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
     index_path = out_dir / "index.json"
-    previews_root = out_dir / "assets" / "previews"
+    state_path = out_dir / STATE_NAME
 
-    existing_meta = load_existing_index(index_path)
+    with mt.phase("load"):
+        if args.db:
+            index_store.enable_db(index_path)
+        if existing_items is None:
+            existing_meta = load_existing_index(index_path)
+        else:
+            existing_meta = {it["slug"]: item_meta(it) for it in existing_items if it.get("slug")}
+        scan_state = load_scan_state(state_path)
+    new_state: Dict[str, Dict[str, Any]] = {}
 
     now = datetime.now()
     cutoff = now - timedelta(days=args.new_days)
     items: List[Dict[str, Any]] = []
-    seen_slugs: set = set()
+    pending_triggers: List[tuple] = []
 
+    # --- Fase 1: walk + confronto con la cache di stato ---
+    by_sig = state_by_sig(scan_state)
+    roots = []
     for root in args.roots:
-        rootp = Path(root)
-        if not rootp.exists():
-            print("[!] Skip: {} non esiste".format(root))
+        if not Path(root).exists():
+            progress.log("[!] Skip: {} non esiste".format(root))
             continue
+        roots.append(root)
+    walk_stats = fswalk.WalkStats()
+    with mt.phase("walk"):
+        found = fswalk.walk_models(roots, MODEL_EXT, IMG_EXT, args.walk_threads, walk_stats,
+                                   on_dir=lambda n, m: progress.tick(files_scanned=n, models_found=m))
+    progress.emit(files_scanned=walk_stats.entries, models_found=len(found), walk_syscalls=walk_stats.syscalls)
+    with mt.phase("entries"):
+        entries = [scan_entry(m.path, m.stat, scan_state, out_dir, by_sig, m.previews, m.inode) for m in found]
+    reused = sum(1 for e in entries if e.get("reused"))
+    for k, v in walk_stats.as_dict().items():
+        mt.count("walk_" + k, v)
+    mt.count("models_found", len(found))
+    mt.count("models_reused", reused)
+    if args.stream:
+        gone = {m.get("filename") for m in existing_meta.values()} - {str(m.path) for m in found} - {None}
+        if gone:
+            progress.record("removed", filenames=sorted(gone))
 
-        for f in rootp.rglob("*"):
-            if not (f.is_file() and f.suffix.lower() in MODEL_EXT):
-                continue
+    # --- Fase 2: slug univoci, poi impronte (opzionali) e miniature a blocchi solo per i
+    #     file nuovi/modificati; ogni blocco produce i suoi item (emessi con --stream) e
+    #     ogni checkpoint_interval secondi lo stato parziale va su disco, così una
+    #     scansione interrotta riprende dai modelli già completati ---
+    resolve_slugs(entries, existing_meta)
+    work = [e for e in entries if e["thumbs"] is None or needs_hash(e, args.hash)]
+    chunk = STREAM_CHUNK if args.stream or args.checkpoint_interval > 0 else max(1, len(work))
+    hash_total = sum(1 for e in work if needs_hash(e, args.hash))
+    thumb_total = len(thumb_jobs_for(work, out_dir, thumb_formats))
+    by_fp = meta_by_fingerprint(existing_meta)
+    ready: Dict[str, Dict[str, Any]] = {}
+    streamed: Dict[str, Dict[str, Any]] = {}
+    hashed = thumbed = 0
+    last_checkpoint = time.monotonic()
+    for i in range(0, len(work), chunk):
+        part = work[i:i + chunk]
+        with mt.phase("hash"):
+            hashed += compute_hashes(part, args.hash, args.jobs, progress, hashed, hash_total)
+        with mt.phase("thumbs"):
+            thumbed += build_thumbs(part, out_dir, args.jobs, progress, thumb_formats, thumbed, thumb_total)
+        with mt.phase("items"):
+            for e in part:
+                it = ready[e["item"]["filename"]] = make_item(e, existing_meta, out_dir, cutoff, pending_triggers, by_fp)
+                if args.stream:
+                    progress.record("item", item=it)
+                    streamed[it["slug"]] = item_meta(it)
+        done = i + len(part)
+        if 0 < args.checkpoint_interval <= time.monotonic() - last_checkpoint and done < len(work):
+            with mt.phase("checkpoint"):
+                partial = dict(scan_state, **{e["item"]["filename"]: state_record(e, checkpoint=True) for e in work[:done]})
+                save_scan_state(state_path, partial)
+            mt.count("checkpoints")
+            progress.emit("checkpoint", models_done=done, models_total=len(work))
+            last_checkpoint = time.monotonic()
 
-            name = nice_name(f)
-            slug = slugify(name)
-            mtype = detect_type(f)
-            st = f.stat()
-            size_mb = round(st.st_size / (1024 * 1024), 2)
-            mtime = datetime.fromtimestamp(st.st_mtime)
-
-            previews_rel: List[str] = []
-            if slug in existing_meta:
-                for rel in existing_meta[slug].get("previews", []):
-                    p = out_dir / rel
-                    if p.exists():
-                        previews_rel.append(str(p.relative_to(out_dir)).replace("\\", "/"))
-
-            for p in find_local_previews(f):
-                dest_base = previews_root / slug / p.name
-                if ensure_thumb(p, dest_base):
-                    saved_dir = (previews_root / slug)
-                    for cand in saved_dir.glob(p.stem + ".*"):
-                        rel = str(cand.relative_to(out_dir)).replace("\\", "/")
-                        if rel not in previews_rel:
-                            previews_rel.append(rel)
-
-            ex = existing_meta.get(slug, {})
-            item: Dict[str, Any] = {
-                "name": name,
-                "display_name": ex.get("display_name"),
-                "slug": slug,
-                "type": mtype,
-                "filename": str(f),
-                "folder": str(f.parent),
-                "size_mb": size_mb,
-                "modified": mtime.isoformat(timespec="seconds"),
-                "previews": previews_rel,
-                "civitai_url": ex.get("civitai_url"),
-                "is_new": mtime >= cutoff,
-                # Manteniamo eventuali dati trigger words
-                "triggerWords": ex.get("triggerWords"),
-                "triggerWordsChecked": ex.get("triggerWordsChecked"),
-                "triggerWordsNotFound": ex.get("triggerWordsNotFound"),
-            }
-
-            # --- NEW: Fetch Trigger Words solo per LoRA con link Civitai ---
-            try:
-                is_lora = (mtype.lower() == "lora")
-                civitai_url = (item.get("civitai_url") or "").strip()
-                already_has_triggers = bool(item.get("triggerWords"))
-                already_checked = bool(item.get("triggerWordsChecked"))
-
-                if is_lora and civitai_url and (not already_has_triggers) and (not already_checked):
-                    mid = _civitai_model_id(civitai_url)
-                    if mid:
-                        tw = _fetch_civitai_trigger_words(mid)
-                        if tw:
-                            item["triggerWords"] = tw
-                            item["triggerWordsChecked"] = True
-                            item["triggerWordsNotFound"] = False
-                        else:
-                            item["triggerWords"] = []
-                            item["triggerWordsChecked"] = True
-                            item["triggerWordsNotFound"] = True
-                    else:
-                        item["triggerWordsChecked"] = True
-            except Exception as e:
-                item["triggerWordsError"] = str(e)[:200]
+    # --- Fase 3: item finali con i metadati preservati ---
+    with mt.phase("items"):
+        for e in entries:
+            new_state[e["item"]["filename"]] = state_record(e)
+            items.append(ready.get(e["item"]["filename"])
+                         or make_item(e, existing_meta, out_dir, cutoff, pending_triggers, by_fp))
+        dups = mark_duplicates(items)
 
-            items.append(item)
-            seen_slugs.add(slug)
+    # --- Fase 4: Trigger Words da Civitai ---
+    with mt.phase("civitai"):
+        fetch_trigger_words(pending_triggers, out_dir, progress)
 
-    if args.gc_previews and previews_root.exists():
-        for d in previews_root.iterdir():
-            try:
-                if d.is_dir() and d.name not in seen_slugs:
-                    for p in d.rglob("*"):
-                        try: p.unlink()
-                        except Exception: pass
-                    try: d.rmdir()
-                    except Exception: pass
-            except Exception:
-                pass
-
-    payload = {
-        "generated_at": datetime.now().isoformat(timespec="seconds"),
-        "counts": {
-            "total": len(items),
-            "checkpoints": sum(1 for x in items if x["type"] == "Checkpoint"),
-            "loras": sum(1 for x in items if x["type"] == "LoRA"),
-        },
-        "items": items,
-    }
+    payload = make_payload(items)
 
-    index_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-    print("[OK] Generato {} ({} modelli).".format(index_path, len(items)))
-    if args.gc_previews:
-        print("[i] Garbage-collect delle anteprime completato.")
+    progress.emit(phase="write")
+    # Scrittura atomica sotto lock: i metadati cambiati su disco durante la
+    # scansione (es. link Civitai salvato dal server) non vengono persi
+    with mt.phase("write"), index_store.index_lock(index_path):
+        index_store.merge_meta(items, existing_meta, load_existing_index(index_path), streamed)
+        formats = {"both": index_store.INDEX_FORMATS}.get(args.index_format, (args.index_format,) if args.index_format else None)
+        index_store.write_index(index_path, payload, formats)
+        save_scan_state(state_path, new_state)
+        if args.gc_previews or args.gc_dry_run:
+            with mt.phase("gc"):
+                gc = preview_refs.collect(out_dir, dry_run=args.gc_dry_run, full=args.gc_full)
+            mt.count("gc_files", gc["files"])
+            mt.count("gc_bytes", gc["bytes"])
+    progress.emit("done", phase="done", total=len(items), reused=reused, duplicates=dups["groups"])
+    progress.log("[OK] Generato {} ({} modelli, {} invariati).".format(index_store.primary_path(index_path), len(items), reused))
+    progress.log("[i] Walk: {dirs} cartelle, {entries} voci, {syscalls} chiamate al filesystem.".format(**walk_stats.as_dict()))
+    if dups["groups"]:
+        progress.log("[i] {} gruppi di file duplicati ({} MB sprecati).".format(dups["groups"], dups["wasted_mb"]))
+    if dups["possible_groups"]:
+        progress.log("[i] {} gruppi di possibili duplicati (stessa impronta rapida, contenuto non verificato: "
+                     "--hash full per confermarli).".format(dups["possible_groups"]))
+    if args.gc_previews or args.gc_dry_run:
+        progress.log("[i] GC anteprime: " + preview_refs.format_report(gc))
+
+    if args.civitai_lookup:
+        with mt.phase("lookup"):
+            res = civitai_lookup(out_dir, args.jobs, progress, retry=args.lookup_retry, formats=thumb_formats)
+        progress.emit("done", phase="done")
+        progress.log("[OK] Ricerca Civitai: {} modelli cercati, {} trovati, {} errori.".format(
+            res["checked"], res["found"], res["errors"]))
 
 if __name__ == "__main__":
     main()
-
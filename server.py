@@ -15,85 +15,187 @@
 # server.py — FocusCatalog (API + static) v2.6
 # Patch: log robusti, ping, check ROOTS, path-fix Win/Docker, config persistente
 # -*- coding: utf-8 -*-
-import argparse, json, os, re, subprocess, sys, time, platform
+import argparse, hashlib, json, os, queue, re, subprocess, sys, platform, threading, time, uuid
+from collections import OrderedDict, deque
 from datetime import datetime
-from io import BytesIO
 from pathlib import Path
 from typing import List, Tuple, Optional
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import quote
 
-import requests
-from flask import Flask, request, jsonify, send_from_directory, abort
-from flask_cors import CORS
-from PIL import Image
+from flask import Flask, request, jsonify, send_from_directory, send_file, abort, g
+from werkzeug.utils import send_from_directory as wz_send_from_directory
+
+import image_variants
+import index_store
+import metrics
+import term_index
+from civitai_client import CivitaiClient
 
 APP_VER = "2.6"
 
-app = Flask(__name__)
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+app = Flask(__name__)  # CORS su /api/* applicato da create_app()
+METRICS = metrics.set_current(metrics.Metrics())  # latenze delle richieste e chiamate Civitai del server
 
 OUT_DIR: Path = None
 INDEX_PATH: Path = None
 ROOTS: List[str] = []
 SCAN_SCRIPT: Path = None
-CONFIG_PATH: Path = None  # inizializzato in main()
+CONFIG_PATH: Path = None  # inizializzato da create_app()
+CIVITAI: CivitaiClient = None
+PREVIEW_MAX: int = 1280  # lato massimo delle preview Civitai salvate (0 = originale)
+THUMB_FORMATS = image_variants.DEFAULT_FORMATS  # varianti 160/320/640 delle preview (--thumb-avif)
+NEW_DAYS = 30  # giorni per il badge NUOVO (--new-days)
+HASH_MODE = "none"  # impronte dei modelli: none | quick | full (--hash)
+JOB_DIR: Path = None  # record dei job di scansione, condivisi tra i worker
+STATIC_OFFLOAD: Optional[str] = None  # "x-accel" (nginx) | "x-sendfile" (Apache/lighttpd) per assets/previews
+ACCEL_PREFIX = "/_focuscatalog/"  # location interna nginx che punta a --out
+SCAN_MODE = "inprocess"  # "inprocess" (thread del server) | "subprocess" (python scan_models.py)
+_CORS_DONE = False
 
 def log(msg: str):
     print(f"[server] {msg}", flush=True)
 
 # ------------------------ index helpers ------------------------
-def load_index():
-    if INDEX_PATH.exists():
+class IndexCache:
+    """index.json parsato in memoria con mappa slug→item, chiavi di ricerca
+    case-folded e ordinamenti precalcolati (per /api/items).
+    Ricarica solo se cambiano mtime/size del file (es. dopo una scansione);
+    letture-modifiche-scritture vanno fatte tenendo `lock`.
+    Con catalog.db (--db) ricerche e lookup per slug vanno direttamente su SQLite."""
+
+    def __init__(self, path: Path, db=None):
+        self.path = path
+        self.db = db
+        self.lock = threading.RLock()
+        self._sig = None
+        self._etag = (None, None)
+        self._build({"generated_at": "", "items": []})
+
+    def _stat_sig(self):
         try:
-            return json.loads(INDEX_PATH.read_text(encoding="utf-8"))
-        except Exception as e:
-            log(f"Errore lettura index.json: {e}")
-    return {"generated_at": "", "items": []}
+            st = index_store.primary_path(self.path).stat()
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def get(self) -> dict:
+        with self.lock:
+            sig = self._stat_sig()
+            if sig != self._sig:
+                self._load(sig)
+            return self.data
+
+    def _load(self, sig):
+        data = {"generated_at": "", "items": []}
+        if sig is not None:
+            try:
+                data = index_store.read_index(self.path)
+            except Exception as e:
+                log(f"Errore lettura index: {e}")
+        self._build(data)
+        self._sig = sig
+
+    def _build(self, data: dict):
+        items = data.get("items", [])
+        self.data = data
+        self.by_slug = {it.get("slug"): it for it in items if it.get("slug")}
+        self.search_keys = [index_store.search_text(it) for it in items]
+        idx = range(len(items))
+        self.orders = {
+            "name": sorted(idx, key=lambda i: (items[i].get("display_name") or items[i].get("name") or "").casefold()),
+            "date": sorted(idx, key=lambda i: items[i].get("modified") or ""),
+            "size": sorted(idx, key=lambda i: items[i].get("size_mb") or 0),
+        }
+
+    def etag(self) -> Optional[str]:
+        """Hash del contenuto di index.json, o del manifest degli shard (che contiene
+        i digest di ogni shard); ricalcolato solo quando cambia il file."""
+        with self.lock:
+            sig = self._stat_sig()
+            if sig is None:
+                return None
+            if self._etag[0] != sig:
+                try:
+                    raw = index_store.primary_path(self.path).read_bytes()
+                    self._etag = (sig, hashlib.sha1(raw).hexdigest()[:20])
+                except OSError:
+                    return None
+            return self._etag[1]
+
+    def meta(self) -> dict:
+        """generated_at e counts dell'index corrente."""
+        if self.db is not None:
+            return self.db.meta()
+        data = self.get()
+        return {"generated_at": data.get("generated_at"), "counts": data.get("counts", {})}
 
-def save_index(data):
-    data["generated_at"] = datetime.now().isoformat(timespec="seconds")
-    INDEX_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    def item(self, slug: str) -> Optional[dict]:
+        if self.db is not None:
+            return self.db.item(slug)
+        with self.lock:
+            self.get()
+            return self.by_slug.get(slug)
+
+    def query(self, q: str = "", mtype: str = "", sort: str = "date-desc", offset: int = 0, limit: int = 96,
+              slugs: Optional[set] = None, exclude: Optional[set] = None) -> Tuple[int, List[dict]]:
+        """Filtra/ordina/pagina sugli indici precalcolati. Restituisce (totale, pagina)."""
+        if self.db is not None:
+            return self.db.query(q, mtype, sort, offset, limit, slugs, exclude)
+        with self.lock:
+            self.get()
+            items, keys, orders = self.data.get("items", []), self.search_keys, self.orders
+        field, _, direction = (sort or "").partition("-")
+        if field not in orders:
+            field, direction = "date", "desc"
+        order = orders[field] if direction == "asc" else reversed(orders[field])
+        terms = q.casefold().split()
+        total, page = 0, []
+        for i in order:
+            it = items[i]
+            if mtype and it.get("type") != mtype: continue
+            if slugs is not None and it.get("slug") not in slugs: continue
+            if exclude and it.get("slug") in exclude: continue
+            if terms and not all(t in keys[i] for t in terms): continue
+            if offset <= total < offset + limit:
+                page.append(it)
+            total += 1
+        return total, page
+
+    def _set(self, data: dict):
+        if self.db is not None:
+            return
+        self._build(data)
+        self._sig = self._stat_sig()
+
+    def update(self, updates: dict) -> dict:
+        """Aggiornamenti per slug via index_store: lock inter-processo, rilettura
+        dal disco, modifica e scrittura atomica; la cache prende il risultato."""
+        with self.lock:
+            return index_store.update_items(self.path, updates, after_write=self._set)
+
+    def upsert(self, items: List[dict], removed: List[str]) -> dict:
+        """Item completi aggiunti/sostituiti per filename (scan_models.py --stream)."""
+        with self.lock:
+            return index_store.upsert_items(self.path, items, removed, after_write=self._set)
+
+INDEX: IndexCache = None
+TERMS: term_index.TermIndex = None  # completamento trigger word/tag (/api/terms)
+
+def load_index():
+    return INDEX.get()
 
 # ------------------------ civitai helpers ------------------------
-def parse_civitai_url(url: str) -> Tuple[Optional[str], Optional[str]]:
+def save_image_smart(src: Path, dest: Path, max_dim: int = 0) -> Optional[Path]:
+    """Salva src come .jpg (o .png se trasparente) entro max_dim px, più le
+    varianti ridotte in THUMB_FORMATS accanto al file."""
+    from PIL import Image
     try:
-        u = urlparse(url)
-        parts = u.path.strip("/").split("/")
-        model_id = parts[1] if len(parts) >= 2 and parts[0].lower() == "models" else None
-        q = parse_qs(u.query)
-        version_id = q.get("modelVersionId", [None])[0]
-        return model_id, version_id
-    except Exception:
-        return None, None
-
-def civitai_fetch_model(model_id: str):
-    r = requests.get(f"https://civitai.com/api/v1/models/{model_id}",
-                     headers={"User-Agent":"Mozilla/5.0"}, timeout=25)
-    r.raise_for_status()
-    return r.json()
-
-def civitai_fetch_model_version(version_id: str):
-    r = requests.get(f"https://civitai.com/api/v1/model-versions/{version_id}",
-                     headers={"User-Agent":"Mozilla/5.0"}, timeout=25)
-    r.raise_for_status()
-    return r.json()
-
-def extract_trigger_words(mdata: dict) -> List[str]:
-    words = set()
-    for ver in (mdata.get("modelVersions") or []):
-        for w in (ver.get("trainedWords") or []):
-            if w: words.add(w.strip())
-    return sorted(words)
-
-def extract_trigger_words_version(vdata: dict) -> List[str]:
-    words = set()
-    for w in (vdata.get("trainedWords") or []):
-        if w: words.add(w.strip())
-    return sorted(words)
-
-def save_image_smart(raw: bytes, dest: Path) -> Optional[Path]:
-    try:
-        img = Image.open(BytesIO(raw)); img.load()
+        img = Image.open(src)
+        if max_dim > 0:
+            if img.format == "JPEG":
+                img.draft(img.mode, (max_dim, max_dim))
+            img.thumbnail((max_dim, max_dim))
+        img.load()
     except Exception:
         return None
     ext = ".png" if (img.mode in ("RGBA","LA") or getattr(img, "info", {}).get("transparency")) else ".jpg"
@@ -105,21 +207,387 @@ def save_image_smart(raw: bytes, dest: Path) -> Optional[Path]:
             img.save(dest, quality=92, optimize=True)
         else:
             img.save(dest, optimize=True)
-        return dest
     except Exception:
         try:
             img = img.convert("RGB")
             dest = dest.with_suffix(".png")
             img.save(dest, optimize=True)
-            return dest
         except Exception:
             return None
+    try:
+        image_variants.write_variants(img, dest, THUMB_FORMATS)
+    except Exception as e:
+        log(f"varianti preview non create ({dest.name}): {e}")
+    return dest
+
+def fetch_preview(url: str, dest: Path) -> Optional[Path]:
+    """Scarica un'immagine Civitai in streaming su file temporaneo, poi la
+    decodifica/ridimensiona (max PREVIEW_MAX px) e la salva accanto a dest."""
+    tmp = dest.with_name(dest.name + ".part")
+    try:
+        CIVITAI.download(url, tmp, headers={"Referer": "https://civitai.com/"})
+        return save_image_smart(tmp, dest, PREVIEW_MAX)
+    finally:
+        try: tmp.unlink()
+        except OSError: pass
+
+# ------------------------ HTTP caching ------------------------
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def negotiate_encoding(path: Path) -> Tuple[Path, Optional[str]]:
+    """Sceglie la variante precompressa (.br/.gz) accettata dal client, purché
+    non più vecchia del file originale; altrimenti il file così com'è."""
+    try:
+        base_mtime = path.stat().st_mtime_ns
+    except OSError:
+        return path, None
+    for encoding, ext in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings[encoding] <= 0:
+            continue
+        side = path.with_name(path.name + ext)
+        try:
+            if side.stat().st_mtime_ns >= base_mtime:
+                return side, encoding
+        except OSError:
+            pass
+    return path, None
+
+# ------------------------ scan jobs ------------------------
+STREAM_FLUSH_S = 2.0  # intervallo minimo tra due scritture degli item in streaming
+
+class ScanJob:
+    """Scansione in background: in un thread del server (scan_models.main con le
+    righe di output passate a _line) o in un sottoprocesso di cui si legge stdout.
+    Gli eventi JSON di --stream aggiornano `progress`, il resto va nel log; gli
+    item emessi man mano vengono uniti all'index a blocchi (flush_stream)."""
+
+    def __init__(self, job_id: str, cmd: List[str], cwd: Path, lock=None):
+        self.id = job_id
+        self.cmd = cmd
+        self.cwd = cwd
+        self.state = "running"
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.finished_at = None
+        self.progress: dict = {}
+        self.output = deque(maxlen=200)
+        self.error = None
+        self.metrics: Optional[dict] = None
+        self.counts: dict = {}
+        self.generated_at = None
+        self._version = 0
+        self._cond = threading.Condition()
+        self._lock = lock  # .scan.lock, tenuto fino alla fine del job
+        self._saved = 0.0
+        self._stream_items: List[dict] = []
+        self._stream_removed: List[str] = []
+        self._flushed = time.monotonic()
+        self._flush_every = STREAM_FLUSH_S
+
+    def _changed(self, final: bool = False):
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+        self.save(force=final)
+
+    def save(self, force: bool = False):
+        """Record del job in .jobs/<id>.json, letto dagli altri worker (SharedJob);
+        durante la scansione al massimo due scritture al secondo."""
+        now = time.monotonic()
+        if not force and now - self._saved < 0.5:
+            return
+        self._saved = now
+        try:
+            index_store.atomic_write_text(JOB_DIR / f"{self.id}.json",
+                                          json.dumps({**self.snapshot(), "metrics": self.metrics}, ensure_ascii=False))
+        except OSError as e:
+            log(f"Record job non scritto: {e}")
+
+    def run(self):
+        inprocess = SCAN_MODE == "inprocess" and Path(self.cmd[1]).resolve() == BUNDLED_SCAN_SCRIPT
+        log(f"=== SCAN START === job {self.id}" + (" (in-process)" if inprocess else ""))
+        log(f"cmd    : {' '.join(self.cmd)}")
+        state, error = "done", None
+        try:
+            rc = self._run_inprocess() if inprocess else self._run_subprocess()
+            if rc != 0:
+                # la scansione non scriverà l'index: si tiene almeno quanto già emesso
+                self.flush_stream(force=True)
+                state, error = "error", f"scan_models.py ha fallito (exit {rc})"
+                log(f"[scan output]\n" + "\n".join(self.output))
+            else:
+                meta = INDEX.meta()
+                self.counts, self.generated_at = meta.get("counts", {}), meta.get("generated_at")
+        except Exception as e:
+            state, error = "error", str(e)
+            log(f"refresh error: {e}")
+        # il lock si libera prima di pubblicare lo stato finale: chi attende il job
+        # (?wait=1) può avviare subito la scansione successiva
+        if self._lock is not None:
+            index_store.release_lock(self._lock)
+        self.state, self.error = state, error
+        self.finished_at = datetime.now().isoformat(timespec="seconds")
+        log(f"=== SCAN {self.state.upper()} === job {self.id}")
+        self._changed(final=True)
+
+    def _run_subprocess(self) -> int:
+        env = os.environ.copy()
+        env["PYTHONIOENCODING"] = "utf-8"
+        proc = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                encoding="utf-8", errors="replace", cwd=str(self.cwd), env=env, bufsize=1)
+        for line in proc.stdout:
+            self._line(line)
+        return proc.wait()
+
+    def _run_inprocess(self) -> int:
+        """scan_models.main nel thread del job: niente avvio dell'interprete né
+        reimport dei moduli, e senza catalog.db l'index già in memoria non si rilegge."""
+        import scan_models
+        try:
+            scan_models.main(self.cmd[2:], sink=self._line,
+                             existing_items=INDEX.get()["items"] if INDEX.db is None else None)
+            return 0
+        except SystemExit as e:  # argparse
+            return e.code if isinstance(e.code, int) else 1
+        except Exception:
+            import traceback
+            for line in traceback.format_exc().splitlines():
+                self._line(line)
+            return 1
+
+    def _line(self, line: str):
+        """Una riga di output della scansione (evento JSON o messaggio)."""
+        line = line.rstrip()
+        if not line:
+            return
+        event = None
+        if line.startswith("{"):
+            try: event = json.loads(line)
+            except ValueError: pass
+        kind = event.get("event") if isinstance(event, dict) else None
+        if kind == "item":
+            self._stream_items.append(event["item"])
+        elif kind == "removed":
+            self._stream_removed.extend(event.get("filenames") or [])
+        elif kind == "metrics":
+            self.metrics = event
+        elif kind:
+            self.progress = event
+        else:
+            self.output.append(line)
+            log(line)
+        self.flush_stream()
+        if kind not in ("item", "removed"):
+            self._changed()
+
+    def flush_stream(self, force: bool = False):
+        """Unisce all'index su disco gli item arrivati dall'ultimo flush (visibili
+        subito a /api/index e a tutti i worker). L'intervallo cresce con il costo
+        della scrittura, così un index grande non viene riscritto di continuo;
+        a scansione conclusa i residui si scartano perché scan_models.py riscrive tutto."""
+        if not (self._stream_items or self._stream_removed):
+            return
+        if not force and time.monotonic() - self._flushed < self._flush_every:
+            return
+        items, removed = self._stream_items, self._stream_removed
+        self._stream_items, self._stream_removed = [], []
+        t0 = time.monotonic()
+        try:
+            INDEX.upsert(items, removed)
+            METRICS.count("scan.stream_items", len(items))
+        except Exception as e:
+            log(f"Merge item in streaming non riuscito: {e}")
+        self._flushed = time.monotonic()
+        self._flush_every = max(STREAM_FLUSH_S, 10 * (self._flushed - t0))
+
+    def snapshot(self) -> dict:
+        return {"id": self.id, "state": self.state, "started_at": self.started_at,
+                "finished_at": self.finished_at, "progress": self.progress, "error": self.error,
+                "output": list(self.output)[-20:], "counts": self.counts, "generated_at": self.generated_at}
+
+    def next_update(self, version: int, timeout: float):
+        """Attende una versione più nuova di `version`; (versione, snapshot) o (version, None) al timeout."""
+        with self._cond:
+            if self._version == version:
+                self._cond.wait(timeout)
+            if self._version == version:
+                return version, None
+            return self._version, self.snapshot()
+
+    def wait(self):
+        version = -1
+        while self.state == "running":
+            version, _ = self.next_update(version, timeout=1)
+
+class SharedJob:
+    """Job avviato da un altro worker dello stesso server (--workers > 1), letto dal
+    suo record in .jobs/<id>.json: stessa interfaccia di ScanJob, ma a polling.
+    Un job "running" senza nessuno che tenga .scan.lock è di un worker terminato."""
+    POLL = 0.25
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.id = path.stem
+        self.data = {"id": self.id, "state": "error", "error": "Record del job illeggibile"}
+        self._load()
+
+    def _load(self):
+        try:
+            self.data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass
+        if self.data.get("state") == "running" and scan_lock_free():
+            self.data.update(state="error", error="Scansione interrotta (worker terminato)")
+        self.metrics = self.data.get("metrics")
+        self.state = self.data.get("state")
+
+    def _mtime(self) -> int:
+        try:
+            return self.path.stat().st_mtime_ns
+        except OSError:
+            return 0
+
+    def snapshot(self) -> dict:
+        return {k: v for k, v in self.data.items() if k != "metrics"}
+
+    def next_update(self, version: int, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            mtime = self._mtime()
+            if mtime != version or (self.state == "running" and scan_lock_free()):
+                self._load()
+                return mtime, self.snapshot()
+            if time.monotonic() >= deadline:
+                return version, None
+            time.sleep(self.POLL)
+
+    def wait(self):
+        version = -1
+        while self.state == "running":
+            version, _ = self.next_update(version, timeout=1)
+
+JOB_ID_RE = re.compile(r"[0-9a-f]{12}")
+
+def scan_lock_path() -> Path:
+    return OUT_DIR / ".scan.lock"
+
+def scan_lock_free() -> bool:
+    fh = index_store.try_lock(scan_lock_path())
+    if fh is None:
+        return False
+    index_store.release_lock(fh)
+    return True
+
+class ScanJobs:
+    """Registro dei job con single-flight: una sola scansione alla volta,
+    le richieste duplicate ricevono il job già in corso. Tra processi (più worker
+    sulla stessa cartella) il single-flight passa da .scan.lock e i job degli altri
+    worker si leggono dai record in .jobs/."""
+
+    def __init__(self, keep: int = 20):
+        self.lock = threading.Lock()
+        self.jobs: "OrderedDict[str, ScanJob]" = OrderedDict()
+        self.keep = keep
+        self.current: Optional[ScanJob] = None
+
+    def start(self, cmd: List[str], cwd: Path) -> Tuple[Optional[ScanJob], bool]:
+        """(job, creato). Il job è None se la scansione in corso non è di questo
+        server (es. scan_models.py lanciato da un altro server sulla stessa --out)."""
+        with self.lock:
+            if self.current and self.current.state == "running":
+                return self.current, False
+            fh = index_store.try_lock(scan_lock_path())
+            if fh is not None:
+                job = ScanJob(uuid.uuid4().hex[:12], cmd, cwd, lock=fh)
+                self.jobs[job.id] = job
+                while len(self.jobs) > self.keep:
+                    self.jobs.popitem(last=False)
+                self.current = job
+                job.save(force=True)
+                index_store.atomic_write_text(JOB_DIR / "current", job.id)
+                self._prune()
+        if fh is None:
+            job = self.shared_current()
+            return (job if job and job.state == "running" else None), False
+        threading.Thread(target=job.run, name=f"scan-{job.id}", daemon=True).start()
+        return job, True
+
+    def _prune(self):
+        records = []
+        for p in JOB_DIR.glob("*.json"):
+            try: records.append((p.stat().st_mtime_ns, p))
+            except OSError: pass
+        for _, p in sorted(records, reverse=True)[self.keep:]:
+            try: p.unlink()
+            except OSError: pass
+
+    def get(self, job_id: str):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None and JOB_ID_RE.fullmatch(job_id) and (JOB_DIR / f"{job_id}.json").exists():
+            job = SharedJob(JOB_DIR / f"{job_id}.json")
+        return job
+
+    def shared_current(self):
+        try:
+            return self.get((JOB_DIR / "current").read_text(encoding="utf-8").strip())
+        except OSError:
+            return None
+
+    def latest(self):
+        """Ultimo job avviato da un qualunque worker (quello locale se è in corso)."""
+        job = self.current
+        if job and job.state == "running":
+            return job
+        return self.shared_current() or job
+
+JOBS = ScanJobs()
+
+# ------------------------ watch mode ------------------------
+WATCH_OPTS: Optional[dict] = None  # impostato da create_app() con --watch
+WATCHER = None
+WATCH_LOCK = None  # .watch.lock: con più worker il watcher gira in uno solo
+
+def apply_watch_changes(paths: List[str]):
+    """Applica all'index solo i file cambiati; se è in corso una scansione
+    completa aspetta che finisca, così le due scritture non si sovrappongono."""
+    import scan_models
+    job = JOBS.latest()
+    if job and job.state == "running":
+        job.wait()
+    res = scan_models.apply_changes(OUT_DIR, paths, jobs=WATCH_OPTS["jobs"], **scan_options())
+    if res["updated"] or res["removed"]:
+        log(f"[watch] {res['updated']} aggiornati, {res['removed']} rimossi")
+
+def start_watcher():
+    """(Ri)avvia il watcher sulle ROOTS correnti (chiamata anche dopo /api/config).
+    Con più worker lo esegue solo quello che ottiene .watch.lock."""
+    global WATCHER, WATCH_LOCK
+    from watcher import Watcher
+    import scan_models
+    if WATCH_LOCK is None:
+        WATCH_LOCK = index_store.try_lock(OUT_DIR / ".watch.lock")
+        if WATCH_LOCK is None:
+            log("[watch] Watcher già attivo in un altro worker")
+            return
+    if WATCHER is not None:
+        WATCHER.stop()
+        WATCHER = None
+    roots = [r for r in ROOTS if os.path.isdir(r)]
+    if not roots:
+        log("[watch] Nessuna radice valida da osservare")
+        return
+    WATCHER = Watcher(roots, apply_watch_changes, exts=scan_models.MODEL_EXT | scan_models.IMG_EXT,
+                      debounce=WATCH_OPTS["debounce"], poll_interval=WATCH_OPTS["interval"],
+                      force_poll=WATCH_OPTS["poll"])
+    WATCHER.start()
+    log(f"[watch] In ascolto su {roots} ({WATCHER.backend})")
 
 # ------------------------ script resolver ------------------------
+BUNDLED_SCAN_SCRIPT = Path(__file__).resolve().parent / "scan_models.py"  # eseguibile in-process
+
 def resolve_scan_script(candidate: Path, out_dir: Path) -> Path:
     if candidate and candidate.exists(): return candidate
-    here = Path(__file__).resolve().parent / "scan_models.py"
-    if here.exists(): return here
+    if BUNDLED_SCAN_SCRIPT.exists(): return BUNDLED_SCAN_SCRIPT
     base = out_dir.parent / "scan_models.py"
     if base.exists(): return base
     return candidate
@@ -169,14 +637,69 @@ def save_config(cfg: dict):
     CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
     CONFIG_PATH.write_text(json.dumps(cfg, indent=2, ensure_ascii=False), encoding="utf-8")
 
+def config_roots(cfg: dict) -> List[str]:
+    return [x for x in (norm_path(cfg.get("checkpointDir", "") or ""), norm_path(cfg.get("loraDir", "") or "")) if x]
+
+_CONFIG_SIG = None
+
+def sync_config():
+    """Applica le ROOTS di config.json se il file è cambiato dall'ultima lettura:
+    all'avvio e, con più worker, quando /api/config è arrivato a un altro processo."""
+    global ROOTS, _CONFIG_SIG
+    try:
+        st = CONFIG_PATH.stat()
+        sig = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        sig = None
+    if sig == _CONFIG_SIG:
+        return
+    _CONFIG_SIG = sig
+    roots = config_roots(load_config())
+    if roots and roots != ROOTS:
+        ROOTS = roots
+        log(f"Override ROOTS da config.json: {ROOTS}")
+        if WATCHER is not None:
+            start_watcher()
+
 # ------------------------------ API ------------------------------
 @app.route("/api/ping")
 def api_ping():
     return jsonify({"ok": True, "ver": APP_VER})
 
+@app.before_request
+def _request_start():
+    g.t0 = time.perf_counter()
+    if request.path.startswith("/api/"):
+        sync_config()
+
+@app.after_request
+def _request_metrics(resp):
+    t0 = g.pop("t0", None)
+    if t0 is not None:
+        # per rotta (non per URL): /<path:filename> raccoglie tutti i file statici
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        METRICS.observe(f"http.server {request.method} {route}", time.perf_counter() - t0)
+        METRICS.count(f"http.server.{resp.status_code}")
+    return resp
+
+@app.route("/api/metrics", methods=["GET"])
+def api_metrics():
+    """Metriche dell'ultima scansione (dal job in corso/concluso o da .scan_metrics.json)
+    e contatori/latenze delle richieste servite da questo processo."""
+    import scan_models
+    job = JOBS.latest()
+    scan = job.metrics if job and job.metrics else None
+    if scan is None:
+        try:
+            scan = json.loads((OUT_DIR / scan_models.METRICS_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            scan = None
+    return jsonify({"ok": True, "scan": scan, "server": METRICS.as_dict(),
+                    "scan_job": {"id": job.id, "state": job.state} if job else None})
+
 @app.route("/api/health", methods=["GET"])
 def api_health():
-    ok = INDEX_PATH.exists()
+    ok = index_store.primary_path(INDEX_PATH).exists()
     return jsonify({
         "ok": True,
         "index_exists": ok,
@@ -185,9 +708,76 @@ def api_health():
         "ver": APP_VER
     })
 
+def stream_index_json():
+    """index.json ricomposto al volo dagli shard: le righe NDJSON sono già JSON
+    valido, quindi vengono concatenate senza parsarle."""
+    manifest = index_store.read_manifest(INDEX_PATH) or {}
+    head = {"generated_at": manifest.get("generated_at", ""), "counts": manifest.get("counts", {})}
+    yield json.dumps(head, ensure_ascii=False)[:-1] + ',"items":['
+    for i, line in enumerate(index_store.iter_shard_lines(INDEX_PATH, manifest)):
+        yield ("," if i else "") + line
+    yield "]}"
+
 @app.route("/api/index", methods=["GET"])
+@app.route("/index.json", methods=["GET"])
 def api_index():
-    return send_from_directory(str(OUT_DIR), "index.json")
+    digest = INDEX.etag()
+    if digest is None:
+        abort(404)
+    sharded = not INDEX_PATH.exists()
+    path, encoding = (None, None) if sharded else negotiate_encoding(INDEX_PATH)
+    tag = f"{digest}-{encoding}" if encoding else digest
+    if request.if_none_match.contains(tag):
+        resp = app.response_class(status=304)
+    elif sharded:
+        resp = app.response_class(stream_index_json(), mimetype="application/json")
+    else:
+        resp = send_file(str(path), mimetype="application/json", conditional=False, etag=False)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+    resp.set_etag(tag)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+def _slug_set(name: str) -> Optional[set]:
+    vals = request.args.getlist(name)
+    if not vals: return None
+    return {x.strip() for v in vals for x in v.split(",") if x.strip()}
+
+@app.route("/api/items", methods=["GET"])
+def api_items():
+    """Ricerca/filtro/ordinamento/paginazione lato server:
+    ?q=&type=Checkpoint|LoRA&sort=name|date|size-asc|desc&offset=&limit=&slugs=a,b&exclude=c"""
+    try:
+        offset = max(0, int(request.args.get("offset", 0)))
+        limit = min(2000, max(1, int(request.args.get("limit", 96))))
+    except ValueError:
+        return jsonify({"ok": False, "error": "offset/limit non validi"}), 400
+    total, page = INDEX.query(q=request.args.get("q", ""), mtype=request.args.get("type", ""),
+                              sort=request.args.get("sort", "date-desc"), offset=offset, limit=limit,
+                              slugs=_slug_set("slugs"), exclude=_slug_set("exclude"))
+    return jsonify({"ok": True, "total": total, "offset": offset, "limit": limit,
+                    "generated_at": INDEX.meta().get("generated_at"), "items": page})
+
+@app.route("/api/terms", methods=["GET"])
+def api_terms():
+    """Completamento trigger word/tag → modelli: ?q=&kind=trigger|tag&limit=&fuzzy=0
+    (prefisso del termine o di una sua parola, poi a una modifica di distanza)."""
+    kind = request.args.get("kind", "")
+    if kind and kind not in {k for _, k in term_index.KINDS}:
+        return jsonify({"ok": False, "error": "kind non valido"}), 400
+    try:
+        limit = min(200, max(1, int(request.args.get("limit", 20))))
+    except ValueError:
+        return jsonify({"ok": False, "error": "limit non valido"}), 400
+    if not term_index.terms_path(OUT_DIR).exists() and index_store.primary_path(INDEX_PATH).exists():
+        # index scritto prima dell'indice dei termini: si costruisce una volta
+        with index_store.index_lock(INDEX_PATH):
+            term_index.sync(OUT_DIR, index_store.iter_items(INDEX_PATH))
+    t0 = time.perf_counter()
+    terms = TERMS.complete(request.args.get("q", ""), limit, kind, request.args.get("fuzzy", "1") != "0")
+    return jsonify({"ok": True, "terms": terms, "took_ms": round((time.perf_counter() - t0) * 1000, 3)})
 
 @app.route("/api/config", methods=["GET"])
 def api_get_config():
@@ -216,119 +806,197 @@ def api_set_config():
     save_config(cfg)
 
     global ROOTS
-    ROOTS = [x for x in [checkpoint, lora] if x]
+    ROOTS = config_roots(cfg)
 
     log(f"[config] Salvate. ROOTS={ROOTS}")
+    if WATCH_OPTS is not None:
+        start_watcher()
     return jsonify({"ok": True, "roots": ROOTS})
 
 @app.route("/api/set_link_and_fetch", methods=["POST"])
 def api_set_link_and_fetch():
+    import scan_models
     data = request.json or {}
     slug = (data.get("slug") or "").strip()
     url  = (data.get("civitai_url") or "").strip()
     if not slug or not url:
         return jsonify({"ok": False, "error": "slug e civitai_url richiesti"}), 400
-    model_id, version_id = parse_civitai_url(url)
-    if not model_id:
+    if not scan_models.parse_civitai_url(url)[0]:
         return jsonify({"ok": False, "error": "Link Civitai non valido"}), 400
-
-    idx = load_index()
-    item = next((it for it in idx.get("items", []) if it.get("slug") == slug), None)
-    if not item:
+    if not INDEX.item(slug):
         return jsonify({"ok": False, "error": "Slug non trovato in index.json"}), 404
 
     try:
-        previews_rel, display_name, trigger_words = [], item.get("display_name") or item.get("name"), []
-
-        if version_id:
-            vdata = civitai_fetch_model_version(version_id)
-            mname = (vdata.get("model") or {}).get("name") or ""
-            vname = vdata.get("name") or ""
-            display_name = (mname or display_name)
-            if vname: display_name = f"{display_name} [{vname}]"
-            urls = [im.get("url") for im in vdata.get("images", []) if im.get("url")]
-            trigger_words = extract_trigger_words_version(vdata)
-        else:
-            mdata = civitai_fetch_model(model_id)
-            mname = mdata.get("name") or display_name
-            display_name = mname
-            urls = []
-            for ver in mdata.get("modelVersions", []):
-                vname = ver.get("name") or ""
-                if vname: display_name = f"{mname} [{vname}]"
-                for im in ver.get("images", []):
-                    u = im.get("url")
-                    if u: urls.append(u)
-                if urls: break
-            trigger_words = extract_trigger_words(mdata)
-
-        for i, u in enumerate(urls[:3]):
-            r = requests.get(u, headers={"User-Agent":"Mozilla/5.0","Referer":"https://civitai.com/"}, timeout=25)
-            r.raise_for_status()
-            saved = save_image_smart(r.content, OUT_DIR/"assets"/"previews"/slug/f"civitai_{i+1}")
-            if saved:
-                rel = str(saved.relative_to(OUT_DIR)).replace("\\","/")
-                if rel not in previews_rel: previews_rel.append(rel)
-            time.sleep(0.15)
-
-        item["civitai_url"] = url
-        if display_name: item["display_name"] = display_name
-        for rel in previews_rel:
-            if rel not in item["previews"]: item["previews"].append(rel)
-
-        if (item.get("type") or "").lower() == "lora":
-            if trigger_words:
-                item["triggerWords"] = trigger_words
-                item["triggerWordsChecked"] = True
-                item["triggerWordsNotFound"] = False
-            else:
-                item["triggerWords"] = []
-                item["triggerWordsChecked"] = True
-                item["triggerWordsNotFound"] = True
-
-        save_index(idx)
+        # Azione esplicita dell'utente: metadati sempre rivalidati (ETag) invece della cache TTL;
+        # download + decodifica delle preview in parallelo sui worker del client (rate limit condiviso)
+        res = scan_models.civitai_link(CIVITAI, slug, url, OUT_DIR, fetch_preview, ttl=0, parallel=True)
+        for err in res["errors"]:
+            log(err)
+        # Applica sull'item corrente su disco (merge con scritture concorrenti)
+        INDEX.update({slug: scan_models.link_update(slug, res)})
+        item = INDEX.item(slug)
+        if not item:
+            return jsonify({"ok": False, "error": "Slug non trovato in index.json"}), 404
         return jsonify({"ok": True, "display_name": item.get("display_name"),
                         "previews": item.get("previews"),
+                        "preview_variants": item.get("preview_variants"),
                         "triggerWords": item.get("triggerWords", [])})
     except Exception as e:
         log(f"set_link_and_fetch error: {e}")
         return jsonify({"ok": False, "error": str(e)}), 500
 
-@app.route("/api/refresh", methods=["POST"])
-def api_refresh():
+LINK_BATCH_MAX = 5000
+
+@app.route("/api/set_links_and_fetch", methods=["POST"])
+def api_set_links_and_fetch():
+    """Come /api/set_link_and_fetch per molti modelli: {"links": [{slug, civitai_url}, ...]}.
+    Metadati e preview si scaricano in parallelo sotto il rate limit condiviso e tutti gli
+    item si aggiornano con una sola scrittura dell'index. Risposta NDJSON: una riga per
+    slug appena pronto ({slug, ok, ...}), poi {"done": true, linked, failed} dopo la
+    scrittura. Il lavoro prosegue anche se il client chiude la connessione."""
+    import scan_models
+    links = (request.json or {}).get("links")
+    if not isinstance(links, list) or not links:
+        return jsonify({"ok": False, "error": "links richiesto (lista di {slug, civitai_url})"}), 400
+    if len(links) > LINK_BATCH_MAX:
+        return jsonify({"ok": False, "error": f"al massimo {LINK_BATCH_MAX} link per richiesta"}), 400
+    todo, rejected = {}, []
+    for d in links:
+        slug = str((d or {}).get("slug") or "").strip()
+        url = str((d or {}).get("civitai_url") or "").strip()
+        if not slug or not scan_models.parse_civitai_url(url)[0]:
+            rejected.append({"slug": slug, "ok": False, "error": "slug o link Civitai non valido"})
+        elif not INDEX.item(slug):
+            rejected.append({"slug": slug, "ok": False, "error": "Slug non trovato in index.json"})
+        else:
+            todo[slug] = url
+    events = queue.Queue()
+
+    def on_result(slug, res):
+        if isinstance(res, Exception):
+            events.put({"slug": slug, "ok": False, "error": str(res)[:200]})
+            return
+        for err in res["errors"]:
+            log(err)
+        events.put({"slug": slug, "ok": True, "civitai_url": res["url"], "previews": res["previews"],
+                    "triggerWords": res["triggerWords"]})
+
+    def work():
+        linked = 0
+        try:
+            results = scan_models.link_many(CIVITAI, todo, OUT_DIR, fetch_preview, on_result, ttl=0)
+            updates = {slug: scan_models.link_update(slug, res)
+                       for slug, res in results.items() if not isinstance(res, Exception)}
+            if updates:
+                INDEX.update(updates)
+            linked = len(updates)
+            events.put({"done": True, "ok": True, "linked": linked, "failed": len(rejected) + len(todo) - linked})
+        except Exception as e:
+            log(f"set_links_and_fetch error: {e}")
+            events.put({"done": True, "ok": False, "error": str(e), "linked": 0, "failed": len(links)})
+
+    threading.Thread(target=work, name="link-batch", daemon=True).start()
+
+    def stream():
+        for rec in rejected:
+            yield json.dumps(rec, ensure_ascii=False) + "\n"
+        while True:
+            rec = events.get()
+            yield json.dumps(rec, ensure_ascii=False) + "\n"
+            if rec.get("done"):
+                return
+
+    return app.response_class(stream(), mimetype="application/x-ndjson",
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def scan_options() -> dict:
+    """Opzioni di scansione del server, le stesse per /api/refresh e per il watcher
+    (argomenti di scan_models.apply_changes)."""
+    return {"new_days": NEW_DAYS, "hash_mode": HASH_MODE, "gc_previews": True, "thumb_formats": THUMB_FORMATS}
+
+def scan_command(extra: List[str]):
+    """(cmd, cwd) per lanciare scan_models.py sulle ROOTS correnti, oppure
+    (None, risposta di errore) se mancano le radici o lo script."""
     if not ROOTS:
-        return jsonify({"ok": False, "error": "Nessun percorso configurato. Vai in Opzioni e salva almeno una cartella."}), 400
+        return None, (jsonify({"ok": False, "error": "Nessun percorso configurato. Vai in Opzioni e salva almeno una cartella."}), 400)
 
     script = resolve_scan_script(SCAN_SCRIPT, OUT_DIR)
     if not script or not script.exists():
         msg = f"scan_models.py non trovato. Cercato in: {SCAN_SCRIPT}, {Path(__file__).parent/'scan_models.py'}, {OUT_DIR.parent/'scan_models.py'}"
-        log(msg);  return jsonify({"ok": False, "error": msg}), 500
-    try:
-        cmd = [sys.executable, str(script),
-               "--out", str(OUT_DIR),
-               "--gc-previews",
-               "--new-days", "30",
-               "--roots"] + ROOTS
-        env = os.environ.copy()
-        env["PYTHONIOENCODING"] = "utf-8"
+        log(msg);  return None, (jsonify({"ok": False, "error": msg}), 500)
 
-        log("=== SCAN START ===")
-        log(f"script : {script}")
-        log(f"roots  : {ROOTS}")
-        log(f"outdir : {OUT_DIR}")
-        res = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8",
-                             cwd=str(script.parent), env=env)
-        log(res.stdout.strip())
-        if res.returncode != 0:
-            log(f"[scan stderr]\n{res.stderr}")
-            return jsonify({"ok": False, "error": "scan_models.py ha fallito", "stderr": res.stderr}), 500
-
-        idx = load_index()
-        log("=== SCAN DONE ===")
-        return jsonify({"ok": True, "counts": idx.get("counts", {}), "generated_at": idx.get("generated_at")})
-    except Exception as e:
-        log(f"refresh error: {e}")
-        return jsonify({"ok": False, "error": str(e)}), 500
+    opts = scan_options()
+    cmd = [sys.executable, str(script),
+           "--out", str(OUT_DIR),
+           "--new-days", str(opts["new_days"]),
+           "--hash", opts["hash_mode"],
+           "--stream"] + (["--gc-previews"] if opts["gc_previews"] else []) \
+        + (["--thumb-avif"] if "avif" in opts["thumb_formats"] else []) + extra + ["--roots"] + ROOTS
+    return cmd, script.parent
+
+def job_links(job: ScanJob) -> dict:
+    return {"job": job.id, "status": f"/api/refresh/{job.id}", "events": f"/api/refresh/{job.id}/events"}
+
+@app.route("/api/refresh", methods=["POST"])
+def api_refresh():
+    """Avvia (o riusa, se già in corso) una scansione in background e restituisce
+    subito l'id del job. Con ?wait=1 attende la fine come nelle versioni precedenti."""
+    cmd, cwd = scan_command([])
+    if cmd is None:
+        return cwd
+    job, created = JOBS.start(cmd, cwd=cwd)
+    if job is None:
+        return jsonify({"ok": False, "error": "Scansione già in corso da un altro processo, riprova al termine"}), 409
+    if request.args.get("wait"):
+        job.wait()
+        snap = job.snapshot()
+        if snap["state"] != "done":
+            return jsonify({"ok": False, "error": snap.get("error") or "scan_models.py ha fallito", "job": snap}), 500
+        return jsonify({"ok": True, "counts": snap["counts"], "generated_at": snap["generated_at"], "job": snap})
+    return jsonify({"ok": True, "created": created, **job_links(job)}), 202
+
+@app.route("/api/civitai_lookup", methods=["POST"])
+def api_civitai_lookup():
+    """Job in background: scansione + ricerca per SHA-256 su Civitai dei modelli
+    senza link (scan_models.py --civitai-lookup). ?retry=1 ritenta gli hash non trovati.
+    Lo stato si segue con gli stessi endpoint di /api/refresh."""
+    extra = ["--civitai-lookup"] + (["--lookup-retry"] if request.args.get("retry") else [])
+    cmd, cwd = scan_command(extra)
+    if cmd is None:
+        return cwd
+    job, created = JOBS.start(cmd, cwd=cwd)
+    if not created:
+        return jsonify({"ok": False, "error": "Scansione già in corso, riprova al termine",
+                        **(job_links(job) if job else {})}), 409
+    return jsonify({"ok": True, "created": True, **job_links(job)}), 202
+
+@app.route("/api/refresh/<job_id>", methods=["GET"])
+def api_refresh_status(job_id):
+    job = JOBS.get(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "Job non trovato"}), 404
+    return jsonify({"ok": True, **job.snapshot()})
+
+@app.route("/api/refresh/<job_id>/events", methods=["GET"])
+def api_refresh_events(job_id):
+    """Server-Sent Events: uno snapshot del job a ogni avanzamento, fino alla fine."""
+    job = JOBS.get(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "Job non trovato"}), 404
+
+    def stream():
+        version = -1
+        while True:
+            version, snap = job.next_update(version, timeout=15)
+            if snap is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"data: {json.dumps(snap, ensure_ascii=False)}\n\n"
+            if snap["state"] != "running":
+                return
+
+    return app.response_class(stream(), mimetype="text/event-stream",
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # ------------------------------ static ------------------------------
 @app.route("/")
@@ -339,16 +1007,158 @@ def root():
 def index_html():
     return send_from_directory(str(OUT_DIR), "index.html")
 
+def offload_static(rel: str, mimetype: Optional[str] = None):
+    """Risposta senza corpo: il file lo invia il front-end (--static-offload).
+    x-sendfile: X-Sendfile col percorso assoluto; x-accel: X-Accel-Redirect verso
+    ACCEL_PREFIX + percorso relativo. ETag, Last-Modified e 304 restano gestiti qui."""
+    resp = wz_send_from_directory(str(OUT_DIR), rel, request.environ, mimetype=mimetype, use_x_sendfile=True,
+                                  response_class=app.response_class, max_age=app.get_send_file_max_age(rel))
+    path = resp.headers.pop("X-Sendfile", None)
+    if resp.status_code == 200 and path:
+        if STATIC_OFFLOAD == "x-accel":
+            resp.headers["X-Accel-Redirect"] = ACCEL_PREFIX + quote(rel)
+        else:
+            resp.headers["X-Sendfile"] = path
+    return resp
+
 @app.route("/<path:filename>")
 def static_files(filename):
-    fpath = OUT_DIR / filename
-    if not fpath.exists() or not fpath.is_file():
-        abort(404)
-    return send_from_directory(str(OUT_DIR), filename)
+    # Nessun exists()/is_file() preventivo: send_from_directory risponde già 404.
+    # Con waitress/gunicorn il corpo passa da wsgi.file_wrapper (sendfile).
+    preview = filename.startswith("assets/previews/")
+    rel, mimetype = filename, None
+    # ?w=<px> sulle preview: variante WebP/AVIF più adatta, solo se il browser la
+    # dichiara esplicitamente in Accept (*/* non basta: vale anche per chi non la decodifica)
+    w = request.args.get("w", type=int)
+    if w and preview:
+        accepted = set(request.accept_mimetypes.values())
+        variant, mimetype = image_variants.pick_variant(OUT_DIR / filename, w, accepted.__contains__)
+        if mimetype:
+            rel = filename.rsplit("/", 1)[0] + "/" + variant.name
+    if preview and STATIC_OFFLOAD:
+        resp = offload_static(rel, mimetype)
+    else:
+        resp = send_from_directory(str(OUT_DIR), rel, mimetype=mimetype)
+    if w and preview:
+        resp.vary.add("Accept")
+    # URL versionati con hash del contenuto (?v=...): cache immutabile lato browser
+    if request.args.get("v") and preview:
+        resp.headers["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return resp
+
+# ------------------------------ app factory ------------------------------
+def use_forkserver():
+    """Scansione in-process: i processi per hash e miniature partono da un
+    forkserver (POSIX) invece che dal fork del server con i suoi thread attivi."""
+    import multiprocessing
+    import model_hash
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        model_hash.MP_CONTEXT = "forkserver"
+        multiprocessing.get_context("forkserver").set_forkserver_preload(["scan_models"])
+
+def _env(name: str, default=None):
+    return os.environ.get("FOCUSCATALOG_" + name, default)
+
+def _env_flag(name: str) -> bool:
+    return (_env(name) or "").strip().lower() in ("1", "true", "yes", "on")
+
+def create_app(out: Optional[str] = None, roots: Optional[List[str]] = None, scan_script: Optional[str] = None,
+               preview_max: Optional[int] = None, thumb_avif: Optional[bool] = None, db: Optional[bool] = None,
+               watch: Optional[dict] = None, static_offload: Optional[str] = None,
+               accel_prefix: Optional[str] = None, scan_mode: Optional[str] = None,
+               new_days: Optional[int] = None, hash_mode: Optional[str] = None) -> Flask:
+    """Configura lo stato del modulo e restituisce l'app Flask. Usata da main() e dai
+    server WSGI esterni (es. gunicorn 'server:create_app()'); i parametri non passati
+    si leggono dalle variabili FOCUSCATALOG_* (ROOTS separate da os.pathsep).
+    Va chiamata una volta per processo: con più worker, in ciascun worker."""
+    global OUT_DIR, INDEX_PATH, ROOTS, SCAN_SCRIPT, CONFIG_PATH, CIVITAI, PREVIEW_MAX, INDEX, TERMS, WATCH_OPTS, \
+        THUMB_FORMATS, JOB_DIR, STATIC_OFFLOAD, ACCEL_PREFIX, SCAN_MODE, NEW_DAYS, HASH_MODE, _CONFIG_SIG, _CORS_DONE
+    if roots is None:
+        roots = [r for r in (_env("ROOTS") or "").split(os.pathsep) if r]
+    if watch is None and _env_flag("WATCH"):
+        watch = {"poll": _env_flag("WATCH_POLL"), "interval": float(_env("WATCH_INTERVAL", 30)),
+                 "debounce": float(_env("WATCH_DEBOUNCE", 2)), "jobs": int(_env("JOBS", 1))}
+    db = _env_flag("DB") if db is None else db
+    offload = static_offload if static_offload is not None else _env("STATIC_OFFLOAD", "none")
+    if offload not in ("none", "x-accel", "x-sendfile"):
+        raise ValueError(f"static_offload non valido: {offload}")
+    mode = scan_mode or _env("SCAN_MODE", SCAN_MODE)
+    if mode not in ("inprocess", "subprocess"):
+        raise ValueError(f"scan_mode non valido: {mode}")
+    hash_mode = hash_mode or _env("HASH", HASH_MODE)
+    if hash_mode not in ("none", "quick", "full"):
+        raise ValueError(f"hash_mode non valido: {hash_mode}")
+    if not _CORS_DONE:
+        from flask_cors import CORS
+        CORS(app, resources={r"/api/*": {"origins": "*"}})
+        _CORS_DONE = True
+
+    OUT_DIR = Path(out or _env("OUT", "public")).resolve()
+    INDEX_PATH = OUT_DIR / "index.json"
+    INDEX = IndexCache(INDEX_PATH, index_store.enable_db(INDEX_PATH) if db else index_store.open_db(INDEX_PATH))
+    TERMS = term_index.TermIndex(OUT_DIR)
+    CONFIG_PATH = OUT_DIR / "config.json"
+    JOB_DIR = OUT_DIR / ".jobs"
+    ROOTS = [norm_path(r) for r in roots]
+    SCAN_SCRIPT = Path(scan_script or _env("SCAN_SCRIPT", "scan_models.py")).resolve()
+    CIVITAI = CivitaiClient(cache_dir=OUT_DIR / ".cache" / "civitai")
+    PREVIEW_MAX = max(0, int(preview_max if preview_max is not None else _env("PREVIEW_MAX", PREVIEW_MAX)))
+    THUMB_FORMATS = image_variants.variant_formats(_env_flag("THUMB_AVIF") if thumb_avif is None else thumb_avif)
+    STATIC_OFFLOAD = None if offload == "none" else offload
+    ACCEL_PREFIX = "/" + (accel_prefix or _env("ACCEL_PREFIX", ACCEL_PREFIX)).strip("/") + "/"
+    SCAN_MODE = mode
+    NEW_DAYS = int(new_days if new_days is not None else _env("NEW_DAYS", NEW_DAYS))
+    HASH_MODE = hash_mode
+    if SCAN_MODE == "inprocess":
+        use_forkserver()
+
+    # Override da config.json
+    _CONFIG_SIG = None
+    sync_config()
+
+    log(f"FocusCatalog v{APP_VER} — Python {platform.python_version()} ({platform.system()}) pid {os.getpid()}")
+    log(f"OUT_DIR = {OUT_DIR}")
+    log(f"INDEX_PATH = {INDEX_PATH}")
+    log(f"CONFIG_PATH = {CONFIG_PATH}")
+    log(f"ROOTS = {ROOTS}")
+    log(f"SCAN_SCRIPT = {SCAN_SCRIPT} ({SCAN_MODE}, --hash {HASH_MODE}, --new-days {NEW_DAYS})")
+    if STATIC_OFFLOAD:
+        log(f"STATIC_OFFLOAD = {STATIC_OFFLOAD}" + (f" ({ACCEL_PREFIX})" if STATIC_OFFLOAD == "x-accel" else ""))
+
+    WATCH_OPTS = watch
+    if WATCH_OPTS is not None:
+        start_watcher()
+    return app
+
+# ------------------------------ serving ------------------------------
+def serve_waitress(host: str, port: int, threads: int, app_kwargs: dict):
+    try:
+        import waitress
+    except ImportError:
+        sys.exit("[server] --server waitress richiede il pacchetto waitress (pip install waitress)")
+    waitress.serve(create_app(**app_kwargs), host=host, port=port, threads=threads, ident="FocusCatalog")
+
+def serve_gunicorn(host: str, port: int, workers: int, threads: int, app_kwargs: dict):
+    """gunicorn con worker gthread; l'app è creata in ogni worker dopo il fork
+    (niente connessioni SQLite o thread del watcher ereditati dal master)."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("[server] --server gunicorn richiede il pacchetto gunicorn (solo Linux/macOS: pip install gunicorn)")
+
+    class FocusCatalogApp(BaseApplication):
+        def load_config(self):
+            for key, value in {"bind": f"{host}:{port}", "workers": workers, "threads": threads,
+                               "worker_class": "gthread"}.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return create_app(**app_kwargs)
+
+    FocusCatalogApp().run()
 
 # ------------------------------ entry ------------------------------
 def main():
-    global OUT_DIR, INDEX_PATH, ROOTS, SCAN_SCRIPT, CONFIG_PATH
     ap = argparse.ArgumentParser()
     ap.add_argument("--out", default="public", help="Cartella con index.html/index.json")
     ap.add_argument("--host", default="127.0.0.1")
@@ -358,32 +1168,40 @@ def main():
         r"D:\Stable Diffusion\Fooocus_win64_2-1-831\Fooocus\models\loras",
     ], help="Cartelle da scansionare")
     ap.add_argument("--scan-script", default="scan_models.py", help="Percorso a scan_models.py")
+    ap.add_argument("--preview-max", type=int, default=PREVIEW_MAX, help="Lato massimo (px) delle preview Civitai, 0 = originale")
+    ap.add_argument("--thumb-avif", action="store_true", help="Crea anche varianti AVIF delle preview (se Pillow lo supporta)")
+    ap.add_argument("--db", action="store_true", help="Usa public/catalog.db (SQLite + FTS5) come catalogo; index.json diventa un'esportazione")
+    ap.add_argument("--watch", action="store_true", help="Osserva le ROOTS e aggiorna l'index solo per i file cambiati")
+    ap.add_argument("--watch-poll", action="store_true", help="Forza il polling (per mount di rete senza inotify)")
+    ap.add_argument("--watch-interval", type=float, default=30.0, help="Secondi tra due polling")
+    ap.add_argument("--watch-debounce", type=float, default=2.0, help="Secondi di quiete prima di applicare le modifiche")
+    ap.add_argument("--jobs", type=int, default=1, help="Processi per le miniature in modalità --watch (0 = numero di CPU)")
+    ap.add_argument("--server", choices=("dev", "waitress", "gunicorn"), default="dev",
+                    help="dev = server di sviluppo Flask; waitress (multi-thread, anche Windows) o gunicorn (multi-processo) in produzione")
+    ap.add_argument("--workers", type=int, default=2, help="Processi worker con --server gunicorn")
+    ap.add_argument("--threads", type=int, default=8, help="Thread per worker con --server waitress/gunicorn")
+    ap.add_argument("--static-offload", choices=("none", "x-accel", "x-sendfile"), default="none",
+                    help="Delega l'invio di assets/previews al front-end: x-accel (nginx) o x-sendfile (Apache/lighttpd)")
+    ap.add_argument("--accel-prefix", default=ACCEL_PREFIX, help="Location interna nginx che punta a --out (con x-accel)")
+    ap.add_argument("--hash", choices=("none", "quick", "full"), default=None,
+                    help="Impronte dei modelli per refresh e watcher (quick = rinomine e duplicati probabili, full = sha256)")
+    ap.add_argument("--new-days", type=int, default=None, help="Giorni per marcare come NUOVO (refresh e watcher)")
+    ap.add_argument("--scan-mode", choices=("inprocess", "subprocess"), default=None,
+                    help="Aggiorna in un thread del server (predefinito) o lanciando python scan_models.py")
     args = ap.parse_args()
 
-    OUT_DIR = Path(args.out).resolve()
-    INDEX_PATH = OUT_DIR / "index.json"
-    CONFIG_PATH = OUT_DIR / "config.json"
-    ROOTS = [norm_path(r) for r in args.roots]
-    SCAN_SCRIPT = Path(args.scan_script).resolve()
-
-    # Override da config.json
-    _cfg = load_config()
-    cp = norm_path(_cfg.get("checkpointDir", "") or "")
-    lr = norm_path(_cfg.get("loraDir", "") or "")
-    _override = [x for x in [cp, lr] if x]
-    if _override:
-        ROOTS = _override
-        log(f"Override ROOTS da config.json: {ROOTS}")
-
-    log(f"FocusCatalog v{APP_VER} — Python {platform.python_version()} ({platform.system()})")
-    log(f"OUT_DIR = {OUT_DIR}")
-    log(f"INDEX_PATH = {INDEX_PATH}")
-    log(f"CONFIG_PATH = {CONFIG_PATH}")
-    log(f"ROOTS = {ROOTS}")
-    log(f"SCAN_SCRIPT = {SCAN_SCRIPT}")
-
-    app.run(host=args.host, port=args.port, debug=False, threaded=True)
+    app_kwargs = dict(out=args.out, roots=args.roots, scan_script=args.scan_script, preview_max=args.preview_max,
+                      thumb_avif=args.thumb_avif, db=args.db, static_offload=args.static_offload,
+                      accel_prefix=args.accel_prefix, scan_mode=args.scan_mode,
+                      new_days=args.new_days, hash_mode=args.hash,
+                      watch={"poll": args.watch_poll, "interval": args.watch_interval,
+                             "debounce": args.watch_debounce, "jobs": args.jobs} if args.watch else None)
+    if args.server == "gunicorn":
+        serve_gunicorn(args.host, args.port, max(1, args.workers), max(1, args.threads), app_kwargs)
+    elif args.server == "waitress":
+        serve_waitress(args.host, args.port, max(1, args.threads), app_kwargs)
+    else:
+        create_app(**app_kwargs).run(host=args.host, port=args.port, debug=False, threaded=True)
 
 if __name__ == "__main__":
     main()
-
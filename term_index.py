@@ -0,0 +1,228 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# term_index.py — FocusCatalog
+# Indice invertito trigger word / tag → slug (out/.term_index.json), aggiornato a
+# ogni scrittura dell'index applicando solo le differenze degli slug cambiati.
+# TermIndex lo carica in array ordinati per il completamento a prefisso (anche
+# sulle singole parole di un termine) e, se servono altri risultati, a una
+# modifica di distanza (errori di battitura), dai termini più usati.
+# -*- coding: utf-8 -*-
+
+import heapq
+import json
+import threading
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+import index_store
+
+TERMS_NAME = ".term_index.json"
+TERMS_VERSION = 1
+# campo dell'item → tipo di termine
+KINDS = (("triggerWords", "trigger"), ("triggerCandidates", "tag"))
+BLOCK = 64  # chiavi per blocco pre-ordinato per numero di modelli
+FUZZY_MIN = 3  # lunghezza minima della query per la ricerca tollerante
+
+
+def terms_path(out_dir: Path) -> Path:
+    return Path(out_dir) / TERMS_NAME
+
+
+def normalize(term: str) -> str:
+    return " ".join(str(term or "").split()).casefold()
+
+
+def item_terms(item: Dict[str, Any]) -> Dict[str, List[str]]:
+    """{tipo: [termini]} di un item, senza duplicati e con gli spazi compattati."""
+    out: Dict[str, List[str]] = {}
+    for field, kind in KINDS:
+        terms = list(dict.fromkeys(" ".join(str(t).split()) for t in item.get(field) or [] if str(t).strip()))
+        if terms:
+            out[kind] = terms
+    return out
+
+
+def load(out_dir: Path) -> Dict[str, Any]:
+    try:
+        data = json.loads(terms_path(out_dir).read_text(encoding="utf-8"))
+        if data.get("version") == TERMS_VERSION:
+            return data
+    except (OSError, ValueError):
+        pass
+    # slugs: termini per slug (per calcolare le differenze);
+    # terms: chiave normalizzata → {"text": forma originale, tipo: [slug]}
+    return {"version": TERMS_VERSION, "slugs": {}, "terms": {}}
+
+
+def _apply(terms: Dict[str, Dict[str, Any]], slug: str, kinds: Dict[str, List[str]], add: bool):
+    for kind, words in kinds.items():
+        for text in words:
+            key = normalize(text)
+            entry = terms.get(key)
+            if add:
+                if entry is None:
+                    entry = terms[key] = {"text": text}
+                slugs = entry.setdefault(kind, [])
+                if slug not in slugs:
+                    slugs.append(slug)
+            elif entry is not None and slug in entry.get(kind, ()):
+                entry[kind].remove(slug)
+                if not entry[kind]:
+                    del entry[kind]
+                if len(entry) == 1:  # resta solo "text"
+                    del terms[key]
+
+
+def sync(out_dir: Path, items: Iterable[Dict[str, Any]]) -> int:
+    """Allinea l'indice agli item appena scritti toccando solo gli slug i cui
+    termini sono cambiati (o spariti); se il file non esiste lo scrive anche senza
+    termini. Chiamata da index_store.write_index sotto index_lock; restituisce il
+    numero di slug aggiornati."""
+    data = load(out_dir)
+    old = data["slugs"]
+    new = {}
+    for it in items:
+        terms = item_terms(it)
+        if terms and it.get("slug"):
+            new[it["slug"]] = terms
+    changed = [s for s in set(old) | set(new) if old.get(s) != new.get(s)]
+    if not changed and terms_path(out_dir).exists():
+        return 0
+    terms = data["terms"]
+    for slug in changed:
+        if slug in old:
+            _apply(terms, slug, old[slug], add=False)
+        if slug in new:
+            _apply(terms, slug, new[slug], add=True)
+    data["slugs"] = new
+    index_store.atomic_write_text(terms_path(out_dir), json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+    return len(changed)
+
+
+def _edits(q: str, alphabet: Iterable[str]) -> Set[str]:
+    """Varianti di q a una modifica (cancellazione, scambio, sostituzione,
+    inserzione) utili come prefisso: le modifiche in coda sono già coperte da q[:-1]."""
+    n = len(q)
+    out = {q[:i] + q[i + 1:] for i in range(n)}
+    out.update(q[:i] + q[i + 1] + q[i] + q[i + 2:] for i in range(n - 1))
+    for c in alphabet:
+        out.update(q[:i] + c + q[i + 1:] for i in range(n - 1))
+        out.update(q[:i] + c + q[i:] for i in range(n))
+    out.discard(q)
+    return {v for v in out if len(v) >= FUZZY_MIN - 1}
+
+
+class _Sorted:
+    """Chiavi ordinate con l'id del termine e, per blocchi di BLOCK chiavi, le
+    posizioni ordinate per numero di modelli: i migliori risultati di un intervallo
+    si ottengono fondendo pochi blocchi invece di esaminarlo tutto."""
+
+    def __init__(self, pairs: List[Tuple[str, int]], counts: List[int]):
+        pairs.sort()
+        self.keys = [k for k, _ in pairs]
+        self.ids = [t for _, t in pairs]
+        self.rank = [-counts[t] for t in self.ids]
+        n = len(self.keys)
+        self.blocks = [sorted(range(i, min(i + BLOCK, n)), key=self.rank.__getitem__) for i in range(0, n, BLOCK)]
+
+    def prefix(self, q: str) -> Tuple[int, int]:
+        return bisect_left(self.keys, q), bisect_left(self.keys, q + "\U0010ffff")
+
+    def top(self, lo: int, hi: int) -> Iterator[int]:
+        """Id dei termini in [lo, hi) dal più usato, generati su richiesta."""
+        key = self.rank.__getitem__
+        if hi - lo <= 2 * BLOCK:
+            parts = [sorted(range(lo, hi), key=key)]
+        else:
+            b0, b1 = -(-lo // BLOCK), hi // BLOCK
+            parts = [sorted(range(lo, b0 * BLOCK), key=key), sorted(range(b1 * BLOCK, hi), key=key)] + self.blocks[b0:b1]
+        for pos in heapq.merge(*parts, key=key):
+            yield self.ids[pos]
+
+
+class TermIndex:
+    """Vista in memoria di .term_index.json per /api/terms, ricaricata solo quando
+    il file cambia: un array ordinato dei termini interi e uno delle singole parole
+    dei termini composti, entrambi interrogati per prefisso con bisect."""
+
+    def __init__(self, out_dir: Path):
+        self.path = terms_path(out_dir)
+        self.lock = threading.Lock()
+        self._sig = None
+        self._build({})
+
+    def _stat_sig(self):
+        try:
+            st = self.path.stat()
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _refresh(self):
+        sig = self._stat_sig()
+        if sig != self._sig:
+            self._build(load(self.path.parent)["terms"] if sig else {})
+            self._sig = sig
+
+    def _build(self, terms: Dict[str, Dict[str, Any]]):
+        self.terms = list(terms.values())
+        self.counts = [len({s for _, k in KINDS for s in e.get(k, ())}) for e in self.terms]
+        keys = list(terms)
+        words = [(w, tid) for tid, key in enumerate(keys) if " " in key for w in set(key.split(" "))]
+        self.full = _Sorted([(key, tid) for tid, key in enumerate(keys)], self.counts)
+        self.words = _Sorted(words, self.counts)
+        self.alphabet = sorted(set("".join(keys)) - {" "})
+
+    def complete(self, q: str, limit: int = 20, kind: str = "", fuzzy: bool = True) -> List[Dict[str, Any]]:
+        """Termini che iniziano per q, poi quelli con una parola che inizia per q e,
+        se non bastano a riempire limit e fuzzy è attivo, quelli a una modifica di
+        distanza; in ogni gruppo prima i termini usati da più modelli (a parte la
+        corrispondenza esatta, sempre in testa)."""
+        q = normalize(q)
+        with self.lock:
+            self._refresh()
+            if not q:
+                return []
+            out: List[Dict[str, Any]] = []
+            seen: Set[int] = set()
+
+            def take(tids: Iterable[int], is_fuzzy: bool = False) -> bool:
+                for tid in tids:
+                    entry = self.terms[tid]
+                    if tid in seen or (kind and kind not in entry):
+                        continue
+                    seen.add(tid)
+                    slugs = entry[kind] if kind else list(dict.fromkeys(s for _, k in KINDS for s in entry.get(k, ())))
+                    out.append({"term": entry["text"], "kinds": [k for _, k in KINDS if k in entry],
+                                "count": len(slugs), "slugs": slugs, "fuzzy": is_fuzzy})
+                    if len(out) >= limit:
+                        return True
+                return False
+
+            lo, hi = self.full.prefix(q)
+            exact = [self.full.ids[lo]] if lo < hi and self.full.keys[lo] == q else []
+            if take(exact) or take(self.full.top(lo, hi)) or take(self.words.top(*self.words.prefix(q))):
+                return out
+            if fuzzy and len(q) >= FUZZY_MIN:
+                ranges = [(idx, r) for v in _edits(q, self.alphabet) for idx in (self.full, self.words)
+                          for r in [idx.prefix(v)] if r[0] < r[1]]
+                take(heapq.merge(*(idx.top(*r) for idx, r in ranges), key=lambda t: -self.counts[t]), True)
+            return out
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            self._refresh()
+            return {"terms": len(self.terms), "words": len(self.words.keys)}
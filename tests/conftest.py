@@ -0,0 +1,8 @@
+# conftest.py — FocusCatalog
+# I moduli stanno nella radice del repository, non in un pacchetto.
+# -*- coding: utf-8 -*-
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,77 @@
+# test_slugs.py — FocusCatalog
+# Slug stabili: un file non eredita slug e metadati di un altro file sparito.
+# -*- coding: utf-8 -*-
+
+from pathlib import Path
+
+from PIL import Image
+
+import index_store
+import scan_models
+
+URL = "https://civitai.com/models/1?modelVersionId=10"
+
+
+def scan(lib: Path, out: Path):
+    scan_models.main(["--roots", str(lib), "--out", str(out), "--jobs", "1", "--hash", "quick"])
+
+
+def items(out: Path):
+    return {it["filename"]: it for it in index_store.read_index(out / "index.json")["items"]}
+
+
+def link(out: Path, slug: str):
+    data = index_store.read_index(out / "index.json")
+    for it in data["items"]:
+        if it["slug"] == slug:
+            it.update(civitai_url=URL, display_name="Linked", triggerWordsChecked=True)
+    index_store.write_index(out / "index.json", data)
+
+
+def library(tmp_path: Path):
+    lib, out = tmp_path / "lib", tmp_path / "out"
+    a, b = lib / "a" / "X.safetensors", lib / "b" / "X.safetensors"
+    for i, p in enumerate((a, b)):
+        p.parent.mkdir(parents=True)
+        p.write_bytes(bytes([i]) * (1000 + i))
+    Image.new("RGB", (64, 64), "red").save(a.with_suffix(".png"))
+    scan(lib, out)
+    slugs = {f: it["slug"] for f, it in items(out).items()}
+    assert slugs[str(a)] == "X" and slugs[str(b)].startswith("X-")
+    link(out, "X")
+    return lib, out, a, b, slugs[str(b)]
+
+
+def test_deleted_owner_does_not_hand_over_slug(tmp_path):
+    lib, out, a, b, b_slug = library(tmp_path)
+    a.unlink()
+    scan(lib, out)
+    it = items(out)[str(b)]
+    assert it["slug"] == b_slug
+    assert not it.get("civitai_url") and it.get("display_name") != "Linked"
+
+
+def test_renamed_owner_keeps_slug_and_metadata(tmp_path):
+    lib, out, a, b, b_slug = library(tmp_path)
+    moved = lib / "c" / "X.safetensors"
+    moved.parent.mkdir()
+    a.rename(moved)
+    scan(lib, out)
+    got = items(out)
+    assert got[str(b)]["slug"] == b_slug and not got[str(b)].get("civitai_url")
+    assert got[str(moved)]["slug"] == "X" and got[str(moved)]["civitai_url"] == URL
+    assert [it["filename"] for it in got.values() if it.get("civitai_url")] == [str(moved)]
+
+
+def test_renamed_to_new_name_keeps_metadata(tmp_path):
+    lib, out, a, b, b_slug = library(tmp_path)
+    renamed = a.with_name("Z.safetensors")
+    a.rename(renamed)
+    a.with_suffix(".png").rename(renamed.with_suffix(".png"))
+    scan(lib, out)
+    got = items(out)
+    assert got[str(b)]["slug"] == b_slug and not got[str(b)].get("civitai_url")
+    assert not got[str(b)].get("previews")
+    z = got[str(renamed)]
+    assert z["slug"] == "Z" and z["civitai_url"] == URL
+    assert z["previews"] and all(rel.startswith("assets/previews/Z/") for rel in z["previews"])
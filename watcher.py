@@ -0,0 +1,166 @@
+# ===============================================================
+# 📦 License
+# FocusCatalog © 2025 MetaDarko
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike 4.0 International License (CC-BY-SA 4.0).
+#
+# You are free to share and adapt the material for any purpose, even commercially,
+# as long as you give appropriate credit to MetaDarko,
+# and distribute your contributions under the same license.
+#
+# In short: anyone can improve or fork FocusCatalog,
+# but the authorship remains with MetaDarko, and all derivatives must remain open.
+# ===============================================================
+
+# watcher.py — FocusCatalog
+# Osserva le cartelle dei modelli e raccoglie i percorsi cambiati (aggiunte,
+# rimozioni, rinomine) in lotti con debounce, passati a scan_models.apply_changes.
+# Usa inotify/FSEvents/ReadDirectoryChangesW tramite watchdog se installato,
+# altrimenti (o con force_poll, es. mount SMB/NFS) un polling periodico degli stat.
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # opzionale: senza watchdog si usa il polling
+    Observer = None
+    FileSystemEventHandler = object
+
+
+def observer_backend(cls) -> str:
+    """Nome del backend di un observer watchdog (InotifyObserver → "inotify",
+    FSEventsObserver → "fsevents", WindowsApiObserver → "windowsapi", ...)."""
+    name = getattr(cls, "__name__", "") or "watchdog"
+    return (name[:-len("Observer")] if name.endswith("Observer") and name != "Observer" else name).lower()
+
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, watcher: "Watcher"):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        self.watcher.notify([p for p in paths if p and (event.is_directory or self.watcher.wants(p))])
+
+
+class Watcher:
+    """Raccoglie i percorsi cambiati sotto `roots` e chiama on_changes(paths)
+    quando non arrivano eventi da `debounce` secondi. Le chiamate sono seriali
+    (un solo thread di consegna), gli eventi arrivati nel frattempo finiscono
+    nel lotto successivo."""
+
+    def __init__(self, roots: Iterable[str], on_changes: Callable[[List[str]], object],
+                 exts: Optional[Set[str]] = None, debounce: float = 2.0,
+                 poll_interval: float = 30.0, force_poll: bool = False):
+        self.roots = [Path(r) for r in roots]
+        self.on_changes = on_changes
+        self.exts = {e.lower() for e in exts} if exts else None
+        self.debounce = max(0.0, debounce)
+        self.poll_interval = max(1.0, poll_interval)
+        self._native = not (force_poll or Observer is None)
+        self.backend = observer_backend(Observer) if self._native else "poll"
+        self._pending: Set[str] = set()
+        self._last_event = 0.0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._observer = None
+        self._snapshot: Dict[str, Tuple[int, int, int]] = {}
+
+    def wants(self, path: str) -> bool:
+        return self.exts is None or os.path.splitext(path)[1].lower() in self.exts
+
+    def notify(self, paths: Iterable[str]):
+        paths = [str(p) for p in paths]
+        if not paths:
+            return
+        with self._cond:
+            self._pending.update(paths)
+            self._last_event = time.monotonic()
+            self._cond.notify_all()
+
+    # ------------------------ ciclo di vita ------------------------
+    def start(self):
+        roots = [r for r in self.roots if r.is_dir()]
+        if self._native:
+            self._observer = Observer()
+            for r in roots:
+                self._observer.schedule(_Handler(self), str(r), recursive=True)
+            self._observer.start()
+        else:
+            self._snapshot = self._walk(roots)
+            self._spawn(self._poll_loop, "watch-poll")
+        self._spawn(self._deliver_loop, "watch-deliver")
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        for t in self._threads:
+            t.join(timeout=5)
+
+    def _spawn(self, target, name: str):
+        t = threading.Thread(target=target, name=name, daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    # ------------------------ consegna con debounce ------------------------
+    def _deliver_loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                while not self._pending and not self._stop.is_set():
+                    self._cond.wait()
+                quiet = self._last_event + self.debounce - time.monotonic()
+                if quiet > 0:
+                    self._cond.wait(quiet)
+                    continue
+                batch, self._pending = sorted(self._pending), set()
+            if self._stop.is_set():
+                return
+            try:
+                self.on_changes(batch)
+            except Exception as e:
+                print(f"[watch] errore applicando {len(batch)} modifiche: {e}", flush=True)
+
+    # ------------------------ polling ------------------------
+    def _walk(self, roots: Iterable[Path]) -> Dict[str, Tuple[int, int, int]]:
+        """Firma (size, mtime_ns, inode) dei file interessanti; os.scandir riusa
+        gli stat già letti dal listing dove il sistema li fornisce."""
+        out: Dict[str, Tuple[int, int, int]] = {}
+        stack = [str(r) for r in roots]
+        while stack:
+            d = stack.pop()
+            try:
+                with os.scandir(d) as it:
+                    for e in it:
+                        try:
+                            if e.is_dir(follow_symlinks=False):
+                                stack.append(e.path)
+                            elif self.wants(e.name):
+                                st = e.stat()
+                                out[e.path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return out
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            current = self._walk([r for r in self.roots if r.is_dir()])
+            old = self._snapshot
+            changed = [p for p, sig in current.items() if old.get(p) != sig]
+            changed += [p for p in old if p not in current]
+            self._snapshot = current
+            self.notify(changed)